@@ -0,0 +1,213 @@
+import os
+import gc
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import datetime
+import resource
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+import fastparquet
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+from benchmarks.synthetic_data import create_runs
+
+#########################################################
+# benchmark constants
+#########################################################
+SCALES = [1000000, 10000000, 50000000]
+KEY_COLUMNS = ['Lastname', 'Firstname']
+HASH_MODES = {'md5': mch.HASH_MODE_MD5, 'fast64': mch.HASH_MODE_FAST64, 'fast128': mch.HASH_MODE_FAST128}
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+RSS_SAMPLE_SECONDS = 0.01
+
+
+def _current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ohne /proc nur der Höchststand des Prozesses (ru_maxrss ist unter Linux in KB, unter macOS in Byte)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if platform.system() == 'Darwin' else maxrss * 1024
+
+
+#########################################################
+# measure
+# Input: stage: Name der Stufe
+#        rows: Anzahl verarbeiteter Zeilen (für den Durchsatz)
+#        function: Funktion, die gemessen wird
+# Misst Laufzeit und höchste RSS während function läuft. Die RSS wird in einem Thread alle
+# RSS_SAMPLE_SECONDS abgefragt
+# Output: Tuple (Rückgabe von function, Dictionary mit stage, rows, seconds, rows_per_second, peak_rss_bytes)
+#########################################################
+def measure(stage: str, rows: int, function) -> tuple:
+    gc.collect()
+    peak = [_current_rss()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_SAMPLE_SECONDS):
+            peak[0] = max(peak[0], _current_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        res = function()
+    finally:
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    peak[0] = max(peak[0], _current_rss())
+    stats = {'stage': stage, 'rows': rows, 'seconds': seconds,
+             'rows_per_second': rows / seconds if seconds > 0 else None, 'peak_rss_bytes': peak[0]}
+    print(stage + ': ' + str(rows) + ' rows in ' + format(seconds, '.3f') + ' s, peak RSS ' +
+          str(peak[0] // (1024 * 1024)) + ' MB')
+    return res, stats
+
+
+#########################################################
+# run_benchmark
+# Input: rows: Anzahl Zeilen des Ausgangsbestands
+#        work_dir: Verzeichnis, in das das Dataset geschrieben wird
+#        change_rate, delete_rate, insert_rate, seed: siehe create_runs
+#        hash_mode: Hash-Verfahren (siehe compute_hashes)
+#        compact: Boolean, ob die Metadatenspalten im kompakten Schema angelegt werden
+# Erzeugt zwei synthetische Full Loads und misst die einzelnen Stufen eines Laufs getrennt:
+#   add_meta_columns: Hashen des Folgelaufs
+#   store_write: Schreiben des Ausgangsbestands als Dataset (write_parquet_df, inkl. Hash-Index)
+#   delta: Delta des Folgelaufs gegen den Ausgangsbestand im Speicher (get_delta)
+#   delta_by_index: Delta des Folgelaufs gegen den Hash-Index des Datasets (get_delta_by_index)
+#   store_append: Anhängen des Deltas an das Dataset (append_parquet_df)
+#   scd2_merge: Löscherkennung (get_deleted_by_full_load) und SCD2 Merge (merge_scd2)
+# Output: Liste mit einem Dictionary pro Stufe (siehe measure)
+#########################################################
+def run_benchmark(rows: int, work_dir: str, change_rate: float = 0.1, delete_rate: float = 0.01,
+                  insert_rate: float = 0.01, seed: int = 0, hash_mode: int = mch.HASH_MODE_MD5,
+                  compact: bool = False) -> list:
+    print('Generating ' + str(rows) + ' rows')
+    old_df, new_df = create_runs(rows, change_rate, delete_rate, insert_rate, seed)
+    first_run = mch.create_currents()
+    second_run = mch.create_currents()
+    current_df = mch.add_meta_columns(old_df, first_run, KEY_COLUMNS, hash_mode=hash_mode, compact=compact)
+    del old_df
+
+    res = []
+    new_meta_df, stats = measure('add_meta_columns', len(new_df), lambda: mch.add_meta_columns(
+        new_df, second_run, KEY_COLUMNS, hash_mode=hash_mode, compact=compact))
+    res.append(stats)
+    del new_df
+
+    store_path = os.path.join(work_dir, 'current')
+    partitioning = scd.create_partitioning(bucket_count=16)
+    _, stats = measure('store_write', len(current_df),
+                       lambda: scd.write_parquet_df(current_df, store_path, partitioning=partitioning))
+    res.append(stats)
+    _, stats = measure('delta', len(new_meta_df), lambda: mch.get_delta(current_df, new_meta_df))
+    res.append(stats)
+    delta_df, stats = measure('delta_by_index', len(new_meta_df),
+                              lambda: scd.get_delta_by_index(store_path, new_meta_df))
+    res.append(stats)
+    _, stats = measure('store_append', len(delta_df), lambda: scd.append_parquet_df(delta_df, store_path))
+    res.append(stats)
+    del delta_df
+
+    current_scd2_df = scd.merge_scd2(scd.create_empty_hist_dataframe(current_df), current_df, first_run,
+                                     mch.VALID_FROM_MODE_LOWER_BOUND)
+    del current_df
+
+    def scd2_merge():
+        deleted_keys = scd.get_deleted_by_full_load(current_scd2_df, new_meta_df)
+        return scd.merge_scd2(current_scd2_df, new_meta_df, second_run, mch.VALID_FROM_MODE_LOAD_DATE,
+                              deleted_keys=deleted_keys)
+
+    _, stats = measure('scd2_merge', len(current_scd2_df) + len(new_meta_df), scd2_merge)
+    res.append(stats)
+    return res
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    commit = _git_commit()
+    results = []
+    for rows in args.rows:
+        work_dir = tempfile.mkdtemp(prefix='benchmark-', dir=args.work_dir)
+        try:
+            for stats in run_benchmark(rows, work_dir, args.change_rate, args.delete_rate, args.insert_rate,
+                                       args.seed, HASH_MODES[args.hash_mode], args.compact):
+                stats['scale'] = rows
+                results.append(stats)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, 'benchmark-' + (commit or 'unknown')[:12] + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'commit': commit, 'created': datetime.datetime.now().isoformat(),
+                   'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                   'fastparquet': fastparquet.__version__, 'cpu_count': os.cpu_count(),
+                   'parameters': {'change_rate': args.change_rate, 'delete_rate': args.delete_rate,
+                                  'insert_rate': args.insert_rate, 'seed': args.seed,
+                                  'hash_mode': args.hash_mode, 'compact': args.compact},
+                   'results': results}, file, indent=2)
+    print('Wrote ' + output)
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+    baseline_stats = {(stats['scale'], stats['stage']): stats for stats in baseline['results']}
+    print('scale'.rjust(10) + 'stage'.rjust(18) + 'baseline s'.rjust(12) + 'candidate s'.rjust(13) +
+          'speedup'.rjust(9) + 'rss ratio'.rjust(11))
+    for stats in candidate['results']:
+        base = baseline_stats.get((stats['scale'], stats['stage']))
+        if base is None:
+            continue
+        speedup = base['seconds'] / stats['seconds'] if stats['seconds'] > 0 else float('inf')
+        print(str(stats['scale']).rjust(10) + stats['stage'].rjust(18) + format(base['seconds'], '.3f').rjust(12) +
+              format(stats['seconds'], '.3f').rjust(13) + format(speedup, '.2f').rjust(9) +
+              format(stats['peak_rss_bytes'] / base['peak_rss_bytes'], '.2f').rjust(11))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for hashing, delta detection, SCD2 merge and parquet '
+                                                 'writes on synthetic grades data')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and write the results as JSON')
+    run_parser.add_argument('--rows', type=int, nargs='+', default=SCALES[:1],
+                            help='rows of the initial load, e.g. ' + ' '.join(str(scale) for scale in SCALES))
+    run_parser.add_argument('--change-rate', type=float, default=0.1)
+    run_parser.add_argument('--delete-rate', type=float, default=0.01)
+    run_parser.add_argument('--insert-rate', type=float, default=0.01)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--hash-mode', choices=list(HASH_MODES), default='md5')
+    run_parser.add_argument('--compact', action='store_true')
+    run_parser.add_argument('--work-dir', default=None, help='directory for the temporary datasets')
+    run_parser.add_argument('--output', default=None, help='result file, default benchmarks/results/benchmark-<commit>.json')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    raise SystemExit(args.func(args))
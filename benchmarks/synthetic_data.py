@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+#########################################################
+# synthetic data constants
+#########################################################
+GRADES = np.array(['A+', 'A', 'A-', 'B+', 'B', 'B-', 'C+', 'C', 'C-', 'D+', 'D', 'D-', 'F'], dtype=object)
+TEST_COLUMNS = ['Test1', 'Test2', 'Test3', 'Test4', 'Final']
+FIRSTNAMES_PER_LASTNAME = 1000
+
+
+def _names(ids: np.ndarray) -> tuple:
+    lastname = pd.Series(ids // FIRSTNAMES_PER_LASTNAME).astype(str).radd('Last').to_numpy(dtype=object)
+    firstname = pd.Series(ids % FIRSTNAMES_PER_LASTNAME).astype(str).radd('First').to_numpy(dtype=object)
+    return lastname, firstname
+
+
+def _ssn(ids: np.ndarray) -> np.ndarray:
+    digits = pd.Series(ids % 1000000000).astype(str).str.zfill(9)
+    return (digits.str[:3] + '-' + digits.str[3:5] + '-' + digits.str[5:]).to_numpy(dtype=object)
+
+
+def _grades_values(rng: np.random.Generator, rows: int) -> dict:
+    res = {column: rng.integers(0, 101, rows).astype(np.float64) for column in TEST_COLUMNS}
+    res['Grade'] = GRADES[rng.integers(0, len(GRADES), rows)]
+    return res
+
+
+#########################################################
+# create_grades_df
+# Input: ids: int64 Array mit eindeutigen Schlüsseln
+#        rng: numpy Generator
+# Erzeugt Datensätze im Schema der grades CSVs (Lastname, Firstname, SSN, Test1-4, Final, Grade).
+# Lastname + Firstname ist für jede id eindeutig
+# Output: Dataframe mit einer Zeile pro id
+#########################################################
+def create_grades_df(ids: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+    lastname, firstname = _names(ids)
+    res = pd.DataFrame({'Lastname': lastname, 'Firstname': firstname, 'SSN': _ssn(ids)})
+    for column, values in _grades_values(rng, len(ids)).items():
+        res[column] = values
+    return res[['Lastname', 'Firstname', 'SSN'] + TEST_COLUMNS + ['Grade']]
+
+
+#########################################################
+# create_runs
+# Input: rows: Anzahl Zeilen des ersten Laufs
+#        change_rate: Anteil der Zeilen, deren Werte sich im zweiten Lauf ändern
+#        delete_rate: Anteil der Zeilen, die im zweiten Lauf fehlen
+#        insert_rate: Anteil (bezogen auf rows) neuer Zeilen im zweiten Lauf
+#        seed: Seed des Zufallsgenerators, gleiche Parameter ergeben gleiche Daten
+# Erzeugt zwei Full Loads: den Ausgangsbestand und den Folgelauf mit Änderungen, Löschungen und neuen Zeilen
+# Output: Tuple (old_df, new_df)
+#########################################################
+def create_runs(rows: int, change_rate: float = 0.1, delete_rate: float = 0.01, insert_rate: float = 0.01,
+                seed: int = 0) -> tuple:
+    for name, rate in [('change_rate', change_rate), ('delete_rate', delete_rate), ('insert_rate', insert_rate)]:
+        if rate < 0 or rate > 1:
+            raise ValueError(name + ' must be between 0 and 1')
+    if change_rate + delete_rate > 1:
+        raise ValueError('change_rate + delete_rate must not be greater than 1')
+    rng = np.random.default_rng(seed)
+    old_df = create_grades_df(np.arange(rows, dtype=np.int64), rng)
+
+    order = rng.permutation(rows)
+    deleted = order[:int(rows * delete_rate)]
+    changed = order[len(deleted):len(deleted) + int(rows * change_rate)]
+    keep = np.ones(rows, dtype=bool)
+    keep[deleted] = False
+
+    new_df = old_df.copy()
+    for column, values in _grades_values(rng, len(changed)).items():
+        # ein Test wird um 1 verschoben, damit jede geänderte Zeile sicher einen anderen RECORD_HASH hat
+        if column == TEST_COLUMNS[0]:
+            values = (new_df[column].to_numpy()[changed] + 1) % 101
+        new_df.loc[changed, column] = values
+    inserts = create_grades_df(np.arange(rows, rows + int(rows * insert_rate), dtype=np.int64), rng)
+    new_df = pd.concat([new_df[keep], inserts], ignore_index=True)
+    return old_df, new_df
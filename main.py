@@ -1,39 +1,45 @@
 import os
 import shutil
-import time
 import pandas as pd
-import pandasql as ps
 import src.PandasETLHelpers.MetaColumnHelpers as mch
 import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.HashCacheHelpers as hch
+import src.PandasETLHelpers.LoadHelpers as lh
+import src.PandasETLHelpers.SnapshotHelpers as sh
 
 key_columns = ['Lastname','Firstname']
 current_path = './data/current/current.parquet'
-    
-delta_sql_string = 'select a.* from new_data_df a LEFT JOIN current_df b ON a.KEY_HASH = b.KEY_HASH AND a.RECORD_HASH = b.RECORD_HASH WHERE b.KEY_HASH IS NULL'
-
-def meta_column_historization(file_path):
+scd2_path = './data/current/scd2'
+hash_cache_path = './data/current/hash_cache'
+metrics_path = './data/current/run_metrics.jsonl'
+valid_from_mode = mch.VALID_FROM_MODE_LOWER_BOUND
+chunk_size = None
+use_snapshot = sh.pa is not None
+partitioning = scd.create_partitioning(bucket_count=16, date_column=mch.META_COLUMNS[mch.COL_INSERT_RUN_TS])
+
+def scd2_historization(file_path, full_load=False):
     currents = mch.create_currents()
-    new_data_df = pd.read_csv(file_path)
-    new_data_df = mch.add_meta_columns(new_data_df,currents,key_columns)
-
-    current_df = scd.read_parquet_df(current_path)
-    if current_df is None:
-        current_df = pd.DataFrame(columns=new_data_df.columns)
-    current_df_delta = ps.sqldf(delta_sql_string)
-    current_df = pd.concat([current_df,current_df_delta])
-    current_df.to_parquet(current_path,partition_cols=key_columns,engine='fastparquet')
-
-def simulate_runs(run_data_dict):
-    if os.path.exists(current_path):
-        shutil.rmtree(current_path)
+    new_data_df = hch.add_meta_columns_cached(file_path, hash_cache_path, currents, key_columns,
+                                              **scd.get_record_hash_options(scd.get_active_path(scd2_path)))
+    scd.historize_to_store(new_data_df, scd2_path, currents, valid_from_mode, partitioning=partitioning,
+                           full_load=full_load)
+
+def simulate_runs(run_data_dict, full_load=False):
+    for path in [current_path, scd2_path]:
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    loads = [lh.create_load(run_data_dict[run], current_path) for run in run_data_dict]
+    lh.run_loads(loads, key_columns, partitioning=partitioning, chunk_size=chunk_size, hash_cache_path=hash_cache_path,
+                 snapshot=use_snapshot)
     for run in run_data_dict:
-        meta_column_historization(run_data_dict[run])
-        time.sleep(2)
+        scd2_historization(run_data_dict[run], full_load)
 
-    final_df = scd.read_parquet_df(current_path)
+    final_df = sh.read_snapshot_df(current_path) if use_snapshot else scd.read_parquet_df(current_path)
     return final_df
 
 if __name__ == '__main__':
+    os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+    mch.set_metrics_sink(mch.create_json_lines_sink(metrics_path))
 
     first_run_delta_path = './data/grades_delta_old.csv'
     second_run_delta_path = './data/grades_delta_new.csv'
@@ -51,5 +57,6 @@ if __name__ == '__main__':
         'first_run' : first_run_full_path,
         'second_run' : second_run_full_path
     }
-    full_final_df = simulate_runs(full_run_data_dict)
-    print(delta_final_df)
\ No newline at end of file
+    full_final_df = simulate_runs(full_run_data_dict, full_load=True)
+    print(delta_final_df)
+    print(scd.read_scd2_dataset(scd2_path))
\ No newline at end of file
@@ -0,0 +1,250 @@
+from src.PandasETLHelpers.SCDHelpers import *
+from src.PandasETLHelpers.SCDHelpers import _new_file_name
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+#########################################################
+# arrow constants
+#########################################################
+BACKEND_PANDAS = 'pandas'
+BACKEND_ARROW = 'arrow'
+
+ARROW_POSITION_COLUMN = '__position'
+
+
+def _check_arrow():
+    if pa is None:
+        raise ImportError('The arrow backend needs pyarrow (pip install pyarrow)')
+
+
+def _to_pandas(table) -> pd.DataFrame:
+    # Strings wie bei pd.read_csv und read_parquet_df als str dtype (fehlende Werte NaN statt None)
+    string_dtype = pd.StringDtype(na_value=np.nan)
+    return table.to_pandas(split_blocks=True, types_mapper={pa.string(): string_dtype,
+                                                            pa.large_string(): string_dtype}.get)
+
+
+#########################################################
+# read_csv_table
+# Input: path: Pfad der Quelldatei (CSV)
+#        convert_options: Dictionary mit Parametern für pyarrow.csv.ConvertOptions (z.B. column_types)
+#        columns: Liste mit Spalten, die gelesen werden. None liest alle
+# Liest eine CSV mit dem Arrow-Reader als Arrow-Tabelle. Spalten, die Arrow als Datum oder Zeit erkennen würde,
+# werden als String gelesen und leere Strings als Nullwert, da pandas sie so liest und die Hashes sonst von denen
+# des pandas-Backends abweichen würden.
+# Output: Arrow-Tabelle
+#########################################################
+def read_csv_table(path: str, convert_options: dict = None, columns: list = None):
+    _check_arrow()
+    convert_options = dict(convert_options or {})
+    convert_options.setdefault('strings_can_be_null', True)
+    if columns is not None:
+        convert_options['include_columns'] = list(columns)
+    with measure_stage(STAGE_READ, 'read_csv_table', source=path) as metrics:
+        res = pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(**convert_options))
+        column_types = dict(convert_options.get('column_types') or {})
+        temporal = [field.name for field in res.schema if pa.types.is_temporal(field.type)
+                    and field.name not in column_types]
+        if temporal:
+            column_types.update({column: pa.string() for column in temporal})
+            convert_options['column_types'] = column_types
+            res = pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(**convert_options))
+        if columns is not None:
+            res = res.select([column for column in res.column_names if column in columns])
+        metrics[METRIC_ROWS_OUT] = res.num_rows
+        metrics[METRIC_BYTES_READ] = os.path.getsize(path)
+    return res
+
+
+#########################################################
+# compute_table_hashes
+# Input: table: Arrow-Tabelle
+#        hash_columns, hash_mode, as_pairs: siehe compute_hashes
+# Wie compute_hashes für eine Arrow-Tabelle. Nur die gehashten Spalten werden an compute_hashes übergeben, ohne
+# Zusammenlegen in Blöcke (split_blocks): Zahlenspalten ohne Nullwerte werden dabei nicht kopiert. Die Hashes
+# sind identisch zu denen des pandas-Backends.
+# Output: siehe compute_hashes
+#########################################################
+def compute_table_hashes(table, hash_columns: dict, hash_mode: int = HASH_MODE_MD5, as_pairs: bool = False) -> dict:
+    _check_arrow()
+    columns = list(dict.fromkeys(column for hash_column in hash_columns.values() for column in hash_column))
+    df = _to_pandas(table.select(columns))
+    return compute_hashes(df, hash_columns, hash_mode, as_pairs=as_pairs)
+
+
+def _hash_array(values, hash_mode: int):
+    if hash_mode == HASH_MODE_FAST64:
+        return pa.array(values, type=pa.uint64())
+    if hash_mode == HASH_MODE_FAST128:
+        return pa.array(values, type=pa.binary())
+    return pa.array(values, type=pa.string())
+
+
+#########################################################
+# add_meta_columns_table
+# Input: table: Arrow-Tabelle, an die die Metadatenspalten angefügt werden sollen
+#        currents, key_columns, record_hash_exclude_columns, hash_mode, compact, record_hash_defaults,
+#        record_hash_dtypes: siehe add_meta_columns
+# Wie add_meta_columns für eine Arrow-Tabelle. Die bestehenden Spalten werden nicht kopiert, die Metadatenspalten
+# haben dieselben Typen wie beim pandas-Backend, damit beide Backends in dasselbe Dataset schreiben können.
+# Output: Arrow-Tabelle mit angefügten Metadatenspalten
+#########################################################
+def add_meta_columns_table(table, currents: dict, key_columns: list, record_hash_exclude_columns: list = None,
+                           hash_mode: int = HASH_MODE_MD5, compact: bool = False, record_hash_defaults: dict = None,
+                           record_hash_dtypes: dict = None):
+    _check_arrow()
+    record_columns = get_record_hash_columns(table.column_names, record_hash_exclude_columns)
+    rows = table.num_rows
+    with measure_stage(STAGE_HASH, 'add_meta_columns_table', currents.get(CURRENT_RUN_ID), rows,
+                       key_columns=list(key_columns), record_columns=record_columns, hash_mode=hash_mode) as metrics:
+        if record_hash_defaults or record_hash_dtypes:
+            df = _to_pandas(table.select(list(dict.fromkeys(list(key_columns) + record_columns))))
+            hashes = compute_meta_hashes(df, key_columns, record_columns, hash_mode, compact, record_hash_defaults,
+                                         record_hash_dtypes)
+        else:
+            hashes = compute_table_hashes(table, {META_COLUMNS[COL_KEY_HASH]: key_columns,
+                                                  META_COLUMNS[COL_RECORD_HASH]: record_columns}, hash_mode, compact)
+        res = table
+        for column in COMPACT_HASH_COLUMNS:
+            name = META_COLUMNS[column]
+            if compact:
+                res = res.append_column(name + HASH_HIGH_SUFFIX, pa.array(hashes[name][0], type=pa.uint64()))
+                res = res.append_column(name + HASH_LOW_SUFFIX, pa.array(hashes[name][1], type=pa.uint64()))
+            else:
+                res = res.append_column(name, _hash_array(hashes[name], hash_mode))
+        run_ts = np.full(rows, np.datetime64(pd.to_datetime(currents[CURRENT_RUN_TS]), 'us'))
+        res = res.append_column(META_COLUMNS[COL_INSERT_RUN_TS], pa.array(run_ts))
+        res = res.append_column(META_COLUMNS[COL_UPDATE_RUN_TS], pa.array(run_ts))
+        if compact:
+            run_id = pa.array(np.full(rows, run_id_to_int(currents[CURRENT_RUN_ID]), dtype=np.int64))
+        else:
+            run_id = pa.array([currents[CURRENT_RUN_ID]] * rows, type=pa.string())
+        res = res.append_column(META_COLUMNS[COL_INSERT_RUN_ID], run_id)
+        res = res.append_column(META_COLUMNS[COL_UPDATE_RUN_ID], run_id)
+        res = res.append_column(META_COLUMNS[COL_DELETED], pa.nulls(rows, pa.timestamp('ns')))
+        metrics[METRIC_ROWS_OUT] = res.num_rows
+    return res
+
+
+#########################################################
+# get_table_hash_pair
+# Input: table: Arrow-Tabelle mit Hash-Spalten (bisheriges oder kompaktes Schema)
+#        column: COL_KEY_HASH oder COL_RECORD_HASH
+# Wie get_hash_pair für eine Arrow-Tabelle. Im kompakten Schema werden die Puffer ohne Kopie übernommen
+# Output: Tuple (high, low) mit uint64 Arrays
+#########################################################
+def get_table_hash_pair(table, column: int) -> tuple:
+    name = META_COLUMNS[column]
+    if name not in table.column_names and name + HASH_HIGH_SUFFIX in table.column_names:
+        return (table[name + HASH_HIGH_SUFFIX].to_numpy(), table[name + HASH_LOW_SUFFIX].to_numpy())
+    return hash_to_uint64_pair(table[name].to_numpy(zero_copy_only=False))
+
+
+def _pair_table(key: tuple, record: tuple, positions: bool = False):
+    columns = {INDEX_KEY_HASH_HIGH: key[0], INDEX_KEY_HASH_LOW: key[1],
+               INDEX_RECORD_HASH_HIGH: record[0], INDEX_RECORD_HASH_LOW: record[1]}
+    if positions:
+        columns[ARROW_POSITION_COLUMN] = np.arange(len(key[0]), dtype=np.int64)
+    return pa.table({name: pa.array(values) for name, values in columns.items()})
+
+
+#########################################################
+# get_delta_table
+# Input: path: Pfad des Datasets mit dem aktuellen Datenbestand
+#        table: Arrow-Tabelle mit META_COLUMNS (aus add_meta_columns_table)
+# Wie get_delta_by_index: liest vom Datenbestand nur den Hash-Index (bei Buckets nur die Buckets aus table).
+# Das Delta ist ein Left-Anti-Join über Key- und Record-Hash mit Arrow: Zeilen ohne identischen Eintrag im Index
+# sind Inserts oder Updates. Die Reihenfolge von table bleibt erhalten.
+# Output: Arrow-Tabelle mit den Inserts und Updates aus table
+#########################################################
+def get_delta_table(path: str, table):
+    _check_arrow()
+    with measure_stage(STAGE_DELTA, 'get_delta_table', rows_in=table.num_rows, path=path) as metrics:
+        new_key = get_table_hash_pair(table, COL_KEY_HASH)
+        new_record = get_table_hash_pair(table, COL_RECORD_HASH)
+        buckets = None
+        manifest = read_manifest(path)
+        if manifest is not None and manifest['partitioning'] is not None and manifest['partitioning']['bucket_count']:
+            buckets = np.unique(get_key_buckets(new_key[0], manifest['partitioning'])).tolist()
+        index_df = read_hash_index(path, columns=INDEX_COLUMNS[:4], buckets=buckets)
+        if index_df is None:
+            res = table
+        else:
+            current = pa.Table.from_pandas(index_df[INDEX_COLUMNS[:4]], preserve_index=False)
+            delta = _pair_table(new_key, new_record, positions=True).join(current, keys=INDEX_COLUMNS[:4],
+                                                                          join_type='left anti')
+            res = table.take(pa.array(np.sort(delta[ARROW_POSITION_COLUMN].to_numpy())))
+        metrics[METRIC_ROWS_OUT] = res.num_rows
+    return res
+
+
+#########################################################
+# write_table_files
+# Input: table: Arrow-Tabelle mit META_COLUMNS
+#        path: Pfad des Datasets
+#        partitioning: Dictionary aus create_partitioning
+# Wie write_data_files, die Dateien werden aber direkt mit pyarrow.parquet aus der Tabelle geschrieben. Für
+# Partitionen und Hash-Index werden nur die Hash-Spalten und die Partitionsspalten nach pandas übernommen.
+# Ohne Dictionary-Encoding, da fastparquet Strings aus Dictionary-Seiten als object statt als str dtype liest.
+# Output: siehe write_data_files
+#########################################################
+def write_table_files(table, path: str, partitioning: dict = None):
+    _check_arrow()
+    key_columns = [column for column in HASH_COLUMN_NAMES if column in table.column_names]
+    if partitioning is not None:
+        key_columns.extend([partitioning['date_column']] if partitioning['date_column'] else [])
+        key_columns.extend(partitioning['partition_cols'])
+    key_df = _to_pandas(table.select(list(dict.fromkeys(key_columns))))
+
+    def write_file(positions: np.ndarray, file_path: str):
+        pq.write_table(table.take(pa.array(positions)), file_path, use_dictionary=False)
+
+    dtypes = _to_pandas(table.schema.empty_table()).dtypes.to_dict()
+    return write_data_files(key_df, path, partitioning, write_file, dtypes)
+
+
+#########################################################
+# append_table
+# Input: table: Arrow-Tabelle mit den neuen Datensätzen
+#        path: Pfad des Datasets
+#        partitioning: Dictionary aus create_partitioning. None übernimmt die Partitionierung des Datasets
+# Wie append_parquet_df für eine Arrow-Tabelle
+# Output: Dictionary mit dem neuen Manifest
+#########################################################
+def append_table(table, path: str, partitioning: dict = None) -> dict:
+    partitioning = get_store_partitioning(path, partitioning)
+    if table.num_rows == 0:
+        return read_manifest(path)
+    entries, index_df = write_table_files(table, path, partitioning)
+    segment = write_hash_index_segment(path, index_df, _new_file_name('index'))
+    return commit_appended_files(path, partitioning, entries, [segment])
+
+
+#########################################################
+# append_delta_table
+# Input: table: Arrow-Tabelle mit META_COLUMNS (aus add_meta_columns_table)
+#        path: Pfad des Datasets mit dem aktuellen Datenbestand
+#        partitioning: Dictionary aus create_partitioning. None übernimmt die Partitionierung des Datasets
+# get_delta_table + append_table ohne Umweg über ein Dataframe
+# Output: Dictionary mit der Anzahl gelesener (rows) und geschriebener (delta_rows) Datensätze
+#########################################################
+def append_delta_table(table, path: str, partitioning: dict = None) -> dict:
+    partitioning = get_store_partitioning(path, partitioning)
+    delta = get_delta_table(path, table)
+    append_table(delta, path, partitioning)
+    return {'rows': table.num_rows, 'delta_rows': delta.num_rows}
+
+
+#########################################################
+# table_to_df
+# Input: table: Arrow-Tabelle
+# Übergabe an die pandas-API (z.B. historize_to_store). Die dtypes entsprechen denen von read_parquet_df
+# Output: Dataframe
+#########################################################
+def table_to_df(table) -> pd.DataFrame:
+    _check_arrow()
+    return _to_pandas(table)
@@ -0,0 +1,274 @@
+import os
+import uuid
+from src.PandasETLHelpers.SCDHelpers import *
+from src.PandasETLHelpers.SCDHelpers import _concat_hash_index, _get_filter_mask
+
+#########################################################
+# as-of constants
+#########################################################
+INTERVAL_ROW_GROUP = 'ROW_GROUP'
+INTERVAL_INDEX_COLUMNS = [INDEX_KEY_HASH_HIGH, INDEX_KEY_HASH_LOW, META_COLUMNS[COL_VALID_FROM],
+                          META_COLUMNS[COL_VALID_TO], INTERVAL_ROW_GROUP, INDEX_FILE]
+AS_OF_SUFFIX = '_dim'
+
+
+def _get_interval_segment(path: str, file_name: str) -> str:
+    return os.path.join(path, INTERVAL_INDEX_DIR, file_name)
+
+
+def _with_file(df: pd.DataFrame, file_name: str) -> pd.DataFrame:
+    categories = [] if file_name is None else [file_name]
+    df[INDEX_FILE] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), categories=categories)
+    return df
+
+
+def _create_interval_index(key_high: np.ndarray, key_low: np.ndarray, valid_from, valid_to,
+                           row_group: int) -> pd.DataFrame:
+    return pd.DataFrame({INDEX_KEY_HASH_HIGH: key_high, INDEX_KEY_HASH_LOW: key_low,
+                         META_COLUMNS[COL_VALID_FROM]: pd.to_datetime(pd.Series(valid_from)).to_numpy(),
+                         META_COLUMNS[COL_VALID_TO]: pd.to_datetime(pd.Series(valid_to)).to_numpy(),
+                         INTERVAL_ROW_GROUP: np.full(len(key_high), row_group, dtype=np.int32)})
+
+
+#########################################################
+# build_interval_index
+# Input: path: Pfad eines Datasets mit SCD2 Versionen (siehe get_active_path / get_history_path)
+#        file_name: Pfad der Datei relativ zu path
+# Liest von der Datei pro Row Group nur den Key-Hash, VALID_FROM und VALID_TO und schreibt die Gültigkeitsintervalle
+# als Segment unter INTERVAL_INDEX_DIR (mit demselben relativen Pfad wie die Datei). Dateien werden im Dataset nie
+# verändert, ein Segment bleibt also gültig, bis vacuum_store die Datei löscht.
+# Output: Dataframe mit INTERVAL_INDEX_COLUMNS
+#########################################################
+def build_interval_index(path: str, file_name: str) -> pd.DataFrame:
+    valid_columns = [META_COLUMNS[COL_VALID_FROM], META_COLUMNS[COL_VALID_TO]]
+    parquet_file = fastparquet.ParquetFile(os.path.join(path, file_name))
+    missing = [column for column in valid_columns if column not in parquet_file.columns]
+    if missing:
+        raise ValueError(file_name + ' has no column ' + str(missing) + '. The interval index needs SCD2 versions')
+    columns = [column for column in parquet_file.columns if column in HASH_COLUMN_NAMES
+               and column.startswith(META_COLUMNS[COL_KEY_HASH])] + valid_columns
+    parts = [_create_interval_index(*hash_to_uint64_pair([]), [], [], 0)]
+    for row_group, df in enumerate(parquet_file.iter_row_groups(columns=columns, index=False)):
+        key_high, key_low = get_hash_pair(df, COL_KEY_HASH)
+        parts.append(_create_interval_index(key_high, key_low, df[valid_columns[0]], df[valid_columns[1]], row_group))
+    res = pd.concat(parts, ignore_index=True)
+
+    segment = _get_interval_segment(path, file_name)
+    os.makedirs(os.path.dirname(segment), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(segment), '.' + uuid.uuid4().hex + '.tmp')
+    try:
+        res.to_parquet(tmp_path, engine=PARQUET_ENGINE, index=False)
+        os.replace(tmp_path, segment)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return _with_file(res, file_name)
+
+
+#########################################################
+# read_interval_index
+# Input: path: Pfad eines Datasets mit SCD2 Versionen
+#        key_hashes: Key-Hashes (siehe read_parquet_df), auf die der Index beschränkt wird. None für alle Keys
+#        as_of: Stichtag. Es bleiben nur Intervalle, die an diesem Tag gültig sind. None für alle Intervalle
+# Der Intervall-Index hält pro Version Key-Hash, VALID_FROM, VALID_TO, Datei und Row Group. Gelesen werden nur
+# die Segmente der Dateien, die select_store_files für key_hashes auswählt. Fehlende Segmente (z.B. für Dateien,
+# die seit der letzten Abfrage geschrieben wurden) werden über build_interval_index angelegt.
+# Output: Dataframe mit INTERVAL_INDEX_COLUMNS oder None, wenn am Pfad keine Daten liegen
+#########################################################
+def read_interval_index(path: str, key_hashes=None, as_of=None):
+    key_pair = get_key_pair(key_hashes)
+    files = select_store_files(path, key_pair=key_pair)
+    if files is None:
+        return None
+    parts = []
+    for file_name in files:
+        segment = _get_interval_segment(path, file_name)
+        if os.path.exists(segment):
+            part = _with_file(pd.read_parquet(segment, engine=PARQUET_ENGINE), file_name)
+        else:
+            part = build_interval_index(path, file_name)
+        mask = np.ones(len(part), dtype=bool)
+        if key_pair is not None:
+            mask &= isin_hash_pairs(part[INDEX_KEY_HASH_HIGH].to_numpy(), part[INDEX_KEY_HASH_LOW].to_numpy(),
+                                    key_pair[0], key_pair[1])
+        if as_of is not None:
+            mask &= _get_filter_mask(part, [filter_as_of(as_of)])
+        parts.append(part[mask] if not mask.all() else part)
+    if len(parts) == 0:
+        return _with_file(_create_interval_index(*hash_to_uint64_pair([]), [], [], 0), None)
+    return _concat_hash_index(parts)
+
+
+def _get_row_groups(intervals: pd.DataFrame) -> dict:
+    res = {}
+    for file_name, row_group in set(zip(intervals[INDEX_FILE], intervals[INTERVAL_ROW_GROUP])):
+        res.setdefault(file_name, []).append(int(row_group))
+    return res
+
+
+def _read_versions(base_path: str, columns: list, filters: list, key_hashes, as_of) -> pd.DataFrame:
+    key_pair = get_key_pair(key_hashes)
+    parts = []
+    for path in [get_history_path(base_path), get_active_path(base_path)]:
+        if key_pair is None:
+            part = read_parquet_df(path, columns, filters)
+        else:
+            intervals = read_interval_index(path, key_pair, as_of)
+            if intervals is None or len(intervals) == 0:
+                continue
+            row_groups = _get_row_groups(intervals)
+            part = read_store_files(path, sorted(row_groups), columns, filters, key_pair, row_groups)
+        if part is not None and len(part) > 0:
+            parts.append(part)
+    if len(parts) == 0:
+        return None
+    return pd.concat(parts, ignore_index=True)
+
+
+#########################################################
+# read_as_of
+# Input: base_path: Pfad des SCD2 Datasets (siehe historize_to_store)
+#        as_of: Stichtag als String oder Timestamp
+#        columns: Liste mit Spalten, die gelesen werden sollen. None liest alle
+#        key_hashes: Key-Hashes (siehe read_parquet_df), auf die die Abfrage beschränkt wird. None für alle Keys
+# Stand aller Keys am Stichtag: pro Key die Version mit VALID_FROM <= as_of <= VALID_TO aus Historie und aktiven
+# Versionen. Ohne key_hashes werden über filter_as_of die Row Groups übersprungen, deren min/max VALID_FROM bzw.
+# VALID_TO den Stichtag ausschließen. Mit key_hashes werden über den Intervall-Index nur die Row Groups gelesen,
+# in denen die am Stichtag gültigen Versionen der Keys liegen.
+# Output: Dataframe oder None, wenn keine Version gültig ist
+#########################################################
+def read_as_of(base_path: str, as_of, columns: list = None, key_hashes=None):
+    return _read_versions(base_path, columns, [filter_as_of(as_of)], key_hashes, as_of)
+
+
+#########################################################
+# read_key_history
+# Input: base_path: Pfad des SCD2 Datasets
+#        key_hashes: Key-Hashes (siehe read_parquet_df) der Keys, deren Versionen gelesen werden
+#        columns: Liste mit Spalten, die gelesen werden sollen. None liest alle
+# Alle Versionen der Keys aus Historie und aktiven Versionen. Gelesen werden nur die Row Groups, die der
+# Intervall-Index für die Keys liefert.
+# Output: Dataframe, sortiert nach VALID_FROM, oder None, wenn die Keys nicht vorkommen
+#########################################################
+def read_key_history(base_path: str, key_hashes, columns: list = None):
+    res = _read_versions(base_path, columns, None, key_hashes, None)
+    if res is not None and META_COLUMNS[COL_VALID_FROM] in res.columns:
+        res = res.sort_values(META_COLUMNS[COL_VALID_FROM], kind='stable', ignore_index=True)
+    return res
+
+
+def _get_fact_key_pair(fact_df: pd.DataFrame, key_columns: list, hash_mode: int) -> tuple:
+    if key_columns is None:
+        return get_hash_pair(fact_df, COL_KEY_HASH)
+    name = META_COLUMNS[COL_KEY_HASH]
+    return compute_hashes(fact_df, {name: key_columns}, hash_mode, as_pairs=True)[name]
+
+
+#########################################################
+# match_as_of
+# Input: key_pair: Tuple (high, low) mit den Key-Hashes der Fakten
+#        dates: Stichtage der Fakten (Series oder Array mit Datumswerten, NaT ergibt keinen Treffer)
+#        dim_key_pair: Tuple (high, low) mit den Key-Hashes der Versionen
+#        valid_from, valid_to: VALID_FROM und VALID_TO der Versionen
+# Ordnet jedem Fakt die Version seines Keys zu, die am Stichtag gültig ist. Die Keys werden über lookup_hash_pairs
+# auf Ganzzahlen abgebildet, die Zuordnung ist ein pd.merge_asof über VALID_FROM je Key mit anschließender Prüfung
+# von VALID_TO. Leere Intervalle (VALID_TO < VALID_FROM, z.B. bei zwei Änderungen am selben Tag, siehe
+# merge_scd2_classes) werden ignoriert.
+# Output: Array mit der Position der Version pro Fakt, -1 wenn keine Version gültig ist
+#########################################################
+def match_as_of(key_pair: tuple, dates, dim_key_pair: tuple, valid_from, valid_to) -> np.ndarray:
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize().to_numpy()
+    valid_from = pd.to_datetime(pd.Series(valid_from)).to_numpy()
+    valid_to = pd.to_datetime(pd.Series(valid_to)).to_numpy()
+    res = np.full(len(dates), -1, dtype=np.int64)
+
+    dim_ids = lookup_hash_pairs(dim_key_pair[0], dim_key_pair[1], dim_key_pair[0], dim_key_pair[1])
+    fact_ids = lookup_hash_pairs(key_pair[0], key_pair[1], dim_key_pair[0], dim_key_pair[1])
+    facts = np.flatnonzero((fact_ids >= 0) & ~np.isnat(dates))
+    versions = np.flatnonzero(valid_to >= valid_from)
+    if len(facts) == 0 or len(versions) == 0:
+        return res
+
+    left = pd.DataFrame({'key': fact_ids[facts], 'date': dates[facts], 'fact': facts}).sort_values('date', kind='stable')
+    right = pd.DataFrame({'key': dim_ids[versions], 'date': valid_from[versions].astype(dates.dtype),
+                          'version': versions}).sort_values('date', kind='stable')
+    matched = pd.merge_asof(left, right, on='date', by='key', direction='backward')
+    found = matched['version'].notna().to_numpy()
+    fact_positions = matched['fact'].to_numpy()[found]
+    version_positions = matched['version'].to_numpy()[found].astype(np.int64)
+    valid = valid_to[version_positions] >= matched['date'].to_numpy()[found]
+    res[fact_positions[valid]] = version_positions[valid]
+    return res
+
+
+#########################################################
+# as_of_join
+# Input: fact_df: Dataframe mit den Fakten
+#        dim_df: Dataframe mit SCD2 Versionen der Dimension (z.B. aus read_key_history oder read_scd2_dataset)
+#        date_column: Spalte von fact_df mit dem Stichtag pro Fakt
+#        key_columns: Liste mit den Key-Spalten der Dimension in fact_df. Der Key-Hash wird daraus wie in
+#                     add_meta_columns berechnet. None nimmt den KEY_HASH aus fact_df
+#        hash_mode: hash_mode der Dimension (siehe compute_hashes)
+#        columns: Liste mit Spalten aus dim_df, die angefügt werden. None nimmt alle
+#        suffix: Suffix für Spalten aus dim_df, die es in fact_df schon gibt
+# Vektorisierter As-of-Join (siehe match_as_of): jedem Fakt werden die Spalten der Version angefügt, die an seinem
+# Stichtag gültig war. Fakten ohne gültige Version bleiben erhalten (Left Join), die Spalten sind dann leer.
+# Output: Dataframe mit Index und Zeilenreihenfolge von fact_df
+#########################################################
+def as_of_join(fact_df: pd.DataFrame, dim_df: pd.DataFrame, date_column: str, key_columns: list = None,
+               hash_mode: int = HASH_MODE_MD5, columns: list = None, suffix: str = AS_OF_SUFFIX) -> pd.DataFrame:
+    return _as_of_join(fact_df, _get_fact_key_pair(fact_df, key_columns, hash_mode), dim_df, date_column, columns,
+                       suffix)
+
+
+def _as_of_join(fact_df: pd.DataFrame, key_pair: tuple, dim_df: pd.DataFrame, date_column: str, columns: list,
+                suffix: str) -> pd.DataFrame:
+    with measure_stage(STAGE_MERGE, 'as_of_join', rows_in=len(fact_df), dim_rows=len(dim_df)) as metrics:
+        positions = match_as_of(key_pair, fact_df[date_column], get_hash_pair(dim_df, COL_KEY_HASH),
+                                dim_df[META_COLUMNS[COL_VALID_FROM]], dim_df[META_COLUMNS[COL_VALID_TO]])
+        dim_part = dim_df[list(dim_df.columns) if columns is None else columns].reset_index(drop=True)
+        dim_part = dim_part.reindex(positions).set_axis(fact_df.index, axis=0)
+        dim_part.columns = [column + suffix if column in fact_df.columns else column for column in dim_part.columns]
+        res = pd.concat([fact_df, dim_part], axis=1)
+        metrics[METRIC_ROWS_OUT] = int((positions >= 0).sum())
+    return res
+
+
+#########################################################
+# as_of_join_store
+# Input: fact_df, date_column, key_columns, hash_mode, columns, suffix: siehe as_of_join
+#        base_path: Pfad des SCD2 Datasets der Dimension
+# As-of-Join gegen ein SCD2 Dataset. Die Fakten werden zuerst gegen den Intervall-Index der Keys aus fact_df
+# abgeglichen, gelesen werden danach nur die Row Groups mit den Versionen, die einem Fakt zugeordnet sind.
+# Output: Dataframe mit Index und Zeilenreihenfolge von fact_df
+#########################################################
+def as_of_join_store(fact_df: pd.DataFrame, base_path: str, date_column: str, key_columns: list = None,
+                     hash_mode: int = HASH_MODE_MD5, columns: list = None, suffix: str = AS_OF_SUFFIX) -> pd.DataFrame:
+    key_pair = _get_fact_key_pair(fact_df, key_columns, hash_mode)
+    valid_columns = [META_COLUMNS[COL_VALID_FROM], META_COLUMNS[COL_VALID_TO]]
+    parts = []
+    for path in [get_history_path(base_path), get_active_path(base_path)]:
+        intervals = read_interval_index(path, key_pair)
+        if intervals is None or len(intervals) == 0:
+            continue
+        positions = match_as_of(key_pair, fact_df[date_column],
+                                (intervals[INDEX_KEY_HASH_HIGH].to_numpy(), intervals[INDEX_KEY_HASH_LOW].to_numpy()),
+                                intervals[valid_columns[0]], intervals[valid_columns[1]])
+        used = intervals.iloc[np.unique(positions[positions >= 0])]
+        if len(used) == 0:
+            continue
+        row_groups = _get_row_groups(used)
+        files = sorted(row_groups)
+        read_columns = None
+        if columns is not None:
+            stored = fastparquet.ParquetFile(os.path.join(path, files[0])).columns
+            key_hash_columns = [column for column in stored if column in HASH_COLUMN_NAMES
+                                and column.startswith(META_COLUMNS[COL_KEY_HASH])]
+            read_columns = list(dict.fromkeys(list(columns) + key_hash_columns + valid_columns))
+        used_keys = (used[INDEX_KEY_HASH_HIGH].to_numpy(), used[INDEX_KEY_HASH_LOW].to_numpy())
+        parts.append(read_store_files(path, files, read_columns, None, used_keys, row_groups))
+    if len(parts) == 0:
+        dim_df = pd.DataFrame({column: [] for column in [META_COLUMNS[COL_KEY_HASH]] + valid_columns + (columns or [])})
+    else:
+        dim_df = pd.concat(parts, ignore_index=True)
+    return _as_of_join(fact_df, key_pair, dim_df, date_column, columns, suffix)
@@ -0,0 +1,370 @@
+import os
+import json
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.PandasETLHelpers.LoadHelpers import *
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+#########################################################
+# batch constants
+#########################################################
+TABLE_NAME = 'name'
+TABLE_SOURCE = 'source'
+TABLE_TARGET = 'target'
+TABLE_KEY_COLUMNS = 'key_columns'
+TABLE_EXCLUDE_COLUMNS = 'record_hash_exclude_columns'
+TABLE_LOAD_TYPE = 'load_type'
+TABLE_HISTORIZATION = 'historization'
+TABLE_VALID_FROM_MODE = 'valid_from_mode'
+TABLE_VALID_FROM_DATE = 'valid_from_date'
+TABLE_HASH_MODE = 'hash_mode'
+TABLE_COMPACT = 'compact'
+TABLE_PARTITIONING = 'partitioning'
+TABLE_READ_OPTIONS = 'read_options'
+
+LOAD_TYPE_DELTA = 'delta'
+LOAD_TYPE_FULL = 'full'
+HISTORIZATION_CURRENT = 'current'
+HISTORIZATION_SCD2 = 'scd2'
+
+VALID_FROM_MODE_NAMES = {'lower_bound': VALID_FROM_MODE_LOWER_BOUND, 'load_date': VALID_FROM_MODE_LOAD_DATE,
+                         'custom': VALID_FROM_MODE_CUSTOM}
+HASH_MODE_NAMES = {'md5': HASH_MODE_MD5, 'fast64': HASH_MODE_FAST64, 'fast128': HASH_MODE_FAST128}
+
+CONFIG_SUFFIXES = ('.json', '.yaml', '.yml')
+BATCH_MEMORY_FRACTION = 0.75
+TABLE_MEMORY_FACTOR = 4
+TABLE_SAMPLE_ROWS = 10000
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+TABLE_MAX_RSS_BYTES = 'max_rss_bytes'
+
+
+def _resolve_name(value, names: dict, parameter: str):
+    if isinstance(value, str):
+        if value.lower() not in names:
+            raise ValueError(parameter + ' must be one of ' + str(list(names)) + ', got ' + value)
+        return names[value.lower()]
+    if value not in names.values():
+        raise ValueError(parameter + ' must be one of ' + str(list(names)) + ', got ' + str(value))
+    return value
+
+
+#########################################################
+# create_table
+# Input: name: eindeutiger Name der Tabelle im Batch
+#        source: Pfad der Quelldatei (CSV)
+#        target: Pfad des Datasets (HISTORIZATION_CURRENT) bzw. des SCD2 Datasets (HISTORIZATION_SCD2)
+#        key_columns: Liste mit den Key-Spalten
+#        record_hash_exclude_columns: Liste mit Spalten, die nicht im Record gehasht werden sollen
+#        load_type: LOAD_TYPE_DELTA oder LOAD_TYPE_FULL. Bei einem Full Load werden fehlende Keys in der
+#                   Historie als gelöscht abgeschlossen. Ein Dataset mit aktuellem Stand ist ein reines
+#                   Append-Dataset, dort hat load_type keine Auswirkung
+#        historization: HISTORIZATION_CURRENT (Delta an den aktuellen Stand anhängen, siehe append_delta_chunks)
+#                       oder HISTORIZATION_SCD2 (siehe historize_to_store)
+#        valid_from_mode: VALID_FROM_MODE_* oder dessen Name aus VALID_FROM_MODE_NAMES (z.B. 'load_date')
+#        valid_from_date: Datum für VALID_FROM_MODE_CUSTOM
+#        hash_mode: HASH_MODE_* oder dessen Name aus HASH_MODE_NAMES (z.B. 'fast64')
+#        compact: Boolean, ob die Metadatenspalten im kompakten Schema geschrieben werden (siehe add_meta_columns)
+#        partitioning: Dictionary mit den Parametern von create_partitioning für neue Datasets
+#        read_options: Dictionary mit weiteren Parametern für pd.read_csv (z.B. dtype)
+# Beschreibt eine Tabelle für run_tables. Die Namen in VALID_FROM_MODE_NAMES und HASH_MODE_NAMES erlauben
+# Konfigurationsdateien ohne die Integer-Konstanten.
+# Output: Dictionary mit der Konfiguration der Tabelle
+#########################################################
+def create_table(name: str, source: str, target: str, key_columns: list, record_hash_exclude_columns: list = None,
+                 load_type: str = LOAD_TYPE_DELTA, historization: str = HISTORIZATION_SCD2,
+                 valid_from_mode=VALID_FROM_MODE_LOWER_BOUND, valid_from_date: str = None,
+                 hash_mode=HASH_MODE_MD5, compact: bool = False, partitioning: dict = None,
+                 read_options: dict = None) -> dict:
+    if load_type not in (LOAD_TYPE_DELTA, LOAD_TYPE_FULL):
+        raise ValueError('load_type of ' + name + ' must be one of LOAD_TYPE_DELTA, LOAD_TYPE_FULL')
+    if historization not in (HISTORIZATION_CURRENT, HISTORIZATION_SCD2):
+        raise ValueError('historization of ' + name + ' must be one of HISTORIZATION_CURRENT, HISTORIZATION_SCD2')
+    if not key_columns:
+        raise ValueError('key_columns of ' + name + ' must not be empty')
+    valid_from_mode = _resolve_name(valid_from_mode, VALID_FROM_MODE_NAMES, 'valid_from_mode of ' + name)
+    if valid_from_mode == VALID_FROM_MODE_CUSTOM and valid_from_date is None:
+        raise ValueError('valid_from_date of ' + name + ' is needed for VALID_FROM_MODE_CUSTOM')
+    return {TABLE_NAME: name, TABLE_SOURCE: source, TABLE_TARGET: target, TABLE_KEY_COLUMNS: list(key_columns),
+            TABLE_EXCLUDE_COLUMNS: list(record_hash_exclude_columns or []), TABLE_LOAD_TYPE: load_type,
+            TABLE_HISTORIZATION: historization, TABLE_VALID_FROM_MODE: valid_from_mode,
+            TABLE_VALID_FROM_DATE: valid_from_date,
+            TABLE_HASH_MODE: _resolve_name(hash_mode, HASH_MODE_NAMES, 'hash_mode of ' + name),
+            TABLE_COMPACT: bool(compact),
+            TABLE_PARTITIONING: None if partitioning is None else create_partitioning(**partitioning),
+            TABLE_READ_OPTIONS: dict(read_options or {})}
+
+
+#########################################################
+# read_table_configs
+# Input: path: Pfad einer Konfigurationsdatei (JSON oder YAML) oder eines Verzeichnisses mit solchen Dateien
+# Jede Datei enthält eine Tabelle oder eine Liste von Tabellen mit den Parametern von create_table. Die Dateien
+# eines Verzeichnisses werden nach Namen sortiert gelesen. YAML braucht PyYAML.
+# Output: Liste mit Dictionaries aus create_table
+#########################################################
+def read_table_configs(path: str) -> list:
+    if os.path.isdir(path):
+        files = [os.path.join(path, file_name) for file_name in sorted(os.listdir(path))
+                 if file_name.endswith(CONFIG_SUFFIXES)]
+    else:
+        files = [path]
+    res = []
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf8') as f:
+            if file_path.endswith('.json'):
+                entries = json.load(f)
+            elif yaml is None:
+                raise ImportError('Reading ' + file_path + ' needs PyYAML (pip install pyyaml)')
+            else:
+                entries = yaml.safe_load(f)
+        for entry in entries if isinstance(entries, list) else [entries]:
+            try:
+                res.append(create_table(**entry))
+            except TypeError as error:
+                raise ValueError('Invalid table in ' + file_path + ': ' + str(error)) from error
+    return res
+
+
+#########################################################
+# get_available_memory
+# Output: verfügbarer Arbeitsspeicher in Bytes (MemAvailable unter Linux, sonst freie Seiten) oder None, wenn er
+#         sich nicht bestimmen lässt
+#########################################################
+def get_available_memory():
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+#########################################################
+# get_chunk_size
+# Input: table: Dictionary aus create_table
+#        table_memory: Arbeitsspeicher in Bytes, den die Tabelle belegen darf. None für unbegrenzt
+# Schätzt den Speicherbedarf pro Zeile aus den ersten TABLE_SAMPLE_ROWS Zeilen der Quelle. Während eine Zeile
+# verarbeitet wird, existiert sie mehrfach (gelesen, gehasht, Delta bzw. Merge), daher wird mit
+# TABLE_MEMORY_FACTOR multipliziert.
+# Output: Anzahl Zeilen pro Chunk oder None, wenn die Quelle ganz gelesen werden soll
+#########################################################
+def get_chunk_size(table: dict, table_memory: int = None):
+    if table_memory is None:
+        return None
+    sample = pd.read_csv(table[TABLE_SOURCE], nrows=TABLE_SAMPLE_ROWS, **table[TABLE_READ_OPTIONS])
+    row_bytes = sample.memory_usage(index=False, deep=True).sum() / max(len(sample), 1)
+    return max(1, int(table_memory // (TABLE_MEMORY_FACTOR * max(row_bytes, 1))))
+
+
+def _get_source_size(table: dict) -> int:
+    try:
+        return os.path.getsize(table[TABLE_SOURCE])
+    except OSError:
+        return 0
+
+
+def _read_chunks(table: dict, chunk_size: int, run_id: str):
+    reader = None
+    if chunk_size is not None:
+        reader = pd.read_csv(table[TABLE_SOURCE], chunksize=chunk_size, **table[TABLE_READ_OPTIONS])
+    while True:
+        with measure_stage(STAGE_READ, 'read_csv', run_id, source=table[TABLE_SOURCE]) as metrics:
+            chunk = pd.read_csv(table[TABLE_SOURCE], **table[TABLE_READ_OPTIONS]) if reader is None \
+                else next(reader, None)
+            metrics[METRIC_ROWS_OUT] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        yield chunk
+        if reader is None:
+            return
+
+
+def _historize_chunks(table: dict, chunks, currents: dict) -> dict:
+    # Jeder Chunk wird einzeln historisiert. Bei einem Full Load werden die Key-Hashes aller Chunks gesammelt,
+    # die fehlenden aktiven Keys werden mit dem letzten Chunk als gelöscht abgeschlossen. Besteht die Quelle
+    # aus einem Chunk, entspricht das genau historize_to_store mit full_load.
+    full_load = table[TABLE_LOAD_TYPE] == LOAD_TYPE_FULL
+    res = {'rows': 0}
+    seen_high, seen_low = [], []
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    first = True
+    options = get_record_hash_options(get_active_path(table[TABLE_TARGET]))
+    while chunk is not None:
+        next_chunk = next(chunks, None)
+        new_df = add_meta_columns(chunk, currents, table[TABLE_KEY_COLUMNS], table[TABLE_EXCLUDE_COLUMNS],
+                                  table[TABLE_HASH_MODE], table[TABLE_COMPACT], **options)
+        deleted_keys = None
+        if full_load and not (first and next_chunk is None):
+            key_high, key_low = get_hash_pair(new_df, COL_KEY_HASH)
+            seen_high.append(key_high)
+            seen_low.append(key_low)
+            if next_chunk is None:
+                deleted_keys = _get_missing_keys(table[TABLE_TARGET], np.concatenate(seen_high),
+                                                 np.concatenate(seen_low))
+        stats = historize_to_store(new_df, table[TABLE_TARGET], currents, table[TABLE_VALID_FROM_MODE],
+                                   table[TABLE_VALID_FROM_DATE], table[TABLE_PARTITIONING],
+                                   full_load and first and next_chunk is None, deleted_keys)
+        res['rows'] += len(new_df)
+        for key, value in stats.items():
+            res[key] = res.get(key, 0) + value
+        chunk, first = next_chunk, False
+    return res
+
+
+def _get_missing_keys(base_path: str, seen_high: np.ndarray, seen_low: np.ndarray) -> pd.DataFrame:
+    index_df = read_hash_index(get_active_path(base_path), columns=[INDEX_KEY_HASH_HIGH, INDEX_KEY_HASH_LOW])
+    if index_df is None:
+        index_df = pd.DataFrame({INDEX_KEY_HASH_HIGH: np.empty(0, dtype=np.uint64),
+                                 INDEX_KEY_HASH_LOW: np.empty(0, dtype=np.uint64)})
+    active_high = index_df[INDEX_KEY_HASH_HIGH].to_numpy()
+    active_low = index_df[INDEX_KEY_HASH_LOW].to_numpy()
+    missing = ~isin_hash_pairs(active_high, active_low, seen_high, seen_low)
+    return pd.DataFrame({META_COLUMNS[COL_KEY_HASH] + HASH_HIGH_SUFFIX: active_high[missing],
+                         META_COLUMNS[COL_KEY_HASH] + HASH_LOW_SUFFIX: active_low[missing]})
+
+
+#########################################################
+# run_table
+# Input: table: Dictionary aus create_table
+#        currents: Dictionary aus create_currents
+#        chunk_size: Anzahl Zeilen pro Chunk (siehe get_chunk_size). None liest die Quelle ganz
+# Historisiert eine Tabelle. Mit chunk_size hängt der Speicherbedarf von der Chunk-Größe ab und nicht von der
+# Größe der Quelle. Bei HISTORIZATION_CURRENT werden alle Chunks in einem Commit sichtbar (append_delta_chunks),
+# bei HISTORIZATION_SCD2 wird jeder Chunk einzeln historisiert. Bricht ein solcher Lauf ab, bleiben die bereits
+# historisierten Chunks bestehen; eine Wiederholung mit derselben Quelle findet sie als unverändert.
+# Wie bei append_delta_chunks müssen alle Chunks dieselben dtypes haben (z.B. dtype in read_options).
+# Output: Dictionary mit der Anzahl Datensätze (rows und delta_rows bzw. pro Klasse wie bei historize_to_store)
+#########################################################
+def run_table(table: dict, currents: dict, chunk_size: int = None) -> dict:
+    chunks = _read_chunks(table, chunk_size, currents[CURRENT_RUN_ID])
+    if table[TABLE_HISTORIZATION] == HISTORIZATION_CURRENT:
+        return append_delta_chunks(chunks, table[TABLE_TARGET], currents, table[TABLE_KEY_COLUMNS],
+                                   table[TABLE_EXCLUDE_COLUMNS], table[TABLE_HASH_MODE], table[TABLE_PARTITIONING],
+                                   table[TABLE_COMPACT])
+    with metrics_run(currents[CURRENT_RUN_ID]):
+        return _historize_chunks(table, chunks, currents)
+
+
+def _run_table_task(table: dict, currents: dict, table_memory: int, parent_pid: int) -> dict:
+    # Läuft im Prozess-Pool. Die Metriken eines anderen Prozesses werden gesammelt und mit dem Ergebnis
+    # zurückgegeben, im aufrufenden Prozess (z.B. ThreadPoolExecutor) landen sie direkt in der Senke von run_tables.
+    collect = os.getpid() != parent_pid
+    records = []
+    previous = set_metrics_sink(records.append) if collect else None
+    res = {TABLE_NAME: table[TABLE_NAME], 'run_id': currents[CURRENT_RUN_ID], 'status': STATUS_OK, 'error': None}
+    wall = time.perf_counter()
+    try:
+        res['chunk_size'] = get_chunk_size(table, table_memory)
+        res.update(run_table(table, currents, res['chunk_size']))
+    except Exception as error:
+        res['status'] = STATUS_ERROR
+        res['error'] = type(error).__name__ + ': ' + str(error)
+    finally:
+        if collect:
+            set_metrics_sink(previous)
+    res[METRIC_WALL_SECONDS] = time.perf_counter() - wall
+    res['metrics'] = records
+    return res
+
+
+#########################################################
+# run_tables
+# Input: tables: Liste mit Dictionaries aus create_table (z.B. aus read_table_configs)
+#        max_workers: Anzahl Prozesse. None nutzt alle CPUs
+#        memory_limit: Arbeitsspeicher in Bytes, den der Batch belegen darf. None nimmt BATCH_MEMORY_FRACTION des
+#                      verfügbaren Arbeitsspeichers (siehe get_available_memory)
+#        table_memory: Arbeitsspeicher in Bytes pro Tabelle. None teilt memory_limit auf die Prozesse auf. Ist es
+#                      gesetzt, laufen höchstens memory_limit // table_memory Tabellen gleichzeitig
+#        executor: optional ein eigener concurrent.futures Executor (z.B. ThreadPoolExecutor)
+#        report_path: optional Pfad einer Datei, in die der Bericht als JSON geschrieben wird
+# Historisiert alle Tabellen parallel über run_table. Die Tabellen werden nach Größe der Quelle absteigend
+# gestartet, damit große Tabellen nicht am Ende allein laufen. Jede Tabelle bekommt eigene currents und damit
+# eine eigene Run-ID. Ein Fehler in einer Tabelle bricht den Batch nicht ab, er steht im Bericht.
+# Alle Metriken der Tabellen (siehe measure_stage) werden im aufrufenden Prozess gesammelt, um den Namen der
+# Tabelle ergänzt und zusätzlich an eine bereits gesetzte Senke weitergegeben. max_rss_bytes einer Tabelle ist die
+# höchste RSS des Prozesses am Ende ihrer Stufen; laufen Tabellen im selben Prozess, enthält sie auch deren Speicher.
+# Output: Bericht als Dictionary: tables (Ergebnis pro Tabelle in Startreihenfolge), stages (alle Metriken),
+#         summary (Anzahl Tabellen und Fehler, Zeilen, Laufzeit, Prozesse und Speicher pro Tabelle)
+#########################################################
+def run_tables(tables: list, max_workers: int = None, memory_limit: int = None, table_memory: int = None,
+               executor=None, report_path: str = None) -> dict:
+    names = [table[TABLE_NAME] for table in tables]
+    if len(set(names)) != len(names):
+        raise ValueError('Table names must be unique')
+    targets = [os.path.abspath(table[TABLE_TARGET]) for table in tables]
+    if len(set(targets)) != len(targets):
+        raise ValueError('Tables must not share a target')
+
+    tables = sorted(tables, key=_get_source_size, reverse=True)
+    if memory_limit is None:
+        available = get_available_memory()
+        memory_limit = None if available is None else int(available * BATCH_MEMORY_FRACTION)
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(tables)))
+    if table_memory is None and memory_limit is not None:
+        table_memory = memory_limit // workers
+    elif table_memory is not None and memory_limit is not None:
+        workers = max(1, min(workers, memory_limit // table_memory))
+    currents = [create_currents() for _ in tables]
+    run_names = {current[CURRENT_RUN_ID]: table[TABLE_NAME] for table, current in zip(tables, currents)}
+
+    previous = get_metrics_sink()
+    stages = []
+    lock = threading.Lock()
+
+    def sink(metrics: dict):
+        metrics['table'] = run_names.get(metrics.get(METRIC_RUN_ID))
+        with lock:
+            stages.append(metrics)
+        if previous is not None:
+            previous(metrics)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(workers)
+    results = [None] * len(tables)
+    wall = time.perf_counter()
+    set_metrics_sink(sink)
+    try:
+        futures = {executor.submit(_run_table_task, table, currents[position], table_memory, os.getpid()): position
+                   for position, table in enumerate(tables)}
+        for future in as_completed(futures):
+            position = futures[future]
+            try:
+                res = future.result()
+            except Exception as error:
+                res = {TABLE_NAME: tables[position][TABLE_NAME], 'run_id': currents[position][CURRENT_RUN_ID],
+                       'status': STATUS_ERROR, 'error': type(error).__name__ + ': ' + str(error), 'metrics': []}
+            for metrics in res.pop('metrics'):
+                sink(metrics)
+            results[position] = res
+    finally:
+        set_metrics_sink(previous)
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    for res in results:
+        rss = [metrics[METRIC_RSS_END_BYTES] for metrics in stages if metrics['table'] == res[TABLE_NAME]
+               and metrics.get(METRIC_RSS_END_BYTES) is not None]
+        res[TABLE_MAX_RSS_BYTES] = max(rss) if rss else None
+    report = {'tables': results, 'stages': stages,
+              'summary': {'tables': len(results),
+                          'failed': sum(res['status'] != STATUS_OK for res in results),
+                          'rows': sum(res.get('rows', 0) for res in results),
+                          METRIC_WALL_SECONDS: time.perf_counter() - wall,
+                          'workers': workers, 'table_memory': table_memory}}
+    if report_path is not None:
+        with open(report_path, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=2, default=str)
+    return report
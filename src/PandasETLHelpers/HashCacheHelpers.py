@@ -0,0 +1,201 @@
+import os
+import json
+import uuid
+from src.PandasETLHelpers.SCDHelpers import *
+
+#########################################################
+# hash cache constants
+#########################################################
+HASH_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+HASH_CACHE_SUFFIX = '.parquet'
+HASH_CACHE_DIGEST_BLOCK_SIZE = 1024 * 1024
+
+FINGERPRINT_SIZE = 'size'
+FINGERPRINT_MTIME = 'mtime_ns'
+FINGERPRINT_DIGEST = 'digest'
+
+HASH_CACHE_COLUMNS = [META_COLUMNS[column] + suffix for column in COMPACT_HASH_COLUMNS
+                      for suffix in [HASH_HIGH_SUFFIX, HASH_LOW_SUFFIX]]
+
+
+#########################################################
+# get_file_fingerprint
+# Input: file_path: Pfad der Quelldatei
+# Liest die Datei blockweise und bildet einen md5 Digest über den Inhalt
+# Output: Dictionary mit Größe, mtime (ns) und Inhalts-Digest der Datei
+#########################################################
+def get_file_fingerprint(file_path: str) -> dict:
+    stat = os.stat(file_path)
+    digest = md5()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_CACHE_DIGEST_BLOCK_SIZE), b''):
+            digest.update(block)
+    return {FINGERPRINT_SIZE: stat.st_size, FINGERPRINT_MTIME: stat.st_mtime_ns,
+            FINGERPRINT_DIGEST: digest.hexdigest()}
+
+
+#########################################################
+# get_hash_cache_key
+# Input: fingerprint: Dictionary aus get_file_fingerprint
+#        key_columns: Liste mit den Spalten des KEY_HASH
+#        record_columns: Liste mit den Spalten des RECORD_HASH (siehe get_record_hash_columns)
+#        hash_mode: Hash-Verfahren (siehe compute_hashes)
+#        read_options: Dictionary mit den Parametern für pd.read_csv, da sie die gehashten Werte verändern können
+#        record_hash_defaults, record_hash_dtypes: siehe add_meta_columns
+# Ändert sich die Datei, eine der Spaltenlisten (z.B. über record_hash_exclude_columns), der hash_mode, die
+# read_options oder die Regeln für den Record-Hash (z.B. nach evolve_schema), ergibt sich ein anderer Schlüssel
+# und der alte Eintrag wird nicht mehr verwendet
+# Output: Schlüssel des Cache-Eintrags als Hex-String
+#########################################################
+def get_hash_cache_key(fingerprint: dict, key_columns: list, record_columns: list, hash_mode: int,
+                       read_options: dict = None, record_hash_defaults: dict = None,
+                       record_hash_dtypes: dict = None) -> str:
+    key = {'fingerprint': fingerprint, 'key_columns': list(key_columns), 'record_columns': list(record_columns),
+           'hash_mode': hash_mode, 'read_options': repr(sorted((read_options or {}).items()))}
+    # ohne Regeln bleiben die Schlüssel bestehender Einträge gleich
+    if record_hash_defaults:
+        key['record_hash_defaults'] = record_hash_defaults
+    if record_hash_dtypes:
+        key['record_hash_dtypes'] = record_hash_dtypes
+    key = json.dumps(key, sort_keys=True, default=str)
+    return md5(key.encode("utf8")).hexdigest()
+
+
+def _get_cache_file(cache_path: str, cache_key: str) -> str:
+    return os.path.join(cache_path, cache_key + HASH_CACHE_SUFFIX)
+
+
+#########################################################
+# read_hash_cache
+# Input: cache_path: Verzeichnis des Hash-Caches
+#        cache_key: Schlüssel aus get_hash_cache_key
+#        rows: erwartete Anzahl Zeilen
+# Ein Treffer setzt die mtime des Eintrags neu, damit evict_hash_cache die zuletzt genutzten Einträge behält.
+# Unlesbare Einträge oder Einträge mit falscher Zeilenanzahl werden entfernt und als Fehltreffer behandelt.
+# Output: Dictionary {KEY_HASH: (high, low), RECORD_HASH: (high, low)} oder None
+#########################################################
+def read_hash_cache(cache_path: str, cache_key: str, rows: int):
+    cache_file = _get_cache_file(cache_path, cache_key)
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        df = pd.read_parquet(cache_file, engine=PARQUET_ENGINE, columns=HASH_CACHE_COLUMNS)
+    except (OSError, ValueError):
+        df = None
+    if df is None or len(df) != rows:
+        _remove_cache_file(cache_file)
+        return None
+    try:
+        os.utime(cache_file)
+    except FileNotFoundError:
+        pass
+    res = {}
+    for column in COMPACT_HASH_COLUMNS:
+        name = META_COLUMNS[column]
+        res[name] = (df[name + HASH_HIGH_SUFFIX].to_numpy(dtype=np.uint64),
+                     df[name + HASH_LOW_SUFFIX].to_numpy(dtype=np.uint64))
+    return res
+
+
+#########################################################
+# write_hash_cache
+# Input: cache_path: Verzeichnis des Hash-Caches
+#        cache_key: Schlüssel aus get_hash_cache_key
+#        hashes: Dictionary {KEY_HASH: (high, low), RECORD_HASH: (high, low)} (compute_hashes mit as_pairs=True)
+#        max_bytes: maximale Größe des Caches, siehe evict_hash_cache
+# Schreibt den Eintrag in eine temporäre Datei und benennt sie danach um, damit parallele Läufe nie einen halb
+# geschriebenen Eintrag lesen
+# Output: None
+#########################################################
+def write_hash_cache(cache_path: str, cache_key: str, hashes: dict, max_bytes: int = HASH_CACHE_MAX_BYTES):
+    os.makedirs(cache_path, exist_ok=True)
+    df = pd.DataFrame({name + suffix: hashes[name][position]
+                       for name in [META_COLUMNS[column] for column in COMPACT_HASH_COLUMNS]
+                       for position, suffix in enumerate([HASH_HIGH_SUFFIX, HASH_LOW_SUFFIX])})
+    tmp_file = os.path.join(cache_path, '.tmp-' + uuid.uuid4().hex + HASH_CACHE_SUFFIX)
+    try:
+        df.to_parquet(tmp_file, engine=PARQUET_ENGINE, index=False)
+        os.replace(tmp_file, _get_cache_file(cache_path, cache_key))
+    finally:
+        _remove_cache_file(tmp_file)
+    evict_hash_cache(cache_path, max_bytes)
+
+
+def _remove_cache_file(cache_file: str):
+    try:
+        os.remove(cache_file)
+    except FileNotFoundError:
+        pass
+
+
+#########################################################
+# evict_hash_cache
+# Input: cache_path: Verzeichnis des Hash-Caches
+#        max_bytes: maximale Größe des Caches
+# Entfernt die am längsten nicht genutzten Einträge (LRU nach mtime), bis der Cache höchstens max_bytes groß ist
+# Output: Anzahl entfernter Einträge
+#########################################################
+def evict_hash_cache(cache_path: str, max_bytes: int = HASH_CACHE_MAX_BYTES) -> int:
+    if not os.path.isdir(cache_path):
+        return 0
+    entries = []
+    for entry in os.scandir(cache_path):
+        if entry.is_file() and entry.name.endswith(HASH_CACHE_SUFFIX) and not entry.name.startswith('.tmp-'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, cache_file in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove_cache_file(cache_file)
+        total -= size
+        removed += 1
+    return removed
+
+
+#########################################################
+# add_meta_columns_cached
+# Input: source: Pfad der Quelldatei (CSV)
+#        cache_path: Verzeichnis des Hash-Caches
+#        currents, key_columns, record_hash_exclude_columns, hash_mode, compact: siehe add_meta_columns
+#        read_options: Dictionary mit weiteren Parametern für pd.read_csv
+#        max_bytes: maximale Größe des Caches, siehe evict_hash_cache
+#        record_hash_defaults, record_hash_dtypes: siehe add_meta_columns (z.B. aus get_record_hash_options)
+# Wie add_meta_columns für eine ganze Quelldatei. KEY_HASH und RECORD_HASH werden unter dem Fingerprint der Datei
+# und den gehashten Spalten (siehe get_hash_cache_key) abgelegt. Wird dieselbe Datei erneut geladen (z.B. bei einem
+# wiederholten Lauf), werden die Hashes aus dem Cache übernommen und nicht neu berechnet.
+# Output: Dataframe mit angefügten Metadatenspalten
+#########################################################
+def add_meta_columns_cached(source: str, cache_path: str, currents: dict, key_columns: list,
+                            record_hash_exclude_columns: list = None, hash_mode: int = HASH_MODE_MD5,
+                            compact: bool = False, read_options: dict = None,
+                            max_bytes: int = HASH_CACHE_MAX_BYTES, record_hash_defaults: dict = None,
+                            record_hash_dtypes: dict = None) -> pd.DataFrame:
+    run_id = currents.get(CURRENT_RUN_ID)
+    with measure_stage(STAGE_READ, 'add_meta_columns_cached', run_id, source=source) as metrics:
+        fingerprint = get_file_fingerprint(source)
+        df = pd.read_csv(source, **(read_options or {}))
+        metrics[METRIC_ROWS_OUT] = len(df)
+        metrics[METRIC_BYTES_READ] = fingerprint[FINGERPRINT_SIZE]
+    record_columns = get_record_hash_columns(df.columns, record_hash_exclude_columns)
+    with measure_stage(STAGE_HASH, 'add_meta_columns_cached', run_id, len(df), key_columns=list(key_columns),
+                       record_columns=record_columns, hash_mode=hash_mode) as metrics:
+        cache_key = get_hash_cache_key(fingerprint, key_columns, record_columns, hash_mode, read_options,
+                                       record_hash_defaults, record_hash_dtypes)
+        pairs = read_hash_cache(cache_path, cache_key, len(df))
+        metrics['cache_hit'] = pairs is not None
+        if pairs is None:
+            pairs = compute_meta_hashes(df, key_columns, record_columns, hash_mode, True, record_hash_defaults,
+                                        record_hash_dtypes)
+            write_hash_cache(cache_path, cache_key, pairs, max_bytes)
+        if compact:
+            hashes = pairs
+        else:
+            hashes = {name: uint64_pair_to_hash(high, low, hash_mode) for name, (high, low) in pairs.items()}
+        res = assign_meta_columns(df, hashes, currents, compact)
+        metrics[METRIC_ROWS_OUT] = len(res)
+    return res
@@ -0,0 +1,327 @@
+import os
+import queue
+import threading
+import contextvars
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, CancelledError
+from src.PandasETLHelpers.HashCacheHelpers import *
+from src.PandasETLHelpers.SnapshotHelpers import refresh_snapshot
+
+#########################################################
+# load constants
+#########################################################
+LOAD_SOURCE = 'source'
+LOAD_TARGET = 'target'
+LOAD_READ_OPTIONS = 'read_options'
+
+PENDING_CHUNKS_PER_WORKER = 2
+PREFETCH_CHUNKS = 2
+PREFETCH_POLL_SECONDS = 0.1
+PIPELINE_CHUNK_SIZE = 100000
+
+
+#########################################################
+# create_load
+# Input: source: Pfad der Quelldatei (CSV)
+#        target: Pfad des Datasets, in das das Delta geschrieben wird
+#        read_options: Dictionary mit weiteren Parametern für pd.read_csv (z.B. dtype)
+# Output: Dictionary, das einen Ladevorgang für run_loads beschreibt
+#########################################################
+def create_load(source: str, target: str, read_options: dict = None) -> dict:
+    return {LOAD_SOURCE: source, LOAD_TARGET: target, LOAD_READ_OPTIONS: read_options or {}}
+
+
+def _read_and_hash(source: str, read_options: dict, currents: dict, key_columns: list,
+                   record_hash_exclude_columns: list, hash_mode: int, compact: bool, record_hash_defaults: dict,
+                   record_hash_dtypes: dict) -> pd.DataFrame:
+    with measure_stage(STAGE_READ, 'read_csv', currents[CURRENT_RUN_ID], source=source) as metrics:
+        df = pd.read_csv(source, **read_options)
+        metrics[METRIC_ROWS_OUT] = len(df)
+        metrics[METRIC_BYTES_READ] = os.path.getsize(source)
+    return add_meta_columns(df, currents, key_columns, record_hash_exclude_columns, hash_mode, compact,
+                            record_hash_defaults, record_hash_dtypes)
+
+
+def _iter_tasks(loads: list, currents: list, key_columns: list, record_hash_exclude_columns: list, hash_mode: int,
+                chunk_size: int, compact: bool, hash_cache_path: str):
+    for position, load in enumerate(loads):
+        options = get_record_hash_options(load[LOAD_TARGET])
+        defaults, dtypes = options['record_hash_defaults'], options['record_hash_dtypes']
+        if hash_cache_path is not None:
+            yield position, (add_meta_columns_cached, load[LOAD_SOURCE], hash_cache_path, currents[position],
+                             key_columns, record_hash_exclude_columns, hash_mode, compact, load[LOAD_READ_OPTIONS],
+                             HASH_CACHE_MAX_BYTES, defaults, dtypes)
+        elif chunk_size is None:
+            yield position, (_read_and_hash, load[LOAD_SOURCE], load[LOAD_READ_OPTIONS], currents[position],
+                             key_columns, record_hash_exclude_columns, hash_mode, compact, defaults, dtypes)
+        else:
+            for chunk in pd.read_csv(load[LOAD_SOURCE], chunksize=chunk_size, **load[LOAD_READ_OPTIONS]):
+                yield position, (add_meta_columns, chunk, currents[position], key_columns,
+                                 record_hash_exclude_columns, hash_mode, compact, defaults, dtypes)
+
+
+#########################################################
+# run_loads
+# Input: loads: Liste mit Ladevorgängen aus create_load. Die Reihenfolge ist pro Ziel die Commit-Reihenfolge
+#        key_columns: Liste mit den Key-Spalten
+#        record_hash_exclude_columns: Liste mit Spalten, die nicht im Record gehasht werden sollen
+#        hash_mode: Hash-Verfahren (siehe compute_hashes)
+#        partitioning: Dictionary aus create_partitioning für neue Datasets
+#        max_workers: Anzahl Prozesse für das Lesen und Hashen und Threads für das Klassifizieren der Buckets.
+#                     None nutzt alle CPUs
+#        chunk_size: Anzahl Zeilen pro Chunk. Ist sie gesetzt, wird jede Quelle in Chunks gelesen, die einzeln
+#                    gehasht werden, damit auch eine einzelne große Quelle auf alle Prozesse verteilt wird
+#        executor: optional ein eigener concurrent.futures Executor (z.B. ThreadPoolExecutor)
+#        compact: Boolean, ob die Metadatenspalten im kompakten Schema geschrieben werden (siehe add_meta_columns)
+#        hash_cache_path: optional Verzeichnis eines Hash-Caches (siehe add_meta_columns_cached). Ist es gesetzt,
+#                         werden die Quellen immer ganz gelesen und chunk_size wird ignoriert
+#        snapshot: Boolean, ob nach jedem Commit die Segmente des memory-mapped Snapshots für die neu geschriebenen
+#                  Dateien angelegt werden (siehe refresh_snapshot, braucht pyarrow)
+# Lädt mehrere Quellen parallel: Lesen und Hashen (add_meta_columns) laufen in einem Prozess-Pool, maximal
+# PENDING_CHUNKS_PER_WORKER Aufgaben pro Prozess sind gleichzeitig unterwegs und werden in der Reihenfolge von loads
+# vergeben. Klassifizieren, Schreiben und der Commit (append_meta_chunks) laufen pro Ziel in einem eigenen Thread:
+# verschiedene Ziele laufen parallel, Ladevorgänge auf dasselbe Ziel nacheinander in der Reihenfolge von loads, da
+# ein späterer Lauf gegen den Stand nach den früheren Läufen auf dasselbe Dataset verglichen werden muss. Bei nach
+# Buckets partitionierten Zielen wird jeder Chunk zusätzlich pro Bucket parallel klassifiziert.
+# Jeder Ladevorgang bekommt eigene currents aus create_currents und damit eine eigene Run-ID. Die Regeln für den
+# Record-Hash (get_record_hash_options) werden aus dem Schema des jeweiligen Ziels übernommen.
+# Bei einem Fehler werden die noch offenen Aufgaben und die laufenden Läufe der anderen Ziele abgebrochen (ihre
+# Dateien werden wieder gelöscht), bereits committete Läufe bleiben bestehen. Geworfen wird der erste Fehler in
+# der Reihenfolge der Ziele.
+# Output: Liste mit einem Dictionary pro Ladevorgang (source, target, run_id, rows, delta_rows)
+#########################################################
+def run_loads(loads: list, key_columns: list, record_hash_exclude_columns: list = None,
+              hash_mode: int = HASH_MODE_MD5, partitioning: dict = None, max_workers: int = None,
+              chunk_size: int = None, executor=None, compact: bool = False, hash_cache_path: str = None,
+              snapshot: bool = False) -> list:
+    currents = [create_currents() for _ in loads]
+    tasks = _iter_tasks(loads, currents, key_columns, record_hash_exclude_columns, hash_mode, chunk_size, compact,
+                        hash_cache_path)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers)
+    max_pending = PENDING_CHUNKS_PER_WORKER * (max_workers or os.cpu_count() or 1)
+    pending = [deque() for _ in loads]
+    # Fortschritt der Vergabe: Anzahl offener Aufgaben, Position der letzten vergebenen Aufgabe, Ende von tasks
+    progress = {'pending': 0, 'position': -1, 'done': False}
+    condition = threading.Condition()
+    cancel_event = threading.Event()
+
+    def submit_next() -> bool:
+        if progress['done']:
+            return False
+        try:
+            task = next(tasks, None)
+        except BaseException:
+            cancel_event.set()
+            raise
+        if task is None:
+            progress['done'] = True
+            return False
+        position, (function, *args) = task
+        pending[position].append(executor.submit(function, *args))
+        progress['pending'] += 1
+        progress['position'] = position
+        return True
+
+    def meta_chunks(position: int):
+        while True:
+            with condition:
+                while len(pending[position]) == 0:
+                    _check_cancelled(cancel_event)
+                    if progress['done'] or progress['position'] > position:
+                        return
+                    if progress['pending'] >= max_pending or not submit_next():
+                        condition.wait(PREFETCH_POLL_SECONDS)
+                future = pending[position].popleft()
+                progress['pending'] -= 1
+                while progress['pending'] < max_pending and submit_next():
+                    pass
+                condition.notify_all()
+            yield future.result()
+
+    def run_target(positions: list) -> dict:
+        res = {}
+        try:
+            for position in positions:
+                _check_cancelled(cancel_event)
+                load = loads[position]
+                with metrics_run(currents[position][CURRENT_RUN_ID]):
+                    res[position] = append_meta_chunks(meta_chunks(position), load[LOAD_TARGET], partitioning,
+                                                       diff_executor=diff_executor)
+                    if snapshot:
+                        refresh_snapshot(load[LOAD_TARGET])
+                res[position].update({'source': load[LOAD_SOURCE], 'target': load[LOAD_TARGET],
+                                      'run_id': currents[position][CURRENT_RUN_ID]})
+        except BaseException:
+            cancel_event.set()
+            raise
+        return res
+
+    targets = {}
+    for position, load in enumerate(loads):
+        targets.setdefault(load[LOAD_TARGET], []).append(position)
+    diff_executor = ThreadPoolExecutor(max_workers)
+    target_executor = ThreadPoolExecutor(max(len(targets), 1))
+    stats = {}
+    try:
+        with condition:
+            while progress['pending'] < max_pending and submit_next():
+                pass
+        futures = [target_executor.submit(contextvars.copy_context().run, run_target, positions)
+                   for positions in targets.values()]
+        errors = []
+        for future in futures:
+            try:
+                stats.update(future.result())
+            except BaseException as error:
+                errors.append(error)
+        if len(errors) > 0:
+            raise next((error for error in errors if not isinstance(error, CancelledError)), errors[0])
+    finally:
+        cancel_event.set()
+        target_executor.shutdown(wait=True)
+        diff_executor.shutdown(wait=True, cancel_futures=True)
+        for position_futures in pending:
+            for future in position_futures:
+                future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+    return [stats[position] for position in range(len(loads))]
+
+
+#########################################################
+# prefetch
+# Input: iterable: Iterable, dessen Elemente im Hintergrund erzeugt werden (z.B. pd.read_csv(..., chunksize=n))
+#        max_pending: Anzahl Elemente, die höchstens fertig auf den Verbraucher warten
+#        cancel_event: optional threading.Event. Ist es gesetzt, bricht der Generator mit CancelledError ab
+# Generator, der iterable in einem eigenen Thread durchläuft, während der Aufrufer die vorherigen Elemente
+# verarbeitet. Die Queue ist auf max_pending begrenzt: ist der Verbraucher langsamer, wartet der Thread
+# (Backpressure). Fehler des Threads werden beim Verbraucher geworfen. Wird der Generator geschlossen (auch bei
+# einem Fehler des Verbrauchers), beendet sich der Thread nach dem laufenden Element.
+# Output: Generator mit den Elementen von iterable in derselben Reihenfolge
+#########################################################
+def prefetch(iterable, max_pending: int = PREFETCH_CHUNKS, cancel_event: threading.Event = None):
+    items = queue.Queue(max_pending)
+    stop = threading.Event()
+
+    def put(item: tuple) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=PREFETCH_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except BaseException as error:
+            put((False, error))
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(produce,), name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            _check_cancelled(cancel_event)
+            try:
+                has_item, item = items.get(timeout=PREFETCH_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if not has_item:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _check_cancelled(cancel_event: threading.Event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise CancelledError('Load was cancelled')
+
+
+def _map_ordered(function, items, executor, max_pending: int, cancel_event: threading.Event, *args):
+    # Wie executor.map, aber mit höchstens max_pending Aufgaben gleichzeitig und abbrechbar
+    pending = deque()
+    try:
+        for item in items:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            _check_cancelled(cancel_event)
+            pending.append(executor.submit(function, item, *args))
+        while len(pending) > 0:
+            yield pending.popleft().result()
+            _check_cancelled(cancel_event)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _read_csv_chunks(reader, source: str, run_id: str):
+    while True:
+        with measure_stage(STAGE_READ, 'read_csv', run_id, source=source) as metrics:
+            chunk = next(reader, None)
+            metrics[METRIC_ROWS_OUT] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+
+#########################################################
+# run_load_pipelined
+# Input: load: Ladevorgang aus create_load
+#        key_columns, record_hash_exclude_columns, hash_mode, partitioning, compact, snapshot: siehe run_loads
+#        chunk_size: Anzahl Zeilen pro Chunk
+#        max_workers: Anzahl Prozesse für das Hashen. None nutzt alle CPUs
+#        executor: optional ein eigener concurrent.futures Executor für das Hashen (z.B. ThreadPoolExecutor)
+#        cancel_event: optional threading.Event, über das ein anderer Thread den Lauf abbrechen kann
+# Lädt eine Quelle wie append_delta_chunks, die Stufen laufen aber überlappend statt nacheinander:
+#   Lesen: pd.read_csv parst die Chunks in einem eigenen Thread voraus (prefetch, PREFETCH_CHUNKS)
+#   Hashen: add_meta_columns läuft im executor, PENDING_CHUNKS_PER_WORKER Chunks pro Prozess gleichzeitig
+#   Klassifizieren: gegen den Hash-Index im aufrufenden Thread
+#   Schreiben: parquet Dateien und Index-Segmente in einem Writer-Thread (append_meta_chunks mit write_executor)
+# Alle Stufen sind über begrenzte Queues verbunden, eine langsame Stufe bremst die vorherigen (Backpressure),
+# der Speicherbedarf bleibt bei wenigen Chunks. Die Laufzeit nähert sich so der langsamsten Stufe statt der
+# Summe aller Stufen. md5 wird pro Zeile über kurze Strings gebildet und hält dabei den GIL, daher hasht
+# standardmäßig ein Prozess-Pool; bei den FAST hash_modes reicht ein ThreadPoolExecutor.
+# Bei einem Fehler in einer Stufe oder nach cancel_event (CancelledError) werden alle Stufen beendet, die schon
+# geschriebenen Dateien gelöscht und der Fehler an den Aufrufer weitergegeben. Committet wird erst am Ende.
+# Output: Dictionary wie ein Eintrag von run_loads (source, target, run_id, rows, delta_rows)
+#########################################################
+def run_load_pipelined(load: dict, key_columns: list, record_hash_exclude_columns: list = None,
+                       hash_mode: int = HASH_MODE_MD5, partitioning: dict = None,
+                       chunk_size: int = PIPELINE_CHUNK_SIZE, max_workers: int = None, executor=None,
+                       compact: bool = False, cancel_event: threading.Event = None, snapshot: bool = False) -> dict:
+    currents = create_currents()
+    run_id = currents[CURRENT_RUN_ID]
+    options = get_record_hash_options(load[LOAD_TARGET])
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers)
+    max_pending = PENDING_CHUNKS_PER_WORKER * (max_workers or os.cpu_count() or 1)
+    writer = ThreadPoolExecutor(1, thread_name_prefix='writer')
+    try:
+        with metrics_run(run_id), \
+                pd.read_csv(load[LOAD_SOURCE], chunksize=chunk_size, **load[LOAD_READ_OPTIONS]) as reader, \
+                closing(prefetch(_read_csv_chunks(reader, load[LOAD_SOURCE], run_id), PREFETCH_CHUNKS,
+                                 cancel_event)) as chunks, \
+                closing(_map_ordered(add_meta_columns, chunks, executor, max_pending, cancel_event, currents,
+                                     key_columns, record_hash_exclude_columns, hash_mode, compact,
+                                     options['record_hash_defaults'], options['record_hash_dtypes'])) as meta_chunks:
+            res = append_meta_chunks(meta_chunks, load[LOAD_TARGET], partitioning, writer)
+            if snapshot:
+                refresh_snapshot(load[LOAD_TARGET])
+    finally:
+        writer.shutdown(wait=True, cancel_futures=True)
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+    res.update({'source': load[LOAD_SOURCE], 'target': load[LOAD_TARGET], 'run_id': run_id})
+    return res
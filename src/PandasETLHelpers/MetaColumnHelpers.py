@@ -1,6 +1,11 @@
+import os
+import uuid
 import datetime
+import threading
+import numpy as np
 import pandas as pd
 from hashlib import md5
+from src.PandasETLHelpers.RunMetricsHelpers import *
 
 #########################################################
 # meta columns constants
@@ -40,7 +45,9 @@ VALID_FROM_MODE_CUSTOM = 3
 VALID_TO_MODE_LOAD_DATE = 1
 VALID_TO_MODE_CUSTOM = 2
 
-RUN_ID_FORMAT = '%Y%m%d%H%M%S'
+RUN_ID_FORMAT = '%Y%m%d%H%M%S%f'
+RUN_ID_SEPARATOR = '-'
+RUN_ID_SUFFIX_LENGTH = 8
 
 PYTHON_TS_FORMAT = '%Y-%m-%d %H:%M:%S'
 SPARK_TS_FORMAT = 'yyyy-MM-dd HH:mm:ss'
@@ -50,6 +57,30 @@ SPARK_DAY_FORMAT = 'yyyy-MM-dd'
 
 SCD2_LOWER_BOUND = '1900-01-01'
 SCD2_UPPER_BOUND = '9999-12-31'
+SCD2_DATE_DTYPE = 'datetime64[us]'
+
+HASH_MODE_MD5 = 1
+HASH_MODE_FAST64 = 2
+HASH_MODE_FAST128 = 3
+
+HASH_SEPARATOR = '#?'
+HASH_CHUNK_SIZE = 1000000
+HASH_PAIR_CHUNK_SIZE = 100000
+FAST_HASH_KEYS = ('0123456789123456', '6543210987654321')
+
+_RUN_TS_LOCK = threading.Lock()
+_last_run_ts = None
+
+HASH_HIGH_SUFFIX = '_HIGH'
+HASH_LOW_SUFFIX = '_LOW'
+COMPACT_HASH_COLUMNS = [COL_KEY_HASH, COL_RECORD_HASH]
+COMPACT_RUN_ID_COLUMNS = [COL_INSERT_RUN_ID, COL_UPDATE_RUN_ID]
+HASH_COLUMN_NAMES = [META_COLUMNS[column] + suffix for column in COMPACT_HASH_COLUMNS
+                     for suffix in ('', HASH_HIGH_SUFFIX, HASH_LOW_SUFFIX)]
+
+DELTA_UNCHANGED = 0
+DELTA_INSERT = 1
+DELTA_UPDATE = 2
 
 
 #########################################################
@@ -58,6 +89,11 @@ SCD2_UPPER_BOUND = '9999-12-31'
 # CURRENT_RUN_ID: load_ts im Format RUN_ID_FORMAT (String)
 # CURRENT_RUN_DAY: load_ts auf Granularität Tag (String)
 # CURRENT_RUN_TS: load_ts als datetime (Datetime)
+# Ohne load_ts wird die aktuelle Zeit verwendet. Die Run-ID ist dann die Zeit mit Mikrosekunden-Auflösung, gefolgt
+# von RUN_ID_SEPARATOR und RUN_ID_SUFFIX_LENGTH Zeichen einer UUID pro Lauf. Der Zeitteil ist innerhalb des Prozesses
+# streng monoton, mehrere Läufe direkt hintereinander bekommen ohne Wartezeit verschiedene Run-IDs und sortieren in
+# Startreihenfolge. Die UUID macht Run-IDs auch zwischen Prozessen und Rechnern eindeutig, die im selben
+# Mikrosekundenschritt starten.
 # Output: Dictionary mit oben genannten Werten
 #########################################################
 def create_currents(load_ts: str = None):
@@ -69,31 +105,148 @@ def create_currents(load_ts: str = None):
       CURRENT_RUN_TS   : load_ts
     }
   else:
-    now = datetime.datetime.now()
+    now = _next_run_ts()
     res = {
-      CURRENT_RUN_ID : now.strftime(RUN_ID_FORMAT),
+      CURRENT_RUN_ID : now.strftime(RUN_ID_FORMAT) + RUN_ID_SEPARATOR + uuid.uuid4().hex[:RUN_ID_SUFFIX_LENGTH],
       CURRENT_RUN_DAY : now.date().strftime(PYTHON_TS_FORMAT),
       CURRENT_RUN_TS: now.strftime(PYTHON_TS_FORMAT)
     }
   return res
 
 
+def _next_run_ts() -> datetime.datetime:
+  global _last_run_ts
+  with _RUN_TS_LOCK:
+    now = datetime.datetime.now()
+    if _last_run_ts is not None and now <= _last_run_ts:
+      now = _last_run_ts + datetime.timedelta(microseconds=1)
+    _last_run_ts = now
+    return now
+
+
+#########################################################
+# get_record_hash_columns
+# Input: columns: Spaltennamen des Dataframes, dessen Values gehasht werden sollen
+#        exclude_columns: Liste mit Spalten, die nicht im Record gehasht werden sollen
+# Erzeugt die Liste an Spalten, die im Record-Hash gehasht werden. Entfernt die Metadaten Spalten
+# aus META_COLUMNS und die Spalten aus exclude_columns, die Reihenfolge von columns bleibt erhalten.
+# Output: Liste mit Spaltennamen
 #########################################################
-# add_hash_columns
+def get_record_hash_columns(columns, exclude_columns: list = None) -> list:
+    column_filter = list(META_COLUMNS.values())
+    if exclude_columns is not None:
+        column_filter.extend(exclude_columns)
+    return list(filter(lambda x: x not in column_filter, columns))
+
+
+#########################################################
+# compute_hashes
+# Input: df: Dataframe dessen Spalten gehasht werden sollen
+#        hash_columns: Dictionary {hash_column_name: Liste mit Spalten die gehasht werden sollen}
+#        hash_mode: HASH_MODE_MD5, HASH_MODE_FAST64 oder HASH_MODE_FAST128
+#        chunk_size: Anzahl Zeilen, die pro Block gehasht werden
+#        as_pairs: Boolean, ob die Hashes blockweise in uint64 Paare (siehe hash_to_uint64_pair) umgewandelt werden
+# Hasht df blockweise, ohne das Dataframe zu kopieren. Der Speicherbedarf für Zwischenergebnisse
+# hängt nur von chunk_size ab.
+# HASH_MODE_MD5: md5 Hex-String über die mit HASH_SEPARATOR konkatenierten Werte (wie bisher).
+#                Jede Spalte wird pro Block nur einmal in Strings umgewandelt, auch wenn sie
+#                in mehreren Hashes vorkommt (z.B. Key-Spalten im Record-Hash)
+# HASH_MODE_FAST64: nicht-kryptographischer 64-bit Hash als uint64, vollständig vektorisiert
+# HASH_MODE_FAST128: zwei 64-bit Hashes mit unterschiedlichen Keys als 16 Byte Binärwert (bytes)
+# Output: Dictionary {hash_column_name: numpy Array mit den Hashwerten} bzw. {hash_column_name: Tuple (high, low)}
+#########################################################
+def compute_hashes(df: pd.DataFrame, hash_columns: dict, hash_mode: int = HASH_MODE_MD5,
+                   chunk_size: int = HASH_CHUNK_SIZE, as_pairs: bool = False) -> dict:
+    if hash_mode not in (HASH_MODE_MD5, HASH_MODE_FAST64, HASH_MODE_FAST128):
+        raise ValueError("hash_mode must be one of HASH_MODE_MD5, HASH_MODE_FAST64, HASH_MODE_FAST128")
+    for hash_column_name, columns in hash_columns.items():
+        if len(columns) == 0:
+            raise ValueError("No columns to hash for " + hash_column_name)
+
+    parts = {hash_column_name: [] for hash_column_name in hash_columns}
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        if hash_mode == HASH_MODE_MD5:
+            chunk_hashes = _hash_chunk_md5(chunk, hash_columns)
+        else:
+            chunk_hashes = _hash_chunk_fast(chunk, hash_columns, hash_mode)
+        for hash_column_name in hash_columns:
+            if as_pairs:
+                parts[hash_column_name].append(np.column_stack(hash_to_uint64_pair(chunk_hashes[hash_column_name])))
+            else:
+                parts[hash_column_name].append(chunk_hashes[hash_column_name])
+
+    if as_pairs:
+        res = {}
+        for hash_column_name, chunks in parts.items():
+            pairs = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.uint64)
+            res[hash_column_name] = (pairs[:, 0].copy(), pairs[:, 1].copy())
+        return res
+    empty_dtype = np.uint64 if hash_mode == HASH_MODE_FAST64 else object
+    return {hash_column_name: np.concatenate(chunks) if chunks else np.empty(0, dtype=empty_dtype)
+            for hash_column_name, chunks in parts.items()}
+
+
+def _to_hash_strings(values: pd.Series) -> np.ndarray:
+    # Ab pandas 3 behält astype(str) fehlende Werte als NaN, der Hash braucht wie bisher 'nan', 'None' oder 'NaT'
+    res = values.astype(str).to_numpy(dtype=object)
+    missing = values.isna().to_numpy()
+    if missing.any():
+        res[missing] = [str(value) for value in values.to_numpy(dtype=object)[missing]]
+    return res
+
+
+def _hash_chunk_md5(chunk: pd.DataFrame, hash_columns: dict) -> dict:
+    strings = {}
+    for columns in hash_columns.values():
+        for column in columns:
+            if column not in strings:
+                strings[column] = _to_hash_strings(chunk[column])
+    res = {}
+    for hash_column_name, columns in hash_columns.items():
+        if len(columns) == 1:
+            keys = strings[columns[0]]
+        else:
+            keys = map(HASH_SEPARATOR.join, zip(*(strings[column] for column in columns)))
+        hashes = np.empty(len(chunk), dtype=object)
+        hashes[:] = [md5(key.encode("utf8")).hexdigest() for key in keys]
+        res[hash_column_name] = hashes
+    return res
+
+
+def _hash_chunk_fast(chunk: pd.DataFrame, hash_columns: dict, hash_mode: int) -> dict:
+    res = {}
+    for hash_column_name, columns in hash_columns.items():
+        first = pd.util.hash_pandas_object(chunk[columns], index=False, hash_key=FAST_HASH_KEYS[0]).to_numpy()
+        if hash_mode == HASH_MODE_FAST64:
+            res[hash_column_name] = first
+        else:
+            second = pd.util.hash_pandas_object(chunk[columns], index=False, hash_key=FAST_HASH_KEYS[1]).to_numpy()
+            pairs = np.column_stack([first, second]).astype('>u8')
+            res[hash_column_name] = pairs.view('V16').ravel().astype(object)
+    return res
+
+
+#########################################################
+# add_hash_column
 # Input: df: Dataframe dessen Spalten gehasht werden sollen
 #        columns: Liste mit Spalten die gehasht werden sollen
 #        hash_column_name: Name der neu angefügten Hash-Spalte
+#        hash_mode: HASH_MODE_MD5 (Default), HASH_MODE_FAST64 oder HASH_MODE_FAST128
+#        chunk_size: Anzahl Zeilen, die pro Block gehasht werden
 # Fügt die Spalte hash_column_name an das Dataframe df an, die 
 # die Spalten in der Liste columns nach md5 hasht und die Werte
-# mit dem Trennzeichen #? konkateniert
+# mit dem Trennzeichen #? konkateniert. Siehe compute_hashes
 # Output: Dataframe mit der neuen Spalte
 #########################################################
-def add_hash_column(df: pd.DataFrame, columns: list, hash_column_name: str) -> pd.DataFrame:
-    res = df.copy()
-    res[hash_column_name] = res[columns[0]].astype(str)
-    for column in columns[1:]:
-        res[hash_column_name] = res[hash_column_name] + "#?" + res[column].astype(str)
-    res.loc[:, hash_column_name] = res.loc[:, hash_column_name].apply(lambda x: md5(x.encode("utf8")).hexdigest())
+def add_hash_column(df: pd.DataFrame, columns: list, hash_column_name: str, hash_mode: int = HASH_MODE_MD5,
+                    chunk_size: int = HASH_CHUNK_SIZE) -> pd.DataFrame:
+    with measure_stage(STAGE_HASH, 'add_hash_column', rows_in=len(df), hash_column=hash_column_name,
+                       columns=list(columns), hash_mode=hash_mode) as metrics:
+        hashes = compute_hashes(df, {hash_column_name: columns}, hash_mode, chunk_size)
+        res = df.copy(deep=False)
+        res[hash_column_name] = hashes[hash_column_name]
+        metrics[METRIC_ROWS_OUT] = len(res)
     return res
 
   
@@ -101,31 +254,28 @@ def add_hash_column(df: pd.DataFrame, columns: list, hash_column_name: str) -> p
 # add_key_hash
 # Input: df: Dataframe, dessen Keys gehasht werden sollen
 #        key_columns: Liste mit den Spaltennamen des Keys
+#        hash_mode: HASH_MODE_MD5 (Default), HASH_MODE_FAST64 oder HASH_MODE_FAST128
 # Wrapperfunktion für add_hash_column. Gibt die Inputparameter
 # weiter und setzt als hash_column_name META_COLUMNS[COL_KEY_HASH] ein
 # Output: Dataframe mit META_COLUMNS[COL_KEY_HASH] Spalte
 #########################################################
-def add_key_hash(df: pd.DataFrame, key_columns: list) -> pd.DataFrame:
-    print("KEY_HASH Columns: " + str(key_columns))
-    return add_hash_column(df, key_columns, META_COLUMNS[COL_KEY_HASH])
+def add_key_hash(df: pd.DataFrame, key_columns: list, hash_mode: int = HASH_MODE_MD5) -> pd.DataFrame:
+    return add_hash_column(df, key_columns, META_COLUMNS[COL_KEY_HASH], hash_mode)
 
 
 #########################################################
 # add_record_hash
 # Input: df: Dataframe, dessen Values gehasht werden sollen
 #        exclude_columns: Liste mit Spalten, die nicht im Record gehasht werden sollen
+#        hash_mode: HASH_MODE_MD5 (Default), HASH_MODE_FAST64 oder HASH_MODE_FAST128
 # Wrapperfunktion für add_hash_column. Erzeugt die Liste an Spalten, die gehasht werden sollen.
 # Entfernt die Metadaten Spalten aus META_COLUMNS und die Spalten aus exclude_columns.
 # Setzt als hash_column_name META_COLUMNS[COL_RECORD_HASH] ein.
 # Output: Dataframe mit META_COLUMNS[COL_KEY_HASH] Spalte
 #########################################################
-def add_record_hash(df: pd.DataFrame, exclude_columns: list = None) -> pd.DataFrame:
-    column_filter = list(META_COLUMNS.values())
-    if exclude_columns is not None:
-        column_filter.extend(exclude_columns)
-    filtered_columns = list(filter(lambda x: x not in column_filter, df.columns))
-    print("RECORD_HASH Columns: " + str(filtered_columns))
-    return add_hash_column(df, filtered_columns, META_COLUMNS[COL_RECORD_HASH])
+def add_record_hash(df: pd.DataFrame, exclude_columns: list = None, hash_mode: int = HASH_MODE_MD5) -> pd.DataFrame:
+    filtered_columns = get_record_hash_columns(df.columns, exclude_columns)
+    return add_hash_column(df, filtered_columns, META_COLUMNS[COL_RECORD_HASH], hash_mode)
 
   
 #########################################################
@@ -134,19 +284,139 @@ def add_record_hash(df: pd.DataFrame, exclude_columns: list = None) -> pd.DataFr
 #        currents: Dictionary mit Zeitwerten. Muss die Werte CURRENT_RUN_TS und CURRENT_RUN_ID beinhalten.
 #        key_columns: Liste mit den Spaltennamen des Keys
 #        record_hash_exclude_columns: Liste mit Spalten, die nicht im Record gehasht werden sollen
+#        hash_mode: HASH_MODE_MD5 (Default), HASH_MODE_FAST64 oder HASH_MODE_FAST128
+#        compact: Boolean, ob die Metadatenspalten im kompakten Schema angelegt werden (siehe to_compact_meta_columns)
+#        record_hash_defaults: Dictionary {Spalte: Default}. Die Spalte geht nur in den Record-Hash ein, wenn ihr Wert
+#                              vom Default abweicht (siehe get_record_hash_options in SCDHelpers)
+#        record_hash_dtypes: Dictionary {Spalte: dtype}. Werte, die sich verlustfrei in den dtype umwandeln lassen,
+#                            werden in diesem dtype gehasht
 # Fügt Metadatenspalten an ein Dataframe an. Diese sind der Key-Hash, der Record-Hash, Insert/Update Timestamp
 # und Run-ID, Dateiname, in welchem der Datensatz zu finden ist und das Deleted Flag.
+# Key- und Record-Hash werden in einem gemeinsamen Durchlauf über df berechnet.
+# Output: Dataframe mit angefügten Metadatenspalten
+#########################################################
+def add_meta_columns(df: pd.DataFrame, currents: map, key_columns: list, record_hash_exclude_columns: list = None,
+                     hash_mode: int = HASH_MODE_MD5, compact: bool = False, record_hash_defaults: dict = None,
+                     record_hash_dtypes: dict = None) -> pd.DataFrame:
+    record_columns = get_record_hash_columns(df.columns, record_hash_exclude_columns)
+    with measure_stage(STAGE_HASH, 'add_meta_columns', currents.get(CURRENT_RUN_ID), len(df),
+                       key_columns=list(key_columns), record_columns=record_columns, hash_mode=hash_mode) as metrics:
+        hashes = compute_meta_hashes(df, key_columns, record_columns, hash_mode, compact, record_hash_defaults,
+                                     record_hash_dtypes)
+        res = assign_meta_columns(df, hashes, currents, compact)
+        metrics[METRIC_ROWS_OUT] = len(res)
+    return res
+
+
+#########################################################
+# compute_meta_hashes
+# Input: df: Dataframe dessen Spalten gehasht werden sollen
+#        key_columns: Liste mit den Spalten des KEY_HASH
+#        record_columns: Liste mit den Spalten des RECORD_HASH (siehe get_record_hash_columns)
+#        hash_mode, as_pairs: siehe compute_hashes
+#        record_hash_defaults, record_hash_dtypes: siehe add_meta_columns
+# KEY_HASH und RECORD_HASH für add_meta_columns und alle anderen Wege, die Metadatenspalten anlegen (Hash-Cache,
+# Arrow-Backend). Ohne record_hash_defaults und record_hash_dtypes ein Aufruf von compute_hashes.
+# Output: Dictionary {KEY_HASH: ..., RECORD_HASH: ...} wie von compute_hashes
+#########################################################
+def compute_meta_hashes(df: pd.DataFrame, key_columns: list, record_columns: list, hash_mode: int = HASH_MODE_MD5,
+                        as_pairs: bool = False, record_hash_defaults: dict = None,
+                        record_hash_dtypes: dict = None) -> dict:
+    record_hash_defaults = {column: value for column, value in (record_hash_defaults or {}).items()
+                            if column in record_columns}
+    record_hash_dtypes = {column: dtype for column, dtype in (record_hash_dtypes or {}).items()
+                          if column in record_columns}
+    if not record_hash_defaults and not record_hash_dtypes:
+        return compute_hashes(df, {META_COLUMNS[COL_KEY_HASH]: key_columns,
+                                   META_COLUMNS[COL_RECORD_HASH]: record_columns}, hash_mode, as_pairs=as_pairs)
+    res = compute_hashes(df, {META_COLUMNS[COL_KEY_HASH]: key_columns}, hash_mode, as_pairs=as_pairs)
+    res[META_COLUMNS[COL_RECORD_HASH]] = _compute_record_hashes(df, record_columns, record_hash_defaults,
+                                                                record_hash_dtypes, hash_mode, as_pairs)
+    return res
+
+
+def _get_default_mask(values: pd.Series, default) -> np.ndarray:
+    if default is None:
+        return values.isna().to_numpy()
+    try:
+        default = pd.Series([default]).astype(values.dtype).iloc[0]
+    except (ValueError, TypeError):
+        return np.zeros(len(values), dtype=bool)
+    return values.eq(default).fillna(False).to_numpy(dtype=bool)
+
+
+def _get_cast_mask(values: pd.Series, dtype) -> np.ndarray:
+    res = np.zeros(len(values), dtype=bool)
+    present = values.notna().to_numpy()
+    try:
+        cast = values[present].astype(dtype)
+        res[present] = cast.astype(values.dtype).eq(values[present]).to_numpy(dtype=bool)
+    except (ValueError, TypeError, OverflowError):
+        pass
+    return res
+
+
+def _compute_record_hashes(df: pd.DataFrame, record_columns: list, defaults: dict, dtypes: dict, hash_mode: int,
+                           compact: bool):
+    # Pro Zeile und Spalte: 0 unverändert hashen, 1 weglassen (Default), 2 im ursprünglichen dtype hashen.
+    # Zeilen mit gleichen Zuständen werden gemeinsam über compute_hashes gehasht.
+    optional = list(dict.fromkeys(list(defaults) + list(dtypes)))
+    states = np.zeros((len(df), len(optional)), dtype=np.int8)
+    for i, column in enumerate(optional):
+        if column in dtypes:
+            states[_get_cast_mask(df[column], dtypes[column]), i] = 2
+        if column in defaults:
+            states[_get_default_mask(df[column], defaults[column]), i] = 1
+    groups, inverse = np.unique(states, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    res = None
+    for group, group_states in enumerate(groups):
+        positions = np.flatnonzero(inverse == group)
+        columns = [column for column in record_columns
+                   if column not in optional or group_states[optional.index(column)] != 1]
+        chunk = df.iloc[positions][columns]
+        for i, column in enumerate(optional):
+            if group_states[i] == 2:
+                chunk[column] = chunk[column].astype(dtypes[column])
+        hashes = compute_hashes(chunk, {META_COLUMNS[COL_RECORD_HASH]: columns}, hash_mode,
+                                as_pairs=compact)[META_COLUMNS[COL_RECORD_HASH]]
+        if compact:
+            if res is None:
+                res = (np.zeros(len(df), dtype=np.uint64), np.zeros(len(df), dtype=np.uint64))
+            res[0][positions], res[1][positions] = hashes
+        else:
+            if res is None:
+                res = np.empty(len(df), dtype=hashes.dtype)
+            res[positions] = hashes
+    if res is None:
+        return compute_hashes(df, {META_COLUMNS[COL_RECORD_HASH]: record_columns}, hash_mode,
+                              as_pairs=compact)[META_COLUMNS[COL_RECORD_HASH]]
+    return res
+
+
+#########################################################
+# assign_meta_columns
+# Input: df: Dataframe, an das die Metadatenspalten angefügt werden sollen
+#        hashes: Dictionary {KEY_HASH: ..., RECORD_HASH: ...} wie von compute_hashes (mit as_pairs=compact)
+#        currents: Dictionary mit Zeitwerten. Muss die Werte CURRENT_RUN_TS und CURRENT_RUN_ID beinhalten.
+#        compact: Boolean, ob die Metadatenspalten im kompakten Schema angelegt werden
+# Fügt die Metadatenspalten mit bereits berechneten Hashes an (z.B. aus einem Hash-Cache, siehe HashCacheHelpers)
 # Output: Dataframe mit angefügten Metadatenspalten
 #########################################################
-def add_meta_columns(df: pd.DataFrame, currents: map, key_columns: list, record_hash_exclude_columns: list = None) \
-        -> pd.DataFrame:
-    df1 = add_key_hash(df, key_columns)
-    df2 = add_record_hash(df1, record_hash_exclude_columns)
-    res = df2
+def assign_meta_columns(df: pd.DataFrame, hashes: dict, currents: dict, compact: bool = False) -> pd.DataFrame:
+    res = df.copy(deep=False)
+    for column in COMPACT_HASH_COLUMNS:
+        name = META_COLUMNS[column]
+        if compact:
+            res[name + HASH_HIGH_SUFFIX] = hashes[name][0]
+            res[name + HASH_LOW_SUFFIX] = hashes[name][1]
+        else:
+            res[name] = hashes[name]
     res[META_COLUMNS[COL_INSERT_RUN_TS]] = pd.to_datetime(currents[CURRENT_RUN_TS])
     res[META_COLUMNS[COL_UPDATE_RUN_TS]] = pd.to_datetime(currents[CURRENT_RUN_TS])
-    res[META_COLUMNS[COL_INSERT_RUN_ID]] = currents[CURRENT_RUN_ID]
-    res[META_COLUMNS[COL_UPDATE_RUN_ID]] = currents[CURRENT_RUN_ID]
+    run_id = run_id_to_int(currents[CURRENT_RUN_ID]) if compact else currents[CURRENT_RUN_ID]
+    res[META_COLUMNS[COL_INSERT_RUN_ID]] = run_id
+    res[META_COLUMNS[COL_UPDATE_RUN_ID]] = run_id
     res[META_COLUMNS[COL_DELETED]] = pd.to_datetime('')
 
     return res
@@ -156,17 +426,273 @@ def add_meta_columns(df: pd.DataFrame, currents: map, key_columns: list, record_
 #########################################################
 # read_current_hashes
 # Input: path: Pfad der ausgelesen werden soll.
-# Lädt die Daten am gegebenen Pfad als Dataframe und selektiert nur die Hash-Spalten
-# Kommt es zu einem Fehler (z.B. liegen keine Daten vor am Pfad, Key-Spalten fehlen)
-# wird None zurückgegeben
+# Lädt nur die Hash-Spalten der Daten am gegebenen Pfad als Dataframe (bisheriges oder kompaktes Schema).
+# Liegen am Pfad keine Daten, wird None zurückgegeben. Andere Fehler werden weitergegeben.
 # Output: Dataframe nur mit Hash-Spalten oder None
 #########################################################
 def read_current_hashes(path: str):
-  try:
-    df = spark.read.parquet(path).select(META_COLUMNS[COL_KEY_HASH],META_COLUMNS[COL_RECORD_HASH])
-    return df
-  except:
+  if not os.path.exists(path):
     return None
+  try:
+    return pd.read_parquet(path, columns=[META_COLUMNS[COL_KEY_HASH], META_COLUMNS[COL_RECORD_HASH]])
+  except ValueError:
+    # Hash-Spalten fehlen: kompaktes Schema
+    return pd.read_parquet(path, columns=[META_COLUMNS[column] + suffix for column in COMPACT_HASH_COLUMNS
+                                          for suffix in (HASH_HIGH_SUFFIX, HASH_LOW_SUFFIX)])
+
+
+#########################################################
+# hash_to_uint64_pair
+# Input: values: Series oder Array mit Hashwerten eines hash_modes (md5 Hex-Strings, uint64 oder 16 Byte bytes)
+# Wandelt Hashwerte in zwei uint64 Arrays (high, low) um. md5 und HASH_MODE_FAST128 ergeben 128 bit,
+# bei HASH_MODE_FAST64 ist low immer 0. Vergleiche und Lookups laufen so auf Zahlen statt auf Strings.
+# Strings und bytes werden in Blöcken von HASH_PAIR_CHUNK_SIZE Werten umgewandelt, der zusätzliche Speicher hängt
+# damit von der Blockgröße ab und nicht von der Anzahl der Werte.
+# Output: Tuple (high, low) mit uint64 Arrays
+#########################################################
+def hash_to_uint64_pair(values) -> tuple:
+    values = values.to_numpy() if isinstance(values, (pd.Series, pd.Index)) else np.asarray(values)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64)
+    if values.dtype.kind in 'iu':
+        return values.astype(np.uint64), np.zeros(len(values), dtype=np.uint64)
+    is_hex = isinstance(values[0], str)
+    high = np.empty(len(values), dtype=np.uint64)
+    low = np.empty(len(values), dtype=np.uint64)
+    for start in range(0, len(values), HASH_PAIR_CHUNK_SIZE):
+        chunk = values[start:start + HASH_PAIR_CHUNK_SIZE]
+        buffer = bytes.fromhex(''.join(chunk)) if is_hex else b''.join(chunk)
+        pairs = np.frombuffer(buffer, dtype='>u8').reshape(-1, 2)
+        high[start:start + len(chunk)] = pairs[:, 0]
+        low[start:start + len(chunk)] = pairs[:, 1]
+    return high, low
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    res = values.astype(np.uint64)
+    res ^= res >> np.uint64(30)
+    res *= np.uint64(0xbf58476d1ce4e5b9)
+    res ^= res >> np.uint64(27)
+    res *= np.uint64(0x94d049bb133111eb)
+    res ^= res >> np.uint64(31)
+    return res
+
+
+#########################################################
+# get_hash_columns
+# Input: df: Dataframe mit Metadatenspalten
+#        column: COL_KEY_HASH oder COL_RECORD_HASH
+# Output: Liste mit den Spaltennamen des Hashes in df: [KEY_HASH] im bisherigen Schema,
+#         [KEY_HASH_HIGH, KEY_HASH_LOW] im kompakten Schema
+#########################################################
+def get_hash_columns(df: pd.DataFrame, column: int) -> list:
+    name = META_COLUMNS[column]
+    if name not in df.columns and name + HASH_HIGH_SUFFIX in df.columns:
+        return [name + HASH_HIGH_SUFFIX, name + HASH_LOW_SUFFIX]
+    return [name]
+
+
+#########################################################
+# get_hash_pair
+# Input: df: Dataframe mit Metadatenspalten (bisheriges oder kompaktes Schema)
+#        column: COL_KEY_HASH oder COL_RECORD_HASH
+# Liest einen Hash als uint64 Paar. Im kompakten Schema werden die Spalten ohne Umwandlung zurückgegeben.
+# Output: Tuple (high, low) mit uint64 Arrays
+#########################################################
+def get_hash_pair(df: pd.DataFrame, column: int) -> tuple:
+    columns = get_hash_columns(df, column)
+    if len(columns) == 1:
+        return hash_to_uint64_pair(df[columns[0]])
+    return (df[columns[0]].to_numpy(dtype=np.uint64, copy=False), df[columns[1]].to_numpy(dtype=np.uint64, copy=False))
+
+
+#########################################################
+# run_id_to_int / run_id_to_str
+# Input: values: einzelne Run-ID oder Series mit Run-IDs
+# Wandelt Run-IDs im Format RUN_ID_FORMAT in int64 (Mikrosekunden seit 1970) um und zurück. Run-IDs ohne
+# Mikrosekunden (vor RUN_ID_FORMAT mit %f) werden mit 0 aufgefüllt. Das int64 enthält nur den Zeitteil, der
+# UUID-Teil aus create_currents geht verloren: im kompakten Schema sind Run-IDs sortierbar und innerhalb eines
+# Prozesses eindeutig, aber nicht zwischen Prozessen, die im selben Mikrosekundenschritt starten.
+# Output: int bzw. Series mit int64 oder Strings
+#########################################################
+def run_id_to_int(values):
+    if isinstance(values, pd.Series):
+        ts = pd.to_datetime(values.astype(str).str.split(RUN_ID_SEPARATOR).str[0].str.ljust(20, '0'),
+                            format=RUN_ID_FORMAT)
+        return ts.astype('datetime64[us]').astype(np.int64)
+    values = str(values).split(RUN_ID_SEPARATOR)[0]
+    return int(np.datetime64(datetime.datetime.strptime(values.ljust(20, '0'), RUN_ID_FORMAT), 'us').astype(np.int64))
+
+
+def run_id_to_str(values):
+    if isinstance(values, pd.Series):
+        return pd.to_datetime(values.astype(np.int64), unit='us').dt.strftime(RUN_ID_FORMAT).astype(object)
+    return pd.Timestamp(int(values), unit='us').strftime(RUN_ID_FORMAT)
+
+
+#########################################################
+# to_compact_meta_columns
+# Input: df: Dataframe mit Metadatenspalten im bisherigen Schema
+# Kompaktes Schema für große Datenbestände:
+#   KEY_HASH / RECORD_HASH: je zwei uint64 Spalten <name>_HIGH und <name>_LOW statt 32 Zeichen langer Strings
+#   INSERT_RUN_ID / UPDATE_RUN_ID: int64 (siehe run_id_to_int) statt Strings
+# Die Zeitstempel sind bereits datetime64. Alle Spalten haben eine feste Breite, pro Lauf konstante Spalten
+# werden im parquet von der Kompression auf wenige Bytes pro Seite reduziert. Vergleiche über get_hash_pair
+# brauchen keine String-Umwandlung mehr. Bereits kompakte Spalten bleiben unverändert.
+# Output: Dataframe im kompakten Schema
+#########################################################
+def to_compact_meta_columns(df: pd.DataFrame) -> pd.DataFrame:
+    res = df.copy(deep=False)
+    for column in COMPACT_HASH_COLUMNS:
+        name = META_COLUMNS[column]
+        if name in res.columns:
+            high, low = hash_to_uint64_pair(res[name])
+            position = res.columns.get_loc(name)
+            res = res.drop(columns=[name])
+            res.insert(position, name + HASH_HIGH_SUFFIX, high)
+            res.insert(position + 1, name + HASH_LOW_SUFFIX, low)
+    for column in COMPACT_RUN_ID_COLUMNS:
+        name = META_COLUMNS[column]
+        if name in res.columns and res[name].dtype.kind not in 'iu':
+            res[name] = run_id_to_int(res[name])
+    return res
+
+
+#########################################################
+# to_legacy_meta_columns
+# Input: df: Dataframe mit Metadatenspalten im kompakten Schema
+#        hash_mode: hash_mode, mit dem die Hashes erzeugt wurden. Bestimmt die bisherige Darstellung
+#                   (md5 Hex-String, uint64 oder 16 Byte bytes, siehe compute_hashes)
+# Wandelt das kompakte Schema aus to_compact_meta_columns zurück in das bisherige Schema
+# Output: Dataframe im bisherigen Schema
+#########################################################
+def to_legacy_meta_columns(df: pd.DataFrame, hash_mode: int = HASH_MODE_MD5) -> pd.DataFrame:
+    res = df.copy(deep=False)
+    for column in COMPACT_HASH_COLUMNS:
+        name = META_COLUMNS[column]
+        if name + HASH_HIGH_SUFFIX in res.columns:
+            high, low = get_hash_pair(res, column)
+            position = res.columns.get_loc(name + HASH_HIGH_SUFFIX)
+            res = res.drop(columns=[name + HASH_HIGH_SUFFIX, name + HASH_LOW_SUFFIX])
+            res.insert(position, name, uint64_pair_to_hash(high, low, hash_mode))
+    for column in COMPACT_RUN_ID_COLUMNS:
+        name = META_COLUMNS[column]
+        if name in res.columns and res[name].dtype.kind in 'iu':
+            res[name] = run_id_to_str(res[name])
+    return res
+
+
+#########################################################
+# uint64_pair_to_hash
+# Input: high, low: uint64 Arrays (siehe hash_to_uint64_pair)
+#        hash_mode: hash_mode, dessen Darstellung erzeugt wird
+# Umkehrung von hash_to_uint64_pair
+# Output: Array mit md5 Hex-Strings, uint64 oder 16 Byte bytes
+#########################################################
+def uint64_pair_to_hash(high: np.ndarray, low: np.ndarray, hash_mode: int) -> np.ndarray:
+    if hash_mode == HASH_MODE_FAST64:
+        return high.astype(np.uint64)
+    pairs = np.column_stack([high, low]).astype('>u8')
+    if hash_mode == HASH_MODE_FAST128:
+        return pairs.view('V16').ravel().astype(object)
+    return np.frombuffer(pairs.tobytes().hex().encode('ascii'), dtype='S32').astype(str).astype(object)
+
+
+#########################################################
+# lookup_hash_pairs
+# Input: high, low: uint64 Arrays der Hashes, die gesucht werden
+#        values_high, values_low: uint64 Arrays der Hashes, in denen gesucht wird
+# Exakter Lookup auf 128 bit Hashes. Der Lookup läuft über eine uint64 Hashtabelle auf
+# einem Fingerprint beider Hälften und wird danach gegen beide Hälften verifiziert. Nur bei einer
+# Kollision des Fingerprints wird auf einen (langsameren) MultiIndex ausgewichen.
+# Output: int64 Array mit der Position des ersten Vorkommens von (high, low) in den values oder -1
+#########################################################
+def lookup_hash_pairs(high: np.ndarray, low: np.ndarray, values_high: np.ndarray, values_low: np.ndarray) -> np.ndarray:
+    values_fingerprint = values_high ^ _mix64(values_low)
+    unique_positions = np.flatnonzero(~pd.Index(values_fingerprint).duplicated())
+    unique_index = pd.Index(values_fingerprint[unique_positions])
+    unique_high = values_high[unique_positions]
+    unique_low = values_low[unique_positions]
+
+    values_pos = unique_index.get_indexer(values_fingerprint)
+    if ((unique_high[values_pos] == values_high) & (unique_low[values_pos] == values_low)).all():
+        pos = unique_index.get_indexer(high ^ _mix64(low))
+        found = pos >= 0
+        found[found] = (unique_high[pos[found]] == high[found]) & (unique_low[pos[found]] == low[found])
+        pos[~found] = -1
+    else:
+        values_index = pd.MultiIndex.from_arrays([values_high, values_low])
+        unique_positions = np.flatnonzero(~values_index.duplicated())
+        pos = values_index[unique_positions].get_indexer(pd.MultiIndex.from_arrays([high, low]))
+
+    res = np.full(len(high), -1, dtype=np.int64)
+    res[pos >= 0] = unique_positions[pos[pos >= 0]]
+    return res
+
+
+#########################################################
+# isin_hash_pairs
+# Input: high, low: uint64 Arrays der Hashes, die gesucht werden
+#        values_high, values_low: uint64 Arrays der Hashes, in denen gesucht wird
+# Exakter Mengentest auf 128 bit Hashes über lookup_hash_pairs
+# Output: Boolean Array, ob (high, low) in (values_high, values_low) vorkommt
+#########################################################
+def isin_hash_pairs(high: np.ndarray, low: np.ndarray, values_high: np.ndarray, values_low: np.ndarray) -> np.ndarray:
+    return lookup_hash_pairs(high, low, values_high, values_low) >= 0
+
+
+#########################################################
+# classify_hash_pairs
+# Input: current_key, current_record: Key- und Record-Hashes des aktuellen Datenbestands als (high, low) uint64 Arrays
+#        new_key, new_record: Key- und Record-Hashes der neugeladenen Daten als (high, low) uint64 Arrays
+# Klassifiziert jede neue Zeile in einem Durchlauf über die Hashes:
+#   DELTA_INSERT: Key-Hash kommt im aktuellen Datenbestand nicht vor
+#   DELTA_UPDATE: Key-Hash kommt vor, aber nicht mit diesem Record-Hash
+#   DELTA_UNCHANGED: Key-Hash und Record-Hash kommen gemeinsam vor
+# Es werden nur die Hashes als uint64 gehalten, keine Kopien der Dataframes.
+# Output: int8 Array mit einem DELTA_* Wert pro Zeile der neuen Daten
+#########################################################
+def classify_hash_pairs(current_key: tuple, current_record: tuple, new_key: tuple, new_record: tuple) -> np.ndarray:
+    key_found = isin_hash_pairs(new_key[0], new_key[1], current_key[0], current_key[1])
+    record_found = isin_hash_pairs(new_key[0] ^ _mix64(new_record[0]), new_key[1] ^ _mix64(new_record[1]),
+                                   current_key[0] ^ _mix64(current_record[0]),
+                                   current_key[1] ^ _mix64(current_record[1]))
+
+    res = np.full(len(key_found), DELTA_INSERT, dtype=np.int8)
+    res[key_found] = DELTA_UPDATE
+    res[key_found & record_found] = DELTA_UNCHANGED
+    return res
+
+
+#########################################################
+# classify_hashes
+# Input: current_key_hash, current_record_hash: Key- und Record-Hashes des aktuellen Datenbestands
+#        new_key_hash, new_record_hash: Key- und Record-Hashes der neugeladenen Daten
+# Wrapperfunktion für classify_hash_pairs. Wandelt die Hashwerte über hash_to_uint64_pair um.
+# Output: int8 Array mit einem DELTA_* Wert pro Zeile der neuen Daten
+#########################################################
+def classify_hashes(current_key_hash, current_record_hash, new_key_hash, new_record_hash) -> np.ndarray:
+    return classify_hash_pairs(hash_to_uint64_pair(current_key_hash), hash_to_uint64_pair(current_record_hash),
+                               hash_to_uint64_pair(new_key_hash), hash_to_uint64_pair(new_record_hash))
+
+
+#########################################################
+# classify_delta
+# Input: current_data: Dataframe, das den aktuellen Datenbestand beinhaltet. Es werden nur die Spalten
+#                      META_COLUMNS[COL_KEY_HASH] und META_COLUMNS[COL_RECORD_HASH] benötigt
+#        new_data: Dataframe, das die neugeladenen Daten beinhaltet. Muss META_COLUMNS als Spalten haben
+# Teilt new_data über classify_hashes in Inserts, Updates und unveränderte Datensätze auf
+# Output: 3 Dataframes (inserts, updates, unchanged) mit Zeilen aus new_data
+#########################################################
+def classify_delta(current_data: pd.DataFrame, new_data: pd.DataFrame):
+    with measure_stage(STAGE_DELTA, 'classify_delta', rows_in=len(new_data), current_rows=len(current_data)) as metrics:
+        delta_class = classify_hash_pairs(get_hash_pair(current_data, COL_KEY_HASH), get_hash_pair(current_data, COL_RECORD_HASH),
+                                          get_hash_pair(new_data, COL_KEY_HASH), get_hash_pair(new_data, COL_RECORD_HASH))
+        inserts = new_data[delta_class == DELTA_INSERT]
+        updates = new_data[delta_class == DELTA_UPDATE]
+        unchanged = new_data[delta_class == DELTA_UNCHANGED]
+        metrics[METRIC_ROWS_OUT] = len(inserts) + len(updates)
+    return inserts, updates, unchanged
 
 
 #########################################################
@@ -178,9 +704,11 @@ def read_current_hashes(path: str):
 # Output: Dataframe das nur Inserts und Updates aus new_data beinhaltet
 #########################################################
 def get_delta(current_data: pd.DataFrame, new_data: pd.DataFrame):
-  delta = new_data.join(current_data,
-                  (new_data[META_COLUMNS[COL_KEY_HASH]] == current_data[META_COLUMNS[COL_KEY_HASH]]) & (new_data[META_COLUMNS[COL_RECORD_HASH]] == current_data[META_COLUMNS[COL_RECORD_HASH]]),
-                  "leftanti")
+  with measure_stage(STAGE_DELTA, 'get_delta', rows_in=len(new_data), current_rows=len(current_data)) as metrics:
+    delta_class = classify_hash_pairs(get_hash_pair(current_data, COL_KEY_HASH), get_hash_pair(current_data, COL_RECORD_HASH),
+                                      get_hash_pair(new_data, COL_KEY_HASH), get_hash_pair(new_data, COL_RECORD_HASH))
+    delta = new_data[delta_class != DELTA_UNCHANGED]
+    metrics[METRIC_ROWS_OUT] = len(delta)
   return delta
 
 
@@ -192,7 +720,7 @@ def get_delta(current_data: pd.DataFrame, new_data: pd.DataFrame):
 # Output: Dataframe, das nur Inserts aus new_data beinhaltet
 #########################################################
 def get_inserts(current_data: pd.DataFrame, new_data: pd.DataFrame):
-  inserts = new_data.join(current_data,new_data[META_COLUMNS[COL_KEY_HASH]] == current_data[META_COLUMNS[COL_KEY_HASH]],"leftanti")
+  inserts, updates, unchanged = classify_delta(current_data, new_data)
   return inserts
 
 
@@ -204,6 +732,5 @@ def get_inserts(current_data: pd.DataFrame, new_data: pd.DataFrame):
 # Output: Dataframe, das nur Updates aus new_data beinhaltet
 #########################################################
 def get_updates(current_data: pd.DataFrame, new_data: pd.DataFrame):
-  updates = new_data.join(current_data,
-                  (new_data[META_COLUMNS[COL_KEY_HASH]] == current_data[META_COLUMNS[COL_KEY_HASH]]) & (new_data[META_COLUMNS[COL_RECORD_HASH]] != current_data[META_COLUMNS[COL_RECORD_HASH]]))
-  return updates
\ No newline at end of file
+  inserts, updates, unchanged = classify_delta(current_data, new_data)
+  return updates
@@ -0,0 +1,360 @@
+from src.PandasETLHelpers.ArrowHelpers import *
+
+#########################################################
+# pipeline constants
+#########################################################
+PLAN_SOURCE = 'source'
+PLAN_SELECT = 'select'
+PLAN_META_COLUMNS = 'meta_columns'
+PLAN_DELTA = 'delta'
+PLAN_SCD2 = 'scd2'
+PLAN_SINK = 'sink'
+
+PLAN_STEP_ORDER = {PLAN_SOURCE: 0, PLAN_SELECT: 1, PLAN_META_COLUMNS: 2, PLAN_DELTA: 3, PLAN_SCD2: 3, PLAN_SINK: 4}
+
+SOURCE_CSV = 'csv'
+SOURCE_DATAFRAME = 'dataframe'
+
+OP_READ_CSV = 'read_csv'
+OP_SELECT = 'select'
+OP_ADD_META_COLUMNS = 'add_meta_columns'
+OP_DELTA_BY_INDEX = 'get_delta_by_index'
+OP_APPEND_DELTA_CHUNKS = 'append_delta_chunks'
+OP_APPEND_STORE = 'append_parquet_df'
+OP_HISTORIZE_TO_STORE = 'historize_to_store'
+OP_READ_CSV_TABLE = 'read_csv_table'
+OP_ADD_META_COLUMNS_TABLE = 'add_meta_columns_table'
+OP_DELTA_TABLE = 'get_delta_table'
+OP_APPEND_DELTA_TABLE = 'append_delta_table'
+OP_APPEND_TABLE = 'append_table'
+OP_TABLE_TO_DF = 'table_to_df'
+
+
+#########################################################
+# create_plan
+# Ein Plan beschreibt einen Lauf deklarativ als Folge von Schritten:
+#   Quelle (plan_csv_source / plan_df_source) -> optional Projektion (plan_select) -> Metadatenspalten
+#   (plan_meta_columns) -> optional Strategie (plan_delta / plan_scd2) -> optional Ziel (plan_store_sink)
+# Die plan_* Funktionen geben jeweils einen neuen Plan zurück und führen nichts aus. Erst run_plan optimiert den
+# Plan (siehe optimize_plan) und führt ihn aus, explain_plan zeigt den Plan vor und nach der Optimierung.
+# Output: leerer Plan (Dictionary)
+#########################################################
+def create_plan() -> dict:
+    return {'steps': []}
+
+
+def _add_step(plan: dict, step: dict) -> dict:
+    steps = plan['steps']
+    if len(steps) == 0 and step['kind'] != PLAN_SOURCE:
+        raise ValueError('A plan has to start with a source')
+    if len(steps) > 0 and PLAN_STEP_ORDER[step['kind']] <= PLAN_STEP_ORDER[steps[-1]['kind']]:
+        raise ValueError('Step ' + step['kind'] + ' cannot follow ' + steps[-1]['kind'] +
+                         '. Order: source, select, meta_columns, delta or scd2, sink')
+    return {'steps': steps + [step]}
+
+
+#########################################################
+# plan_csv_source / plan_df_source
+# Input: plan: Plan aus create_plan
+#        path: Pfad der Quelldatei (CSV)
+#        read_options: Dictionary mit weiteren Parametern für pd.read_csv
+#        chunk_size: Anzahl Zeilen pro Chunk. Ist sie gesetzt, wird die Quelle in Chunks gelesen, sofern die
+#                    Strategie das zulässt (siehe optimize_plan)
+#        df: Dataframe als Quelle
+# Output: Plan mit der Quelle
+#########################################################
+def plan_csv_source(plan: dict, path: str, read_options: dict = None, chunk_size: int = None) -> dict:
+    read_options = dict(read_options or {})
+    if 'usecols' in read_options or 'chunksize' in read_options:
+        raise ValueError('Use plan_select and chunk_size instead of usecols and chunksize in read_options')
+    return _add_step(plan, {'kind': PLAN_SOURCE, 'type': SOURCE_CSV, 'path': path, 'read_options': read_options,
+                            'chunk_size': chunk_size})
+
+
+def plan_df_source(plan: dict, df: pd.DataFrame) -> dict:
+    return _add_step(plan, {'kind': PLAN_SOURCE, 'type': SOURCE_DATAFRAME, 'df': df, 'chunk_size': None})
+
+
+#########################################################
+# plan_select
+# Input: plan: Plan mit Quelle
+#        columns: Liste mit den Spalten der Quelle, die geladen werden. Die Reihenfolge der Quelle bleibt erhalten
+# Output: Plan mit Projektion
+#########################################################
+def plan_select(plan: dict, columns: list) -> dict:
+    return _add_step(plan, {'kind': PLAN_SELECT, 'columns': list(columns)})
+
+
+#########################################################
+# plan_meta_columns
+# Input: plan: Plan mit Quelle
+#        key_columns, record_hash_exclude_columns, hash_mode, compact: siehe add_meta_columns
+# Output: Plan mit Metadatenspalten
+#########################################################
+def plan_meta_columns(plan: dict, key_columns: list, record_hash_exclude_columns: list = None,
+                      hash_mode: int = HASH_MODE_MD5, compact: bool = False) -> dict:
+    return _add_step(plan, {'kind': PLAN_META_COLUMNS, 'key_columns': list(key_columns),
+                            'record_hash_exclude_columns': list(record_hash_exclude_columns or []),
+                            'hash_mode': hash_mode, 'compact': compact})
+
+
+#########################################################
+# plan_delta / plan_scd2
+# Input: plan: Plan mit Metadatenspalten
+#        current_path: Dataset, gegen dessen Hash-Index das Delta bestimmt wird. None nimmt das Ziel aus
+#                      plan_store_sink
+#        valid_from_mode, valid_from_date, full_load, deleted_keys: siehe historize_to_store
+# plan_delta: nur Inserts und Updates gegenüber current_path werden weitergegeben (get_delta_by_index)
+# plan_scd2: der Lauf wird nach SCD Typ 2 in das Ziel historisiert (historize_to_store), braucht plan_store_sink
+# Output: Plan mit Strategie
+#########################################################
+def plan_delta(plan: dict, current_path: str = None) -> dict:
+    return _add_step(plan, {'kind': PLAN_DELTA, 'current_path': current_path})
+
+
+def plan_scd2(plan: dict, valid_from_mode: int, valid_from_date: str = None, full_load: bool = False,
+              deleted_keys: pd.DataFrame = None) -> dict:
+    return _add_step(plan, {'kind': PLAN_SCD2, 'valid_from_mode': valid_from_mode, 'valid_from_date': valid_from_date,
+                            'full_load': full_load, 'deleted_keys': deleted_keys})
+
+
+#########################################################
+# plan_store_sink
+# Input: plan: Plan mit Metadatenspalten
+#        path: Pfad des Datasets (bei plan_scd2 das SCD2 Dataset, siehe get_active_path)
+#        partitioning: Dictionary aus create_partitioning für neue Datasets
+# Ohne Ziel gibt run_plan das Ergebnis als Dataframe zurück
+# Output: Plan mit Ziel
+#########################################################
+def plan_store_sink(plan: dict, path: str, partitioning: dict = None) -> dict:
+    return _add_step(plan, {'kind': PLAN_SINK, 'path': path, 'partitioning': partitioning})
+
+
+def _operator(name: str, function, details: str, notes: list = None) -> dict:
+    return {'operator': name, 'function': function, 'details': details, 'notes': notes or []}
+
+
+def _read_operator(source: dict, columns: list, chunked: bool, backend: str = BACKEND_PANDAS) -> dict:
+    if backend == BACKEND_ARROW:
+        return _read_table_operator(source, columns)
+    if source['type'] == SOURCE_DATAFRAME:
+        df = source['df']
+        if columns is None:
+            return _operator(OP_SELECT, lambda state, currents: df,
+                             'dataframe with ' + str(len(df)) + ' rows, ' + str(len(df.columns)) + ' columns')
+        selected = [column for column in df.columns if column in columns]
+        return _operator(OP_SELECT, lambda state, currents: df[selected],
+                         'dataframe columns=' + str(selected), ['projection applied before hashing'])
+
+    read_options = dict(source['read_options'])
+    notes = []
+    if columns is not None:
+        read_options['usecols'] = columns
+        notes.append('projection pushed into read_csv (usecols)')
+    if chunked:
+        read_options['chunksize'] = source['chunk_size']
+        notes.append('source streamed in chunks of ' + str(source['chunk_size']) + ' rows')
+
+    def function(state, currents):
+        with measure_stage(STAGE_READ, OP_READ_CSV, source=source['path']) as metrics:
+            res = pd.read_csv(source['path'], **read_options)
+            metrics[METRIC_BYTES_READ] = os.path.getsize(source['path'])
+            if not chunked:
+                metrics[METRIC_ROWS_OUT] = len(res)
+        return res
+
+    return _operator(OP_READ_CSV, function, source['path'] + ' ' + str(read_options), notes)
+
+
+def _read_table_operator(source: dict, columns: list) -> dict:
+    notes = ['chunk_size ignored, the arrow backend reads the whole source'] if source['chunk_size'] else []
+    if source['type'] == SOURCE_DATAFRAME:
+        df = source['df']
+        selected = list(df.columns) if columns is None else [column for column in df.columns if column in columns]
+        return _operator(OP_SELECT, lambda state, currents: pa.Table.from_pandas(df[selected], preserve_index=False),
+                         'dataframe columns=' + str(selected), notes + ['dataframe converted to an arrow table'])
+    if source['read_options']:
+        raise ValueError('read_options are pd.read_csv parameters and not supported by the arrow backend')
+    if columns is not None:
+        notes.append('projection pushed into the arrow csv reader (include_columns)')
+    return _operator(OP_READ_CSV_TABLE, lambda state, currents: read_csv_table(source['path'], columns=columns),
+                     source['path'] + ' columns=' + str(columns), notes)
+
+
+#########################################################
+# optimize_plan
+# Input: plan: Plan aus den plan_* Funktionen
+# Übersetzt den Plan in die Operatoren, die run_plan ausführt:
+#   - Projektion: plan_select wird als usecols in pd.read_csv geschoben, nicht geladene Spalten fallen damit vor
+#     dem Hashen weg. Ausgeschlossene Record-Hash Spalten, die nicht geladen werden, werden ignoriert
+#   - Fusion: Delta in dasselbe Dataset, das auch Ziel ist, wird zu einem append_delta_chunks zusammengefasst.
+#     Hashen, Klassifizieren gegen den Hash-Index und Schreiben passieren pro Chunk, es entsteht weder ein
+#     Zwischen-Dataframe des ganzen Laufs noch eine Kopie für das Delta. Ohne chunk_size ist die ganze Quelle
+#     ein Chunk
+#   - SCD2: historize_to_store braucht den ganzen Lauf, chunk_size wird ignoriert. Unveränderte Datensätze werden
+#     dort bereits über den Hash-Index aussortiert
+# Mit backend=BACKEND_ARROW bleiben die Daten als Arrow-Tabelle (siehe ArrowHelpers): Lesen mit dem Arrow-Reader
+# (ohne Chunks), Delta als Anti-Join mit Arrow und Schreiben mit pyarrow.parquet. Für plan_scd2 und ohne Ziel wird
+# die Tabelle an der Grenze zur pandas-API umgewandelt (table_to_df).
+# Ungültige Kombinationen (z.B. plan_scd2 ohne Ziel, Key-Spalten außerhalb von plan_select) ergeben einen ValueError.
+# Output: Liste mit Operatoren (Dictionaries mit operator, function, details, notes)
+#########################################################
+def optimize_plan(plan: dict, backend: str = BACKEND_PANDAS) -> list:
+    if backend not in [BACKEND_PANDAS, BACKEND_ARROW]:
+        raise ValueError('Unknown backend ' + str(backend))
+    steps = {step['kind']: step for step in plan['steps']}
+    source = steps.get(PLAN_SOURCE)
+    if source is None:
+        raise ValueError('A plan has to start with a source')
+    meta = steps.get(PLAN_META_COLUMNS)
+    strategy = steps.get(PLAN_DELTA) or steps.get(PLAN_SCD2)
+    sink = steps.get(PLAN_SINK)
+    if meta is None and (strategy is not None or sink is not None):
+        raise ValueError('delta, scd2 and sink need meta_columns')
+
+    columns = steps[PLAN_SELECT]['columns'] if PLAN_SELECT in steps else None
+    meta_notes = []
+    if meta is not None and columns is not None:
+        missing = [column for column in meta['key_columns'] if column not in columns]
+        if missing:
+            raise ValueError('Key columns ' + str(missing) + ' are not selected')
+        excluded = [column for column in meta['record_hash_exclude_columns'] if column in columns]
+        if len(excluded) < len(meta['record_hash_exclude_columns']):
+            meta_notes.append('record_hash_exclude_columns not selected are ignored')
+        meta = dict(meta, record_hash_exclude_columns=excluded)
+
+    if strategy is not None and strategy['kind'] == PLAN_SCD2:
+        if sink is None:
+            raise ValueError('scd2 needs a store sink')
+        notes = ['chunk_size ignored, historize_to_store needs the whole run'] if source['chunk_size'] else []
+        operators = [_read_operator(source, columns, False, backend),
+                     _meta_operator(meta, meta_notes, backend, get_active_path(sink['path']))]
+        if backend == BACKEND_ARROW:
+            operators.append(_to_df_operator())
+        return operators + [_operator(OP_HISTORIZE_TO_STORE, lambda state, currents: historize_to_store(
+                    state, sink['path'], currents, strategy['valid_from_mode'], strategy['valid_from_date'],
+                    sink['partitioning'], strategy['full_load'], strategy['deleted_keys']),
+                    'base_path=' + sink['path'] + ' valid_from_mode=' + str(strategy['valid_from_mode']) +
+                    ' full_load=' + str(strategy['full_load']),
+                    notes + ['unchanged rows dropped via the hash index before active files are read'])]
+
+    if strategy is not None:
+        current_path = strategy['current_path'] or (sink['path'] if sink is not None else None)
+        if current_path is None:
+            raise ValueError('delta needs a current_path or a store sink')
+        if sink is not None and current_path == sink['path'] and backend == BACKEND_ARROW:
+            return [_read_operator(source, columns, False, backend),
+                    _meta_operator(meta, meta_notes, backend, sink['path']),
+                    _operator(OP_APPEND_DELTA_TABLE, lambda state, currents: append_delta_table(
+                        state, sink['path'], sink['partitioning']), 'path=' + sink['path'],
+                        ['fused delta + sink: anti-join against the hash index and write without a dataframe'])]
+        if sink is not None and current_path == sink['path']:
+            return [_read_operator(source, columns, bool(source['chunk_size'])),
+                    _operator(OP_APPEND_DELTA_CHUNKS, lambda state, currents: append_delta_chunks(
+                        state if source['chunk_size'] else [state], sink['path'],
+                        currents, meta['key_columns'], meta['record_hash_exclude_columns'], meta['hash_mode'],
+                        sink['partitioning'], meta['compact']),
+                        'path=' + sink['path'] + ' key_columns=' + str(meta['key_columns']) + ' hash_mode=' +
+                        str(meta['hash_mode']) + ' compact=' + str(meta['compact']),
+                        meta_notes + ['fused add_meta_columns + delta + sink: hash, classify against the hash '
+                                      'index and write per chunk, one manifest commit'])]
+        operators = [_read_operator(source, columns, False, backend),
+                     _meta_operator(meta, meta_notes, backend, current_path)]
+        delta_function = get_delta_table if backend == BACKEND_ARROW else get_delta_by_index
+        operators.append(_operator(OP_DELTA_TABLE if backend == BACKEND_ARROW else OP_DELTA_BY_INDEX,
+                                   lambda state, currents: delta_function(current_path, state),
+                                   'current_path=' + current_path))
+    else:
+        operators = [_read_operator(source, columns, False, backend)]
+        if meta is not None:
+            operators.append(_meta_operator(meta, meta_notes, backend, None if sink is None else sink['path']))
+    if sink is not None and backend == BACKEND_ARROW:
+        operators.append(_operator(OP_APPEND_TABLE, lambda state, currents: _append_store_table(state, sink),
+                                   'path=' + sink['path']))
+    elif sink is not None:
+        operators.append(_operator(OP_APPEND_STORE, lambda state, currents: _append_store(state, sink),
+                                   'path=' + sink['path']))
+    elif backend == BACKEND_ARROW:
+        operators.append(_to_df_operator())
+    return operators
+
+
+def _to_df_operator() -> dict:
+    return _operator(OP_TABLE_TO_DF, lambda state, currents: table_to_df(state), 'arrow table to dataframe',
+                     ['conversion at the pandas API boundary'])
+
+
+def _meta_operator(meta: dict, notes: list, backend: str = BACKEND_PANDAS, schema_path: str = None) -> dict:
+    # Die Regeln für den Record-Hash kommen beim Ausführen aus dem Schema des Ziels (siehe get_record_hash_options)
+    function = add_meta_columns_table if backend == BACKEND_ARROW else add_meta_columns
+    return _operator(OP_ADD_META_COLUMNS_TABLE if backend == BACKEND_ARROW else OP_ADD_META_COLUMNS,
+                     lambda state, currents: function(state, currents, meta['key_columns'],
+                                                      meta['record_hash_exclude_columns'], meta['hash_mode'],
+                                                      meta['compact'], **_get_record_hash_options(schema_path)),
+                     'key_columns=' + str(meta['key_columns']) + ' record_hash_exclude_columns=' +
+                     str(meta['record_hash_exclude_columns']) + ' hash_mode=' + str(meta['hash_mode']) +
+                     ' compact=' + str(meta['compact']), notes)
+
+
+def _get_record_hash_options(schema_path: str) -> dict:
+    if schema_path is None:
+        return {}
+    return get_record_hash_options(schema_path)
+
+
+def _append_store(df: pd.DataFrame, sink: dict) -> dict:
+    append_parquet_df(df, sink['path'], partitioning=sink['partitioning'])
+    return {'rows': len(df), 'delta_rows': len(df)}
+
+
+def _append_store_table(table, sink: dict) -> dict:
+    append_table(table, sink['path'], partitioning=sink['partitioning'])
+    return {'rows': table.num_rows, 'delta_rows': table.num_rows}
+
+
+def _describe_step(step: dict) -> str:
+    values = []
+    for key, value in step.items():
+        if key == 'kind' or value is None:
+            continue
+        if isinstance(value, pd.DataFrame):
+            value = 'dataframe(' + str(len(value)) + ' rows)'
+        values.append(key + '=' + str(value))
+    return ' '.join([step['kind']] + values)
+
+
+#########################################################
+# explain_plan
+# Input: plan: Plan aus den plan_* Funktionen
+#        backend: BACKEND_PANDAS oder BACKEND_ARROW (siehe optimize_plan)
+# Output: String mit dem Plan wie deklariert und den Operatoren nach optimize_plan (inkl. angewandter Regeln)
+#########################################################
+def explain_plan(plan: dict, backend: str = BACKEND_PANDAS) -> str:
+    lines = ['== Logical plan ==']
+    lines.extend(str(position + 1) + '. ' + _describe_step(step) for position, step in enumerate(plan['steps']))
+    lines.append('== Optimized plan ==')
+    for position, operator in enumerate(optimize_plan(plan, backend)):
+        lines.append(str(position + 1) + '. ' + operator['operator'] + ' ' + operator['details'])
+        lines.extend('     ' + note for note in operator['notes'])
+    return '\n'.join(lines)
+
+
+#########################################################
+# run_plan
+# Input: plan: Plan aus den plan_* Funktionen
+#        currents: Dictionary aus create_currents. None erzeugt neue currents
+#        backend: BACKEND_PANDAS oder BACKEND_ARROW (braucht pyarrow, siehe optimize_plan)
+# Optimiert den Plan und führt ihn aus. Alle Stufen werden mit der Run-ID gemessen (siehe measure_stage)
+# Output: mit Ziel ein Dictionary mit Statistiken und run_id (bei plan_scd2 wie historize_to_store, sonst rows und
+#         delta_rows), ohne Ziel das Ergebnis als Dataframe
+#########################################################
+def run_plan(plan: dict, currents: dict = None, backend: str = BACKEND_PANDAS):
+    if currents is None:
+        currents = create_currents()
+    state = None
+    with metrics_run(currents[CURRENT_RUN_ID]):
+        for operator in optimize_plan(plan, backend):
+            state = operator['function'](state, currents)
+    if isinstance(state, dict):
+        state = dict(state, run_id=currents[CURRENT_RUN_ID])
+    return state
@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+import contextvars
+from contextlib import contextmanager
+
+#########################################################
+# run metrics constants
+#########################################################
+STAGE_READ = 'read'
+STAGE_HASH = 'hash'
+STAGE_DELTA = 'delta'
+STAGE_MERGE = 'merge'
+STAGE_WRITE = 'write'
+
+METRIC_RUN_ID = 'run_id'
+METRIC_STAGE = 'stage'
+METRIC_NAME = 'name'
+METRIC_STARTED = 'started'
+METRIC_WALL_SECONDS = 'wall_seconds'
+METRIC_CPU_SECONDS = 'cpu_seconds'
+METRIC_ROWS_IN = 'rows_in'
+METRIC_ROWS_OUT = 'rows_out'
+METRIC_BYTES_READ = 'bytes_read'
+METRIC_BYTES_WRITTEN = 'bytes_written'
+METRIC_RSS_START_BYTES = 'rss_start_bytes'
+METRIC_RSS_END_BYTES = 'rss_end_bytes'
+METRIC_RSS_DELTA_BYTES = 'rss_delta_bytes'
+METRIC_ERROR = 'error'
+
+_METRICS_SINK = None
+_METRICS_RUN_ID = contextvars.ContextVar('metrics_run_id', default=None)
+
+
+#########################################################
+# set_metrics_sink
+# Input: sink: Funktion, die pro Stufe mit einem Dictionary aufgerufen wird (z.B. aus create_json_lines_sink
+#              oder list.append). None schaltet die Metriken aus (Default)
+# Setzt die Senke für alle Threads des Prozesses. Prozesse eines ProcessPoolExecutor erben die Senke nur, wenn sie
+# per fork gestartet werden.
+# Output: die bisherige Senke
+#########################################################
+def set_metrics_sink(sink):
+    global _METRICS_SINK
+    previous = _METRICS_SINK
+    _METRICS_SINK = sink
+    return previous
+
+
+def get_metrics_sink():
+    return _METRICS_SINK
+
+
+#########################################################
+# create_json_lines_sink
+# Input: target: Pfad einer Datei, an die angehängt wird, oder ein Stream mit write (z.B. sys.stderr)
+# Jede Stufe wird als eine Zeile JSON geschrieben. Eine Datei wird pro Zeile im Append-Modus geöffnet, damit
+# mehrere Prozesse in dieselbe Datei schreiben können
+# Output: Senke für set_metrics_sink
+#########################################################
+def create_json_lines_sink(target=None):
+    target = sys.stderr if target is None else target
+    lock = threading.Lock()
+
+    def sink(metrics: dict):
+        line = json.dumps(metrics, default=str) + '\n'
+        with lock:
+            if isinstance(target, (str, os.PathLike)):
+                with open(target, 'a') as file:
+                    file.write(line)
+            else:
+                target.write(line)
+                target.flush()
+
+    return sink
+
+
+#########################################################
+# metrics_run
+# Input: run_id: Run-ID (CURRENT_RUN_ID aus create_currents)
+# Kontextmanager, der run_id an alle Stufen hängt, die innerhalb des Blocks ohne eigene run_id gemessen werden
+# (z.B. das Lesen und Schreiben von Dateien innerhalb von historize_to_store)
+#########################################################
+@contextmanager
+def metrics_run(run_id):
+    token = _METRICS_RUN_ID.set(run_id)
+    try:
+        yield
+    finally:
+        _METRICS_RUN_ID.reset(token)
+
+
+def _get_current_rss():
+    # aktuelle RSS aus /proc (ru_maxrss ist der Höchststand seit Prozessstart und daher keiner Stufe zuzuordnen)
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+#########################################################
+# measure_stage
+# Input: stage: STAGE_READ, STAGE_HASH, STAGE_DELTA, STAGE_MERGE oder STAGE_WRITE
+#        name: Name der gemessenen Funktion
+#        run_id: Run-ID. None übernimmt die Run-ID aus metrics_run
+#        rows_in: Anzahl Eingangszeilen
+#        attributes: weitere Werte, die mit ausgegeben werden (z.B. die gehashten Spalten)
+# Kontextmanager, der ein Dictionary liefert, in das der Block rows_out, bytes_read oder bytes_written einträgt.
+# Am Ende des Blocks werden Wall- und CPU-Zeit (des Prozesses) und die aktuelle RSS des Prozesses zu Beginn und am
+# Ende des Blocks sowie deren Differenz ergänzt und das Dictionary an die Senke übergeben. Die Differenz ist der
+# Speicher, den die Stufe behält (z.B. ihr Ergebnis), nicht ihr Höchststand. Ohne /proc (z.B. unter macOS oder
+# Windows) bleiben die RSS-Werte None. Ohne Senke wird nichts gemessen.
+#########################################################
+@contextmanager
+def measure_stage(stage: str, name: str, run_id=None, rows_in: int = None, **attributes):
+    sink = _METRICS_SINK
+    if sink is None:
+        yield {}
+        return
+    metrics = {METRIC_RUN_ID: run_id if run_id is not None else _METRICS_RUN_ID.get(), METRIC_STAGE: stage,
+               METRIC_NAME: name, METRIC_STARTED: datetime.datetime.now().isoformat(), METRIC_ROWS_IN: rows_in,
+               METRIC_ROWS_OUT: None, METRIC_BYTES_READ: None, METRIC_BYTES_WRITTEN: None}
+    metrics.update(attributes)
+    rss = _get_current_rss()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield metrics
+    except BaseException as error:
+        metrics[METRIC_ERROR] = type(error).__name__
+        raise
+    finally:
+        metrics[METRIC_WALL_SECONDS] = time.perf_counter() - wall
+        metrics[METRIC_CPU_SECONDS] = time.process_time() - cpu
+        metrics[METRIC_RSS_START_BYTES] = rss
+        metrics[METRIC_RSS_END_BYTES] = _get_current_rss()
+        metrics[METRIC_RSS_DELTA_BYTES] = None if rss is None or metrics[METRIC_RSS_END_BYTES] is None \
+            else metrics[METRIC_RSS_END_BYTES] - rss
+        sink(metrics)
@@ -1,78 +1,106 @@
+import os
+import json
+import uuid
+import datetime
+import threading
+import contextvars
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import fastparquet
 from src.PandasETLHelpers.MetaColumnHelpers import *
 
+#########################################################
+# store constants
+#########################################################
+PARQUET_ENGINE = 'fastparquet'
+
+HASH_INDEX_DIR = '_hash_index'
+INDEX_KEY_HASH_HIGH = 'KEY_HASH_HIGH'
+INDEX_KEY_HASH_LOW = 'KEY_HASH_LOW'
+INDEX_RECORD_HASH_HIGH = 'RECORD_HASH_HIGH'
+INDEX_RECORD_HASH_LOW = 'RECORD_HASH_LOW'
+INDEX_FILE = 'FILE'
+INDEX_BUCKET = 'KEY_BUCKET'
+INDEX_COLUMNS = [INDEX_KEY_HASH_HIGH, INDEX_KEY_HASH_LOW, INDEX_RECORD_HASH_HIGH, INDEX_RECORD_HASH_LOW, INDEX_BUCKET,
+                 INDEX_FILE]
+
+INDEX_ROW_GROUP_MIN_ROWS = 100000
+
+INTERVAL_INDEX_DIR = '_interval_index'
+SNAPSHOT_DIR = '_snapshot'
+SNAPSHOT_SUFFIX = '.arrow'
+
+PARTITION_BUCKET_COLUMN = 'KEY_BUCKET'
+PARTITION_DATE_COLUMN = 'INSERT_DATE'
+PARTITION_DERIVED_COLUMNS = [PARTITION_BUCKET_COLUMN, PARTITION_DATE_COLUMN]
+BUCKET_MODE_MODULO = 1
+BUCKET_MODE_PREFIX = 2
+MAX_BUCKET_COUNT = 65536
 
-'''#########################################################
+ACTIVE_DATASET = 'active'
+HISTORY_DATASET = 'history'
+PENDING_HISTORY = 'pending_history'
+
+MANIFEST_FILE = '_manifest.json'
+MANIFEST_FORMAT_VERSION = 1
+COMPACTION_TARGET_ROWS = 1000000
+PENDING_WRITES = 2
+
+_MANIFEST_LOCK = threading.RLock()
+_COMPACTION_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='compaction')
+
+
+#########################################################
 # create_empty_hist_dataframe
 # Input: df: Dataframe, dessen Schema umd SCD Typ 2 Historisierungsspalten erweitert werden soll
 # Erzeugt ein leeres Dataframe mit dem Schema von df, das erweitert wird um die Spalten META_COLUMNS[COL_VALID_FROM] und META_COLUMNS[COL_VALID_TO] 
 # Output: Dataframe mit zusätzlichen Spalten META_COLUMNS[COL_VALID_FROM] und META_COLUMNS[COL_VALID_TO]
 #########################################################
 def create_empty_hist_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-  res = pd.DataFrame(columns=df.columns)
-  res[META_COLUMNS[COL_VALID_FROM]] = pd.to_datetime('')
-  res[META_COLUMNS[COL_VALID_TO]] = pd.to_datetime('')
-  res = create_dataframe_with_schema(df.schema) \
-        .withColumn(META_COLUMNS[COL_VALID_FROM],psf.lit(None).cast(pst.DateType())) \
-        .withColumn(META_COLUMNS[COL_VALID_TO],psf.lit(None).cast(pst.DateType()))
-  
+  res = create_dataframe_with_schema(df.dtypes)
+  res[META_COLUMNS[COL_VALID_FROM]] = pd.Series(dtype=SCD2_DATE_DTYPE)
+  res[META_COLUMNS[COL_VALID_TO]] = pd.Series(dtype=SCD2_DATE_DTYPE)
   return res
 
 #########################################################
 # create_dataframe_with_schema
-# Input: schema: Schema des leeren Dataframes, das erzeugt werden soll
+# Input: schema: Series mit den dtypes der Spalten (z.B. df.dtypes)
 # Erzeugt ein leeres Dataframe mit gegebenem Schema
 # Output: Dataframe mit gegebenem Schema
 #########################################################
-def create_dataframe_with_schema(schema: pst.StructType)  -> pd.DataFrame:
-    emptyRDD = spark.sparkContext.emptyRDD()
-    res = spark.createDataFrame(emptyRDD, schema)
+def create_dataframe_with_schema(schema: pd.Series)  -> pd.DataFrame:
+    res = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in schema.items()})
     
     return res
 
   
-
 #########################################################
 # prepare_schema
 # Input: df: Dataframe, dessen Schema angepasst werden soll
-#        new_schema: neues Schema, das auf df angewandt werden soll
+#        new_schema: Schema eines Datasets, das auf df angewandt werden soll (siehe get_store_schema)
 #        default_values: Dictionary mit Defaultwerten für neue Spalten. Z.B. {"new_column_int" : 5, "new_column_str" : "default_value"}
+#                        Ohne Eintrag gilt der Default aus new_schema
 #        remove_columns: Boolean, ob Spalten aus df entfernt werden sollen, die nicht in new_schema definiert sind
 # Wendet ein gegebenes Schema auf ein Dataframe an. Neue Spalten werden hinzugefügt und mit den Defaultwerten aus 
-# default_values ergänzt. Entfernt ggfs. überschüssige Spalten aus df, sofern remove_columns True ist
+# default_values ergänzt. Entfernt ggfs. überschüssige Spalten aus df, sofern remove_columns True ist.
+# Meta-Spalten bleiben immer erhalten.
 # Output: Dataframe mit neuem Schema
 #########################################################
-def prepare_schema(df: pd.DataFrame, new_schema: pst.StructType, default_values: dict = None, remove_columns: bool = False) -> psd.DataFrame:
-    res = df
-    old_fields = set((f.name, f.dataType, f.nullable) for f in df.schema)
-    new_fields = set((f.name, f.dataType, f.nullable) for f in new_schema)
-
-    # Add missing fields first
-    for col_name, col_type, col_nullable in new_fields.difference(old_fields):
-        default_value = None
-        if default_values is not None:
-            if col_name in default_values.keys():
-                default_value = default_values[col_name]
-        res = res.withColumn(col_name, psf.lit(default_value).cast(col_type))
+def prepare_schema(df: pd.DataFrame, new_schema: dict, default_values: dict = None,
+                   remove_columns: bool = False) -> pd.DataFrame:
+    res = df.copy(deep=False)
+    defaults = {**new_schema['defaults'], **(default_values or {})}
+    for column, dtype in new_schema['columns'].items():
+        if column not in res.columns:
+            res[column] = pd.Series([defaults.get(column)] * len(res), index=res.index, dtype=object).astype(dtype)
 
     if remove_columns:
-        for col_name, col_type, col_nullable in old_fields.difference(new_fields):
-            res = res.drop(col_name)
+        res = res[[column for column in res.columns if column in new_schema['columns'] or _is_meta_column(column)]]
 
     return res
 
 
-#########################################################
-# merge_cdc
-#########################################################
-def merge_cdc(current_df: psd.DataFrame, new_df: psd.DataFrame, key_columns: list, deleted_df: psd.DataFrame = None) -> psd.DataFrame:
-    res = current_df
-    if deleted_df is not None:
-        res = res.join(deleted_df, key_columns, "leftanti").select(res.columns)
-    res = res.join(new_df, key_columns, "leftanti").select(res.columns)
-    res = res.unionAll(new_df)
-    return res
-  
-
 #########################################################
 # get_valid_from_date
 # Input: valid_from_mode: Integer, der den valid_from_mode bestimmt
@@ -104,201 +132,1525 @@ def get_valid_from_date(valid_from_mode: int, valid_from_date: str = None, curre
   else:
     print("Error. Mode must be one in VALID_FROM_MODE_LOWER_BOUND, VALID_FROM_MODE_LOAD_DATE, VALID_FROM_MODE_CUSTOM. Defaulting to VALID_FROM_MODE_LOWER_BOUND")
     valid_from = SCD2_LOWER_BOUND
-  print(valid_from)
   return valid_from
 
 
+#########################################################
+# to_scd2_date
+# Input: value: Datum als String (z.B. SCD2_UPPER_BOUND, currents[CURRENT_RUN_DAY]) oder Timestamp
+# Wandelt ein Datum in den Typ der Spalten META_COLUMNS[COL_VALID_FROM] und META_COLUMNS[COL_VALID_TO] um
+# Output: Timestamp auf Granularität Tag
+#########################################################
+def to_scd2_date(value) -> pd.Timestamp:
+    return pd.Timestamp(value).normalize()
+
+
+def _get_run_id(df: pd.DataFrame, currents: dict):
+    # Run-ID in der Darstellung der Spalte in df (String oder int64 im kompakten Schema)
+    if df[META_COLUMNS[COL_UPDATE_RUN_ID]].dtype.kind in 'iu':
+        return run_id_to_int(currents[CURRENT_RUN_ID])
+    return currents[CURRENT_RUN_ID]
+
+
+#########################################################
+# merge_scd2_classes
+# Input: siehe merge_scd2
+# Berechnet die 5 Klassen von merge_scd2 in einem Durchlauf: Die aktiven Datensätze aus current_df werden über
+# einen Hash-Lookup auf den Key-Hash (siehe lookup_hash_pairs) ihrem neuen Datensatz zugeordnet, danach entscheidet
+# ein Vergleich der Record-Hashes. Es werden keine Joins der Dataframes gebildet, nur die Hashes als uint64 gehalten.
+# Neue Datensätze, deren Key nur noch abgeschlossen in current_df oder in closed_key_hashes vorkommt (z.B. nach einem
+# Delete), werden als neue Version mit valid_from ab CURRENT_RUN_DAY eingefügt.
+# Abgeschlossene Versionen bekommen VALID_TO = CURRENT_RUN_DAY - 1 Tag, die neue Version gilt ab CURRENT_RUN_DAY.
+# Ändert sich ein Key mehrmals am selben Tag (oder vor einem in der Zukunft liegenden VALID_FROM), ist VALID_TO der
+# abgeschlossenen Version kleiner als ihr VALID_FROM: ein leeres Intervall. Die Version bleibt in der Historie, ist
+# aber an keinem Stichtag gültig, so dass pro Key und Tag höchstens eine Version gilt (die letzte des Tages).
+# filter_as_of und match_as_of schließen leere Intervalle deshalb aus.
+# closed_key_hashes: optional Tuple (high, low) mit uint64 Key-Hashes abgeschlossener Datensätze, die nicht in
+#                    current_df enthalten sind (z.B. aus dem Hash-Index der Historie, siehe historize_to_store)
+# deleted_key_hashes: optional Tuple (high, low) mit uint64 Key-Hashes gelöschter Datensätze. Aktive Datensätze
+#                     dieser Keys, die nicht in new_df vorkommen, werden wie Änderungen abgeschlossen und bekommen
+#                     zusätzlich DELETED = CURRENT_RUN_TS (Tombstone in changed_current_df)
+# Output: 5 Dataframes current_only_df, new_only_df, unchanged_current_df, changed_current_df, changed_new_df
+#########################################################
+def merge_scd2_classes(current_df: pd.DataFrame, new_df: pd.DataFrame, currents: dict, valid_from_mode: int,
+                       valid_from_date: str = None, closed_key_hashes: tuple = None, deleted_key_hashes: tuple = None):
+    valid_from_column = META_COLUMNS[COL_VALID_FROM]
+    valid_to_column = META_COLUMNS[COL_VALID_TO]
+    upper_bound = to_scd2_date(SCD2_UPPER_BOUND)
+    run_day = to_scd2_date(currents[CURRENT_RUN_DAY])
+
+    new_key = get_hash_pair(new_df, COL_KEY_HASH)
+    if (lookup_hash_pairs(new_key[0], new_key[1], new_key[0], new_key[1]) != np.arange(len(new_df))).any():
+        raise ValueError('new_df contains more than one row per ' + META_COLUMNS[COL_KEY_HASH])
+    new_record = get_hash_pair(new_df, COL_RECORD_HASH)
+    current_key = get_hash_pair(current_df, COL_KEY_HASH)
+    current_record = get_hash_pair(current_df, COL_RECORD_HASH)
+
+    active = (current_df[valid_to_column] == upper_bound).to_numpy()
+    new_pos = np.full(len(current_df), -1, dtype=np.int64)
+    new_pos[active] = lookup_hash_pairs(current_key[0][active], current_key[1][active], new_key[0], new_key[1])
+    matched = new_pos >= 0
+    same_record = np.zeros(len(current_df), dtype=bool)
+    same_record[matched] = ((current_record[0][matched] == new_record[0][new_pos[matched]])
+                            & (current_record[1][matched] == new_record[1][new_pos[matched]]))
+    changed = matched & ~same_record
+
+    new_matched = np.zeros(len(new_df), dtype=bool)
+    new_matched[new_pos[matched]] = True
+    new_changed = np.zeros(len(new_df), dtype=bool)
+    new_changed[new_pos[changed]] = True
+    new_in_current = isin_hash_pairs(new_key[0], new_key[1], current_key[0], current_key[1])
+    if closed_key_hashes is not None:
+        new_in_current |= isin_hash_pairs(new_key[0], new_key[1], closed_key_hashes[0], closed_key_hashes[1])
+    new_changed |= ~new_matched & new_in_current
+
+    deleted = np.zeros(len(current_df), dtype=bool)
+    if deleted_key_hashes is not None:
+        deleted = active & ~matched & isin_hash_pairs(current_key[0], current_key[1],
+                                                      deleted_key_hashes[0], deleted_key_hashes[1])
+
+    current_only_df = current_df[~matched & ~deleted]
+    unchanged_current_df = current_df[same_record]
+
+    changed_current_df = current_df[changed | deleted].copy()
+    changed_current_df[META_COLUMNS[COL_UPDATE_RUN_TS]] = pd.to_datetime(currents[CURRENT_RUN_TS])
+    changed_current_df[META_COLUMNS[COL_UPDATE_RUN_ID]] = _get_run_id(changed_current_df, currents)
+    changed_current_df[valid_to_column] = run_day - pd.Timedelta(days=1)
+    changed_current_df.loc[deleted[changed | deleted], META_COLUMNS[COL_DELETED]] = pd.to_datetime(currents[CURRENT_RUN_TS])
+
+    new_only_df = new_df[~new_matched & ~new_in_current].copy()
+    new_only_df[valid_from_column] = to_scd2_date(get_valid_from_date(valid_from_mode, valid_from_date, currents))
+    new_only_df[valid_to_column] = upper_bound
+
+    changed_new_df = new_df[new_changed].copy()
+    changed_new_df[valid_from_column] = run_day
+    changed_new_df[valid_to_column] = upper_bound
+
+    return current_only_df, new_only_df, unchanged_current_df, changed_current_df, changed_new_df
+
+
 #########################################################
 # merge_scd2
-# Input: spark: SparkSession, um SQL-Engine zu nutzen
-#        current_df: Dataframe, das den aktuellen Datenbestand beinhaltet. Muss Hashes und COL_VALID_TO + COL_VALID_FROM als Spalten haben
-#        new_df: Dataframe, das die neugeladenen Daten beinhaltet. Muss META_COLUMNS als Spalten haben
+# Input: current_df: Dataframe, das den aktuellen Datenbestand beinhaltet. Muss Hashes und COL_VALID_TO + COL_VALID_FROM als Spalten haben
+#        new_df: Dataframe, das die neugeladenen Daten beinhaltet. Muss META_COLUMNS als Spalten haben (ohne COL_VALID_TO + COL_VALID_FROM)
+#                und darf pro Key-Hash nur einen Datensatz enthalten
 #        currents: Dictionary mit Zeitwerten. Muss je nach valid_from_mode die Werte CURRENT_RUN_TS, CURRENT_RUN_DAY und/oder CURRENT_RUN_ID beinhalten.
 #        valid_from_mode: Integer, der den valid_from_mode bestimmt (Welches valid_from Datum an neue Datensätze geschrieben wird). 
 #                         VALID_FROM_MODE_LOWER_BOUND, VALID_FROM_MODE_LOAD_DATE, VALID_FROM_MODE_CUSTOM
 #        valid_from_date: Datum, das bei VALID_FROM_MODE_CUSTOM als valid_from gesetzt werden soll
+#        deleted_keys: Dataframe mit Key-Hashes gelöschter Datensätze (z.B. aus get_deletes_by_column oder
+#                      get_deleted_by_full_load)
 # Mergt die Dataframes current_df und new_df zusammen und historisiert die Daten nach SCD Typ 2. 
-# Erzeugt 5 Dataframes, die über union zusammengefüht werden:
+# Erzeugt über merge_scd2_classes 5 Dataframes, die zusammengeführt werden:
 #   current_only_df: Datensätze, die nur current_df sind oder bereits vollständig historisiert
 #   new_only_df: Datensätze, die nur in new_df sind. valid_from wird hier je nach valid_from_mode gesetzt
 #   unchanged_current_df: Datensätze, die unverändert und aktiv in new_df und current_df sind
-#   changed_current_df: Datensätze aus current_df, die aktiv sind und verändert in new_df vorkommen. Sind jetzt historisiert und valid_to wird gesetzt
+#   changed_current_df: Datensätze aus current_df, die aktiv sind und verändert in new_df vorkommen oder gelöscht wurden. Sind jetzt historisiert und valid_to wird gesetzt
 #   changed_new_df: Datensätze aus new_df, die die Veränderung beinhalten. Neue aktive Datensätze mit valid_from ab CURRENT_RUN_DAY
 # Output: Zusammengeführtes Dataframe der 5 oben genannten
 #########################################################
-def merge_scd2(current_df: pd.DataFrame, new_df: pd.DataFrame, currents: dict, valid_from_mode: int, valid_from_date: str = None) -> pd.DataFrame:
-    current_table_name = 'current_' + currents[CURRENT_RUN_ID]
-    new_table_name = 'new_' + currents[CURRENT_RUN_ID]
-    
-    #current_df = spark.read.parquet(os.path.join(dataset_base_path,active_suffix))
-    current_df.registerTempTable(current_table_name)
-    
-    new_df.registerTempTable(new_table_name)
-
-    print('current only')
-    current_only_df = spark.sql('select c.* from ' + current_table_name + ' c '
-                                + ' left outer join ' + new_table_name + ' n '
-                                + ' on (c.' + META_COLUMNS[COL_KEY_HASH] + ' = n.' + META_COLUMNS[
-                                    COL_KEY_HASH] + ')'
-                                + ' where n.' + META_COLUMNS[COL_KEY_HASH] + ' is null '
-                                + ' or c.' + META_COLUMNS[
-                                    COL_VALID_TO] + ' <> TO_DATE(CAST(UNIX_TIMESTAMP(\'' + SCD2_UPPER_BOUND + '\', \'' + SPARK_DAY_FORMAT + '\') AS TIMESTAMP)) ')
-
-    current_only_df.show(truncate=False)
-
-    print('new only')
-    # enthält die komplett neuen eingefügten aktiven Datensätze --> Muss nach aktiv geschrieben werden
-    valid_from = get_valid_from_date(valid_from_mode, valid_from_date, currents)
-    
-    
-    new_only_df = spark.sql('select n.* from ' + new_table_name + ' n '
-                            + ' where n.' + META_COLUMNS[COL_KEY_HASH] + ' not in '
-                            + ' (select ' + META_COLUMNS[COL_KEY_HASH] + ' from ' + current_table_name + ' )')
-    new_only_df = new_only_df.withColumn(META_COLUMNS[COL_VALID_FROM],
-                                         to_date(psf.date_format(psf.lit(valid_from), SPARK_DAY_FORMAT)))
-    new_only_df = new_only_df.withColumn(META_COLUMNS[COL_VALID_TO],
-                                         to_date(psf.date_format(psf.lit(SCD2_UPPER_BOUND), SPARK_DAY_FORMAT)))
-    new_only_df.show(truncate=False)
-
-    print('unchanged current')
-    # enthält die ungeänderten aktiven Datensätze --> Muss nach aktiv geschrieben werden
-    unchanged_current_df = spark.sql('select c.* from ' + current_table_name + ' c '
-                                     + ' inner join ' + new_table_name + ' n '
-                                     + ' on ( c.' + META_COLUMNS[COL_KEY_HASH] + ' = n.' + META_COLUMNS[
-                                         COL_KEY_HASH]
-                                     + '  and c.' + META_COLUMNS[COL_RECORD_HASH] + ' = n.' + META_COLUMNS[
-                                         COL_RECORD_HASH] + ')'
-                                     + ' and c.' + META_COLUMNS[
-                                         COL_VALID_TO] + ' = TO_DATE(CAST(UNIX_TIMESTAMP(\'' + SCD2_UPPER_BOUND + '\', \'' + SPARK_DAY_FORMAT + '\') AS TIMESTAMP))')
-    unchanged_current_df.show(truncate=False)
-
-    print('changed current')
-    # enthält die neuen historisierten Datensätze mit neuem VALID_TO date --> Muss nach hist angefügt werden
-    changed_current_df = spark.sql('select c.* from ' + current_table_name + ' c '
-                                   + ' inner join ' + new_table_name + ' n '
-                                   + ' on ( c.' + META_COLUMNS[COL_KEY_HASH] + ' = n.' + META_COLUMNS[
-                                       COL_KEY_HASH]
-                                   + '  and c.' + META_COLUMNS[COL_RECORD_HASH] + ' <> n.' + META_COLUMNS[
-                                       COL_RECORD_HASH]
-                                   + '  and c.' + META_COLUMNS[
-                                       COL_VALID_TO] + ' = TO_DATE(CAST(UNIX_TIMESTAMP(\'' + SCD2_UPPER_BOUND + '\', \'' + SPARK_DAY_FORMAT + '\') AS TIMESTAMP)))')
-    changed_current_df = changed_current_df.withColumn(META_COLUMNS[COL_UPDATE_RUN_TS],
-                                                       psf.unix_timestamp(psf.lit(
-                                                           currents[CURRENT_RUN_TS]),
-                                                                          SPARK_TS_FORMAT).cast("timestamp"))
-    changed_current_df = changed_current_df.withColumn(META_COLUMNS[COL_UPDATE_RUN_ID],
-                                                       psf.lit(currents[CURRENT_RUN_ID]))
-    changed_current_df = changed_current_df.withColumn(META_COLUMNS[COL_VALID_TO],
-                                                       psf.date_sub(psf.date_format(psf.lit(
-                                                           currents[CURRENT_RUN_DAY]),
-                                                                                    SPARK_DAY_FORMAT), 1))
-    changed_current_df.show(truncate=False)
-
-    print('changed new')
-    # Enthält die neuen aktiven Datensätze mit neuem VALID_FROM date  --> Muss nach aktiv geschrieben werden
-    changed_new_df = spark.sql('select n.* from ' + new_table_name + ' n '
-                               + ' inner join ' + current_table_name + ' c '
-                               + ' on ( c.' + META_COLUMNS[COL_KEY_HASH] + ' = n.' + META_COLUMNS[
-                                   COL_KEY_HASH]
-                               + '  and c.' + META_COLUMNS[COL_RECORD_HASH] + ' <> n.' + META_COLUMNS[
-                                   COL_RECORD_HASH]
-                               + '  and c.' + META_COLUMNS[
-                                       COL_VALID_TO] + ' = TO_DATE(CAST(UNIX_TIMESTAMP(\'' + SCD2_UPPER_BOUND + '\', \'' + SPARK_DAY_FORMAT + '\') AS TIMESTAMP)))')
-    changed_new_df = changed_new_df.withColumn(META_COLUMNS[COL_VALID_FROM],
-                                               to_date(psf.date_format(
-                                                   psf.lit(currents[CURRENT_RUN_DAY]),
-                                                   SPARK_DAY_FORMAT)))
-    changed_new_df = changed_new_df.withColumn(META_COLUMNS[COL_VALID_TO],
-                                               to_date(psf.date_format(psf.lit(SCD2_UPPER_BOUND), SPARK_DAY_FORMAT)))
-    changed_new_df.show(truncate=False)
-    
-    res = current_only_df.unionByName(new_only_df).unionByName(unchanged_current_df).unionByName(changed_current_df).unionByName(
-        changed_new_df)
-          
-    spark.catalog.dropTempView(current_table_name)
-    spark.catalog.dropTempView(new_table_name)
-    return res
+def merge_scd2(current_df: pd.DataFrame, new_df: pd.DataFrame, currents: dict, valid_from_mode: int, valid_from_date: str = None,
+               deleted_keys: pd.DataFrame = None) -> pd.DataFrame:
+    with measure_stage(STAGE_MERGE, 'merge_scd2', currents.get(CURRENT_RUN_ID), len(new_df),
+                       current_rows=len(current_df)) as metrics:
+        deleted_key_hashes = None if deleted_keys is None else get_hash_pair(deleted_keys, COL_KEY_HASH)
+        parts = merge_scd2_classes(current_df, new_df, currents, valid_from_mode, valid_from_date,
+                                   deleted_key_hashes=deleted_key_hashes)
+        columns = list(current_df.columns) + [c for c in parts[1].columns if c not in current_df.columns]
+        res = pd.concat([part for part in parts if len(part) > 0] or [current_df], ignore_index=True)
+        metrics[METRIC_ROWS_OUT] = len(res)
+    return res.reindex(columns=columns)
 
 
-  
 #########################################################
 # get_deletes_by_column
 # Input: df: Dataframe aus welchem gelöschte Datensätze identifiziert werden sollen
 #        del_col_name: String mit Spaltenname, in welchem nach del_col_value gesucht werden soll
 #        del_col_value: Wert, der bestimmt, welche Datensätze als gelöscht identifiziert werden sollen
 # Sucht im Dataframe df nach dem Wert del_col_value in der Spalte del_col_name und gibt die Key-Hashes der
-# passenden Datensätze als Liste zurück
-# Output: Liste mit Key-Hashes
+# passenden Datensätze zurück
+# Output: Dataframe mit den Key-Hash Spalten (siehe get_hash_columns)
 #########################################################
-def get_deletes_by_column(df: pd.DataFrame, del_col_name: str, del_col_value) -> list:
-  deleted_key_hash_list = df.filter(df[del_col_name] == del_col_value).select(META_COLUMNS[COL_KEY_HASH]).rdd.flatMap(lambda x: x).collect()
-  return deleted_key_hash_list
+def get_deletes_by_column(df: pd.DataFrame, del_col_name: str, del_col_value) -> pd.DataFrame:
+    return df.loc[df[del_col_name] == del_col_value, get_hash_columns(df, COL_KEY_HASH)].drop_duplicates()
 
 
 #########################################################
 # get_deleted_by_full_load
 # Input: current_df: Dataframe, das den aktuellen Datenbestand beinhaltet. Muss META_COLUMNS als Spalten haben
 #        new_df: Dataframe, das die neugeladenen Daten beinhaltet. Muss META_COLUMNS als Spalten haben
-# Identifiziert die Datensätze, die in current_df sind, aber nicht in new_df. Gibt die Key-Hashes der Datensätze als
-# Liste zurück. Nur sinnvoll, wenn new_df und current_df ein Full Load sind.
-# Output: Liste mit Key-Hashes
-#########################################################
-def get_deleted_by_full_load(current_df: pd.DataFrame, new_df: pd.DataFrame):
-    spark = SparkSession.builder.getOrCreate()
-    current_table_name = 'current_df'
-    new_table_name = 'new_df'
-    
-    #current_df = spark.read.parquet(os.path.join(dataset_base_path,active_suffix))
-    current_df.registerTempTable(current_table_name)
-    
-    new_df.registerTempTable(new_table_name)
-
-    #print('current only')
-    current_only_df = spark.sql('select c.* from ' + current_table_name + ' c '
-                                + ' left outer join ' + new_table_name + ' n '
-                                + ' on (c.' + META_COLUMNS[COL_KEY_HASH] + ' = n.' + META_COLUMNS[
-                                    COL_KEY_HASH] + ')'
-                                + ' where n.' + META_COLUMNS[COL_KEY_HASH] + ' is null')
-    spark.catalog.dropTempView(current_table_name)
-    spark.catalog.dropTempView(new_table_name)
-    
-    deleted_key_hash_list = current_only_df.select(META_COLUMNS[COL_KEY_HASH]).rdd.flatMap(lambda x: x).collect()
-    return deleted_key_hash_list'''
+# Identifiziert die Datensätze, die in current_df sind, aber nicht in new_df (Anti-Join über die Key-Hashes).
+# Hat current_df VALID_TO, werden nur aktive Datensätze betrachtet. Nur sinnvoll, wenn new_df ein Full Load ist.
+# Output: Dataframe mit den Key-Hash Spalten (siehe get_hash_columns)
+#########################################################
+def get_deleted_by_full_load(current_df: pd.DataFrame, new_df: pd.DataFrame) -> pd.DataFrame:
+    if META_COLUMNS[COL_VALID_TO] in current_df.columns:
+        current_df = current_df[current_df[META_COLUMNS[COL_VALID_TO]] == to_scd2_date(SCD2_UPPER_BOUND)]
+    current_key = get_hash_pair(current_df, COL_KEY_HASH)
+    new_key = get_hash_pair(new_df, COL_KEY_HASH)
+    deleted = ~isin_hash_pairs(current_key[0], current_key[1], new_key[0], new_key[1])
+    return current_df.loc[deleted, get_hash_columns(current_df, COL_KEY_HASH)].drop_duplicates()
   
   
 #########################################################
 # read_df
 # Input: path: String mit Pfad, von welchem Daten gelesen werden sollen
-# Liest die Daten von path als parquet. Bei Fehler (z.B. keine Daten liegen am gegebenen Pfad)
-# wird None zurückgegeben
+#        columns: Liste mit Spalten, die gelesen werden sollen. None liest alle
+#        filters: Zeilenfilter im Format von fastparquet/pyarrow: Liste mit Tuples (Spalte, Operator, Wert), die
+#                 alle gelten müssen, oder Liste solcher Listen, von denen eine gelten muss. Operatoren: ==, !=,
+#                 <, <=, >, >=, in, not in. Bausteine: filter_active, filter_as_of, filter_run_id_range
+#        key_hashes: Series oder Dataframe mit Key-Hashes (bisheriges oder kompaktes Schema). Es werden nur
+#                    Datensätze dieser Keys gelesen
+#        buckets: Liste mit Key-Buckets, auf die das Lesen beschränkt wird (siehe get_key_buckets)
+#        legacy: Boolean, ob Metadatenspalten im kompakten Schema in das bisherige Schema umgewandelt werden
+#        hash_mode: hash_mode der gespeicherten Hashes für legacy (siehe to_legacy_meta_columns)
+# Liest die Daten von path als parquet. Hat das Dataset ein Manifest, werden nur die Dateien des
+# aktuellen Snapshots gelesen. Die Auswahl wird so früh wie möglich angewendet:
+#   1. Partitionen: buckets, Filter auf KEY_BUCKET und die Buckets von key_hashes wählen über das Manifest
+#      nur passende Dateien aus
+#   2. Hash-Index: bei key_hashes werden nur die Dateien gelesen, in denen der Index diese Keys findet
+#   3. Statistiken: filters werden an fastparquet übergeben, Row Groups, deren min/max nicht passen, werden
+#      nicht dekodiert
+#   4. Zeilen: die gelesenen Row Groups werden exakt gefiltert, nur columns bleiben übrig
+# Liegen am Pfad keine Daten (kein Verzeichnis, kein Manifest und keine parquet Dateien), wird None
+# zurückgegeben. Andere Fehler (z.B. eine defekte Datei) werden nicht abgefangen, damit ein defektes Dataset
+# nicht wie ein leeres behandelt wird.
 # Output: Dataframe oder None
 #########################################################
-def read_parquet_df(path: str):
-  try:
-    df = pd.read_parquet(path)
-    return df
-  except:
+def read_parquet_df(path: str, columns: list = None, filters: list = None, key_hashes=None, buckets: list = None,
+                    legacy: bool = False, hash_mode: int = HASH_MODE_MD5):
+  if filters is not None and len(filters) > 0 and not isinstance(filters[0], list):
+    filters = [filters]
+  key_pair = get_key_pair(key_hashes)
+  if os.path.isfile(path):
+    path, files = os.path.dirname(path), [os.path.basename(path)]
+  else:
+    files = select_store_files(path, filters, key_pair, buckets)
+    if files is None:
+      return None
+
+  res = read_store_files(path, files, columns, filters, key_pair)
+  return to_legacy_meta_columns(res, hash_mode) if legacy else res
+
+
+#########################################################
+# get_key_pair
+# Input: key_hashes: Series oder Dataframe mit Key-Hashes (bisheriges oder kompaktes Schema), ein Tuple (high, low)
+#                    mit uint64 Arrays oder None
+# Output: Tuple (high, low) mit uint64 Arrays oder None
+#########################################################
+def get_key_pair(key_hashes):
+    if key_hashes is None or isinstance(key_hashes, tuple):
+        return key_hashes
+    if isinstance(key_hashes, pd.DataFrame):
+        return get_hash_pair(key_hashes, COL_KEY_HASH)
+    return hash_to_uint64_pair(key_hashes)
+
+
+#########################################################
+# select_store_files
+# Input: path: Pfad des Datasets
+#        filters: Zeilenfilter als Liste von Listen mit Tuples (siehe read_parquet_df)
+#        key_pair: optional Tuple (high, low) mit uint64 Key-Hashes (siehe get_key_pair)
+#        buckets: Liste mit Key-Buckets, auf die die Auswahl beschränkt wird
+# Schritte 1 und 2 von read_parquet_df: wählt über Manifest und Hash-Index die Dateien des Snapshots aus, die
+# Zeilen für filters und key_pair enthalten können
+# Output: Liste mit Dateipfaden relativ zu path oder None, wenn am Pfad keine Daten liegen
+#########################################################
+def select_store_files(path: str, filters: list = None, key_pair: tuple = None, buckets: list = None):
+    manifest = read_manifest(path)
+    partitioning = manifest['partitioning'] if manifest is not None else None
+    if partitioning is not None and partitioning['bucket_count']:
+        buckets = _intersect_buckets(buckets, _get_filter_buckets(filters))
+        if key_pair is not None:
+            buckets = _intersect_buckets(buckets, np.unique(_get_buckets_from_high(key_pair[0], partitioning)).tolist())
+    files = get_store_files(path, buckets)
+    if manifest is None and len(files) == 0:
+        return None
+    if manifest is not None and key_pair is not None:
+        index_df = read_hash_index(path, columns=[INDEX_KEY_HASH_HIGH, INDEX_KEY_HASH_LOW, INDEX_FILE], buckets=buckets)
+        if index_df is not None:
+            found = isin_hash_pairs(index_df[INDEX_KEY_HASH_HIGH].to_numpy(), index_df[INDEX_KEY_HASH_LOW].to_numpy(),
+                                    key_pair[0], key_pair[1])
+            found_files = set(index_df[INDEX_FILE][found])
+            files = [file_name for file_name in files if file_name in found_files]
+    return files
+
+
+#########################################################
+# filter_active / filter_as_of / filter_run_id_range
+# Bausteine für filters in read_parquet_df
+# filter_active: nur aktive SCD2 Versionen (VALID_TO = SCD2_UPPER_BOUND)
+# filter_as_of: nur SCD2 Versionen, die am Stichtag as_of gültig sind (VALID_FROM <= as_of <= VALID_TO, beide
+#               Grenzen inklusive, siehe merge_scd2_classes)
+# filter_run_id_range: Run-IDs zwischen start und end (jeweils inklusive, None = offen). Die Werte müssen die
+#                      Darstellung der Spalte haben (String im Format RUN_ID_FORMAT oder int64 im kompakten Schema).
+#                      Ein String ohne UUID-Teil (siehe create_currents) als end schließt Läufe in genau dieser
+#                      Mikrosekunde aus
+# Output: Liste mit Filter-Tuples
+#########################################################
+def filter_active() -> list:
+  return [(META_COLUMNS[COL_VALID_TO], '==', to_scd2_date(SCD2_UPPER_BOUND))]
+
+
+def filter_as_of(as_of) -> list:
+  as_of = to_scd2_date(as_of)
+  return [(META_COLUMNS[COL_VALID_FROM], '<=', as_of), (META_COLUMNS[COL_VALID_TO], '>=', as_of)]
+
+
+def filter_run_id_range(start=None, end=None, column: int = COL_INSERT_RUN_ID) -> list:
+  res = []
+  if start is not None:
+    res.append((META_COLUMNS[column], '>=', start))
+  if end is not None:
+    res.append((META_COLUMNS[column], '<=', end))
+  return res
+
+
+def _intersect_buckets(buckets, other):
+  if other is None:
+    return buckets
+  if buckets is None:
+    return sorted(other)
+  return sorted(set(buckets) & set(other))
+
+
+def _get_filter_buckets(filters: list):
+  # Buckets, die eine der Alternativen in filters zulässt. None, wenn eine Alternative KEY_BUCKET nicht einschränkt
+  if not filters:
     return None
+  res = set()
+  for conjunction in filters:
+    allowed = None
+    for column, op, value in conjunction:
+      if column != PARTITION_BUCKET_COLUMN or op not in ('==', 'in'):
+        continue
+      values = set(int(v) for v in (value if op == 'in' else [value]))
+      allowed = values if allowed is None else allowed & values
+    if allowed is None:
+      return None
+    res |= allowed
+  return res
 
-  
-'''#########################################################
+
+def _get_filter_mask(df: pd.DataFrame, filters: list) -> np.ndarray:
+  res = np.zeros(len(df), dtype=bool)
+  for conjunction in filters:
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in conjunction:
+      values = df[column]
+      if op == '==':
+        mask &= (values == value).to_numpy()
+      elif op == '!=':
+        mask &= (values != value).to_numpy()
+      elif op == '<':
+        mask &= (values < value).to_numpy()
+      elif op == '<=':
+        mask &= (values <= value).to_numpy()
+      elif op == '>':
+        mask &= (values > value).to_numpy()
+      elif op == '>=':
+        mask &= (values >= value).to_numpy()
+      elif op == 'in':
+        mask &= values.isin(value).to_numpy()
+      elif op == 'not in':
+        mask &= ~values.isin(value).to_numpy()
+      else:
+        raise ValueError('Unsupported filter operator ' + str(op))
+    res |= mask
+  return res
+
+
+#########################################################
+# list_parquet_files
+# Input: path: Pfad des Datasets (Verzeichnis)
+# Listet alle Parquet-Dateien des Datasets rekursiv auf. Dateien und Verzeichnisse, die mit _ oder . beginnen
+# (z.B. _metadata, HASH_INDEX_DIR) gehören nicht zu den Daten.
+# Output: Sortierte Liste mit Dateipfaden relativ zu path
+#########################################################
+def list_parquet_files(path: str) -> list:
+    res = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if not d.startswith(('_', '.'))]
+        for file_name in files:
+            if not file_name.startswith(('_', '.')) and file_name.endswith('.parquet'):
+                res.append(os.path.relpath(os.path.join(root, file_name), path).replace(os.sep, '/'))
+    return sorted(res)
+
+
+#########################################################
+# get_store_files
+# Input: path: Pfad des Datasets
+#        buckets: Liste mit Key-Buckets (siehe get_key_buckets). None liefert die Dateien aller Buckets
+# Bestimmt die Dateien des aktuellen Snapshots: aus dem Manifest oder, bei Datasets ohne Manifest,
+# über list_parquet_files. Bei nach Buckets partitionierten Datasets werden nur die Dateien der gegebenen
+# Buckets zurückgegeben.
+# Output: Liste mit Dateipfaden relativ zu path
+#########################################################
+def get_store_files(path: str, buckets: list = None) -> list:
+    manifest = read_manifest(path)
+    if manifest is None:
+        return list_parquet_files(path)
+    entries = manifest['files']
+    if buckets is not None and manifest['partitioning']['bucket_count']:
+        buckets = set(int(b) for b in buckets)
+        entries = [entry for entry in entries if entry['partition'].get(PARTITION_BUCKET_COLUMN) in buckets]
+    return [entry['path'] for entry in entries]
+
+
+#########################################################
+# read_store_files
+# Input: path: Pfad des Datasets
+#        files: Liste mit Dateipfaden relativ zu path
+#        columns: Liste mit Spalten, die gelesen werden sollen. None liest alle
+#        filters: Zeilenfilter als Liste von Listen mit Tuples (siehe read_parquet_df)
+#        key_pair: optional Tuple (high, low) mit uint64 Key-Hashes, auf die die Zeilen beschränkt werden
+#        row_groups: optional Dictionary {Datei: Liste mit Row-Group-Nummern}. Von diesen Dateien werden nur die
+#                    gegebenen Row Groups gelesen (z.B. aus dem Intervall-Index, siehe AsOfHelpers)
+# Liest die gegebenen Dateien und hängt sie aneinander. Partitionsspalten, die nur im Verzeichnisnamen
+# stehen (z.B. Lastname=Alfalfa bei Datasets, die noch über DataFrame.to_parquet geschrieben wurden), werden
+# als Spalte ergänzt. Abgeleitete Partitionen (PARTITION_DERIVED_COLUMNS) sind keine Spalten der Daten, Filter
+# darauf (KEY_BUCKET als int, INSERT_DATE als Timestamp) werden über den Pfad entschieden, ohne die Datei zu öffnen.
+# Die übrigen filters werden über die Row-Group-Statistiken an fastparquet weitergegeben.
+# Output: Dataframe
+#########################################################
+def read_store_files(path: str, files: list, columns: list = None, filters: list = None,
+                     key_pair: tuple = None, row_groups: dict = None) -> pd.DataFrame:
+    with measure_stage(STAGE_READ, 'read_store_files', path=path, files=len(files)) as metrics:
+        res = _read_store_files(path, files, columns, filters, key_pair, row_groups, get_store_schema(path), metrics)
+        metrics[METRIC_ROWS_OUT] = len(res)
+    return res
+
+
+def _read_store_files(path: str, files: list, columns: list, filters: list, key_pair: tuple, row_groups: dict,
+                      schema: dict, metrics: dict) -> pd.DataFrame:
+    parts = []
+    bytes_read = 0
+    for file_name in files:
+        path_values = _get_partition_values(file_name)
+        file_filters = _resolve_filters(filters, _get_derived_partition_values(path_values))
+        if file_filters is None:
+            continue
+        parquet_file = fastparquet.ParquetFile(os.path.join(path, file_name))
+        if row_groups is not None and file_name in row_groups:
+            sources = [parquet_file[row_group] for row_group in sorted(row_groups[file_name])]
+            bytes_read += sum(chunk.meta_data.total_compressed_size for source in sources
+                              for row_group in source.row_groups for chunk in row_group.columns)
+        else:
+            sources = [parquet_file]
+            bytes_read += os.path.getsize(os.path.join(path, file_name))
+        partition_values = {column: value for column, value in path_values.items()
+                            if column not in parquet_file.columns and column not in PARTITION_DERIVED_COLUMNS}
+        filled = []
+        if schema is not None:
+            # Spalten, die nach dem Schreiben der Datei ergänzt wurden, sind für die Datei konstant (Default)
+            filled = [column for column in schema['columns']
+                      if column not in parquet_file.columns and column not in partition_values]
+            partition_values.update({column: schema['defaults'].get(column) for column in filled})
+        file_filters = _resolve_filters(file_filters, partition_values)
+        if file_filters is None:
+            continue
+        read_columns = columns
+        if columns is not None:
+            extra = [column for conjunction in file_filters for column, _, _ in conjunction]
+            if key_pair is not None:
+                extra.extend(column for column in HASH_COLUMN_NAMES if column.startswith(META_COLUMNS[COL_KEY_HASH]))
+            read_columns = [c for c in dict.fromkeys(list(columns) + extra)
+                            if c not in partition_values and c in parquet_file.columns]
+        elif schema is not None and any(column in schema['dropped'] for column in parquet_file.columns):
+            read_columns = [column for column in parquet_file.columns if column not in schema['dropped']]
+        source_parts = [source.to_pandas(columns=read_columns, filters=file_filters, index=False) for source in sources]
+        df = source_parts[0] if len(source_parts) == 1 else pd.concat(source_parts, ignore_index=True)
+        for column, value in partition_values.items():
+            df[column] = value
+        if schema is not None:
+            df = _apply_schema(df, schema, filled)
+        if file_filters:
+            df = df[_get_filter_mask(df, file_filters)]
+        if key_pair is not None:
+            key_high, key_low = get_hash_pair(df, COL_KEY_HASH)
+            df = df[isin_hash_pairs(key_high, key_low, key_pair[0], key_pair[1])]
+        parts.append(df if columns is None else df[columns])
+    metrics[METRIC_BYTES_READ] = bytes_read
+    if len(parts) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)
+
+
+def _apply_schema(df: pd.DataFrame, schema: dict, filled: list) -> pd.DataFrame:
+    dropped = [column for column in df.columns if column in schema['dropped']]
+    if dropped:
+        df = df.drop(columns=dropped)
+    for column in filled + list(schema['widened']):
+        if column in df.columns and str(df[column].dtype) != schema['columns'][column]:
+            df[column] = df[column].astype(schema['columns'][column])
+    return df
+
+
+def _get_derived_partition_values(path_values: dict) -> dict:
+    res = {}
+    if PARTITION_BUCKET_COLUMN in path_values:
+        res[PARTITION_BUCKET_COLUMN] = int(path_values[PARTITION_BUCKET_COLUMN])
+    if PARTITION_DATE_COLUMN in path_values:
+        res[PARTITION_DATE_COLUMN] = pd.Timestamp(path_values[PARTITION_DATE_COLUMN])
+    return res
+
+
+def _resolve_filters(filters: list, values: dict):
+    # Setzt die Werte einer Datei (z.B. Partitionen aus dem Pfad) in filters ein. Alternativen, die dadurch nicht
+    # gelten können, fallen weg, erfüllte Bedingungen werden entfernt.
+    # Output: Filter für die Zeilen der Datei, [] wenn alle Zeilen passen, None wenn keine Zeile passen kann
+    if not filters:
+        return []
+    res = []
+    for conjunction in filters:
+        known = [f for f in conjunction if f[0] in values]
+        if len(known) > 0:
+            df = pd.DataFrame({column: [values[column]] for column, _, _ in known})
+            if not _get_filter_mask(df, [known])[0]:
+                continue
+        remaining = [f for f in conjunction if f[0] not in values]
+        if len(remaining) == 0:
+            return []
+        res.append(remaining)
+    return res if len(res) > 0 else None
+
+
+def _get_partition_values(file_name: str) -> dict:
+    res = {}
+    for directory in file_name.split('/')[:-1]:
+        if '=' in directory:
+            column, value = directory.split('=', 1)
+            res[column] = urllib.parse.unquote(value)
+    return res
+
+
+#########################################################
+# create_partitioning
+# Input: bucket_count: Anzahl der Key-Buckets. None oder 0 partitioniert nicht nach Buckets
+#        bucket_mode: BUCKET_MODE_MODULO (High-Teil des Key-Hash modulo bucket_count) oder
+#                     BUCKET_MODE_PREFIX (führende Bits des Key-Hash, bucket_count muss eine Zweierpotenz sein)
+#        date_column: Timestamp-Spalte (z.B. META_COLUMNS[COL_INSERT_RUN_TS]), nach deren Tag zusätzlich partitioniert wird
+#        partition_cols: Liste mit Spalten, nach deren Werten partitioniert wird (Verzeichnisse col=value)
+# Beschreibt die Partitionierung eines Datasets. Die Partitionierung wird im Manifest gespeichert. Mit Key-Buckets
+# bleibt die Anzahl der Verzeichnisse fest, unabhängig von der Kardinalität des Keys, und Delta-Erkennung
+# sowie SCD-Merges lesen nur die Buckets, deren Key-Hashes im neuen Batch vorkommen.
+# Output: Dictionary mit der Partitionierung
+#########################################################
+def create_partitioning(bucket_count: int = None, bucket_mode: int = BUCKET_MODE_MODULO, date_column: str = None,
+                        partition_cols: list = None) -> dict:
+    if bucket_count:
+        if bucket_count < 1 or bucket_count > MAX_BUCKET_COUNT:
+            raise ValueError('bucket_count must be between 1 and ' + str(MAX_BUCKET_COUNT))
+        if bucket_mode == BUCKET_MODE_PREFIX and bucket_count & (bucket_count - 1) != 0:
+            raise ValueError('bucket_count must be a power of two for BUCKET_MODE_PREFIX')
+        if bucket_mode not in (BUCKET_MODE_MODULO, BUCKET_MODE_PREFIX):
+            raise ValueError('bucket_mode must be one of BUCKET_MODE_MODULO, BUCKET_MODE_PREFIX')
+    return {'bucket_count': bucket_count or 0, 'bucket_mode': bucket_mode, 'date_column': date_column,
+            'partition_cols': list(partition_cols) if partition_cols else []}
+
+
+#########################################################
+# get_key_buckets
+# Input: key_hash: Series oder Array mit Key-Hashes eines beliebigen hash_modes
+#        partitioning: Dictionary aus create_partitioning
+# Berechnet den Key-Bucket jeder Zeile. Ohne Buckets ist der Bucket immer 0.
+# Output: uint16 Array mit den Buckets
+#########################################################
+def get_key_buckets(key_hash, partitioning: dict) -> np.ndarray:
+    high, low = hash_to_uint64_pair(key_hash)
+    return _get_buckets_from_high(high, partitioning)
+
+
+def _get_buckets_from_high(high: np.ndarray, partitioning: dict) -> np.ndarray:
+    bucket_count = partitioning['bucket_count'] if partitioning is not None else 0
+    if not bucket_count:
+        return np.zeros(len(high), dtype=np.uint16)
+    if partitioning['bucket_mode'] == BUCKET_MODE_PREFIX:
+        bits = bucket_count.bit_length() - 1
+        if bits == 0:
+            return np.zeros(len(high), dtype=np.uint16)
+        return (high >> np.uint64(64 - bits)).astype(np.uint16)
+    return (high % np.uint64(bucket_count)).astype(np.uint16)
+
+
+def _get_partitioning(manifest: dict, partition_cols: list = None, partitioning: dict = None) -> dict:
+    if partitioning is None and partition_cols is not None:
+        partitioning = create_partitioning(partition_cols=partition_cols)
+    if partitioning is None:
+        partitioning = manifest['partitioning'] or create_partitioning()
+    return partitioning
+
+
+def _format_partition_value(column: str, value, partitioning: dict) -> str:
+    if column == PARTITION_BUCKET_COLUMN:
+        return str(int(value)).zfill(len(str(partitioning['bucket_count'] - 1)))
+    if column == PARTITION_DATE_COLUMN:
+        return value.strftime(PYTHON_DAY_FORMAT)
+    return urllib.parse.quote(str(value), safe=' ')
+
+
+#########################################################
+# read_manifest
+# Input: path: Pfad des Datasets
+# Liest das Manifest des Datasets. Das Manifest beschreibt den aktuellen Snapshot: die Datendateien (files),
+# die Segmente des Hash-Index (index), die Partitionsspalten, nicht mehr referenzierte Dateien (retired) und
+# das Schema (schema, siehe evolve_schema).
+# Output: Dictionary mit dem Manifest oder None, wenn das Dataset kein Manifest hat
+#########################################################
+def read_manifest(path: str):
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def _write_manifest(path: str, manifest: dict):
+    tmp_path = os.path.join(path, '.' + MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, MANIFEST_FILE))
+
+
+#########################################################
+# commit_manifest
+# Input: path: Pfad des Datasets
+#        update: Funktion, die das aktuelle Manifest bekommt und das neue Manifest zurückgibt
+# Schreibt ein neues Manifest. Das Manifest wird erst in eine temporäre Datei geschrieben und dann per
+# os.replace ersetzt, Leser sehen also immer entweder den alten oder den neuen Snapshot. Lesen, update
+# und Schreiben laufen unter einem Lock, damit z.B. eine Compaction im Hintergrund keine Appends verliert.
+# Hat das Dataset noch kein Manifest, wird es aus den vorhandenen Dateien erzeugt. Writer legen das Manifest
+# deshalb an, bevor sie neue Dateien schreiben.
+# Output: Dictionary mit dem neuen Manifest
+#########################################################
+def commit_manifest(path: str, update) -> dict:
+    with _MANIFEST_LOCK:
+        os.makedirs(path, exist_ok=True)
+        manifest = read_manifest(path)
+        if manifest is None:
+            manifest = _create_manifest(path)
+        res = update(manifest)
+        res['version'] = manifest['version'] + 1
+        res['committed_at'] = datetime.datetime.now().strftime(PYTHON_TS_FORMAT)
+        _write_manifest(path, res)
+        return res
+
+
+def _get_or_create_manifest(path: str) -> dict:
+    manifest = read_manifest(path)
+    if manifest is None:
+        manifest = commit_manifest(path, lambda current: dict(current))
+    return manifest
+
+
+def _create_manifest(path: str) -> dict:
+    res = {'format': MANIFEST_FORMAT_VERSION, 'version': 0, 'partitioning': None, 'files': [], 'index': [],
+           'retired': []}
+    files = list_parquet_files(path)
+    if len(files) > 0:
+        res['files'] = [{'path': file_name, 'rows': None, 'partition': {}} for file_name in files]
+        index_df = build_hash_index(path, files)
+        res['index'] = [write_hash_index_segment(path, index_df, _new_file_name('index'))]
+    return res
+
+
+def _new_file_name(prefix: str) -> str:
+    return prefix + '-' + datetime.datetime.now().strftime('%Y%m%d%H%M%S%f') + '-' + uuid.uuid4().hex[:8]
+
+
+def _retire(manifest: dict, paths: list) -> list:
+    retired_at = datetime.datetime.now().strftime(PYTHON_TS_FORMAT)
+    return manifest['retired'] + [{'path': p, 'retired_at': retired_at} for p in paths]
+
+
+#########################################################
+# get_store_schema
+# Input: path: Pfad des Datasets
+# Output: Dictionary mit dem Schema aus dem Manifest (siehe evolve_schema) oder None, wenn das Dataset kein
+#         Schema führt
+#########################################################
+def get_store_schema(path: str):
+    manifest = read_manifest(path)
+    return None if manifest is None else manifest.get('schema')
+
+
+def _is_meta_column(column: str) -> bool:
+    return column in META_COLUMNS.values() or column in HASH_COLUMN_NAMES
+
+
+def _create_schema(dtypes: dict) -> dict:
+    # Meta-Spalten gehören nicht zum Schema, sie werden von add_meta_columns bestimmt
+    return {'version': 1,
+            'columns': {column: str(dtype) for column, dtype in dtypes.items() if not _is_meta_column(column)},
+            'defaults': {}, 'widened': {}, 'dropped': {}, 'history': []}
+
+
+def _get_nullable_dtype(dtype) -> str:
+    # dtype, der den Default None für Dateien ohne die Spalte aufnehmen kann
+    dtype = pd.api.types.pandas_dtype(dtype)
+    if pd.api.types.is_bool_dtype(dtype) and isinstance(dtype, np.dtype):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+        return str(dtype).capitalize().replace('Uint', 'UInt')
+    return str(dtype)
+
+
+def _infer_schema(path: str, files: list) -> dict:
+    dtypes = {}
+    for file_name in files:
+        for column, dtype in fastparquet.ParquetFile(os.path.join(path, file_name)).dtypes.items():
+            dtypes.setdefault(column, dtype)
+    return _create_schema(dtypes)
+
+
+def _is_widening(dtype: str, new_dtype: str) -> bool:
+    dtype, new_dtype = pd.api.types.pandas_dtype(dtype), pd.api.types.pandas_dtype(new_dtype)
+    if pd.api.types.is_string_dtype(new_dtype) and not isinstance(new_dtype, pd.CategoricalDtype):
+        return True
+    if isinstance(dtype, np.dtype) and isinstance(new_dtype, np.dtype):
+        return dtype != new_dtype and np.can_cast(dtype, new_dtype, 'safe')
+    return False
+
+
+#########################################################
+# evolve_schema
+# Input: path: Pfad des Datasets
+#        add_columns: Dictionary {Spalte: dtype} mit neuen Spalten
+#        defaults: Dictionary {Spalte: Wert} mit den Defaults der neuen Spalten (JSON-Wert, fehlend None)
+#        drop_columns: Liste mit Spalten, die entfernt werden
+#        widen_columns: Dictionary {Spalte: dtype} mit Spalten, deren Typ verbreitert wird (z.B. int32 -> int64,
+#                       int64 -> float64 oder beliebig -> str)
+# Schema Evolution nur über Metadaten: die Änderung wird als neue Schema-Version im Manifest committet, Dateien
+# werden nie neu geschrieben. read_store_files (und damit read_parquet_df, historize_to_store usw.) wendet das
+# Schema pro Datei beim Lesen an: fehlende Spalten bekommen ihren Default (und werden wie Partitionswerte auch
+# in filters eingesetzt), entfernte Spalten werden nicht gelesen, verbreiterte Spalten werden gecastet.
+# Führt das Dataset noch kein Schema, wird es vorher aus den Footern der Dateien abgeleitet. Bei SCD2 Datasets
+# führen get_active_path und get_history_path jeweils ein eigenes Schema.
+# Wird eine entfernte Spalte wieder ergänzt, sind ihre Werte aus den alten Dateien wieder sichtbar. Neue Datasets
+# führen ab dem ersten Schreiben ein Schema, Spalten, die ein Writer zusätzlich mitbringt, werden dann
+# automatisch mit Default None ergänzt (Integer- und Bool-Spalten als nullable dtype).
+# Für den Record-Hash siehe get_record_hash_options: ergänzte Spalten mit Default ändern den Hash bestehender
+# Datensätze nicht.
+# Output: Dictionary mit dem neuen Schema
+#########################################################
+def evolve_schema(path: str, add_columns: dict = None, defaults: dict = None, drop_columns: list = None,
+                  widen_columns: dict = None) -> dict:
+    add_columns = {column: str(pd.api.types.pandas_dtype(dtype)) for column, dtype in (add_columns or {}).items()}
+    defaults = dict(defaults or {})
+    drop_columns = list(drop_columns or [])
+    widen_columns = {column: str(pd.api.types.pandas_dtype(dtype)) for column, dtype in (widen_columns or {}).items()}
+    meta = [column for column in list(add_columns) + drop_columns + list(widen_columns) if _is_meta_column(column)]
+    if meta:
+        raise ValueError('Meta columns ' + str(meta) + ' are not part of the schema evolution')
+    for column, dtype in add_columns.items():
+        try:
+            pd.Series([defaults.get(column)], dtype=object).astype(dtype)
+        except (ValueError, TypeError) as error:
+            raise ValueError('Default of ' + column + ' does not fit ' + dtype) from error
+
+    def update(current: dict) -> dict:
+        schema = current.get('schema') or _infer_schema(path, [entry['path'] for entry in current['files']])
+        schema = json.loads(json.dumps(schema))
+        for column, dtype in add_columns.items():
+            if column in schema['columns']:
+                raise ValueError('Column ' + column + ' already exists in ' + path)
+            schema['columns'][column] = dtype
+            schema['defaults'][column] = defaults.get(column)
+            schema['dropped'].pop(column, None)
+        for column in drop_columns:
+            if column not in schema['columns']:
+                raise ValueError('Column ' + column + ' does not exist in ' + path)
+            # der Default bleibt für den Record-Hash erhalten (siehe get_record_hash_options)
+            schema['dropped'][column] = schema['defaults'].get(column)
+            schema['widened'].pop(column, None)
+            del schema['columns'][column]
+        for column, dtype in widen_columns.items():
+            if column not in schema['columns'] or not _is_widening(schema['columns'][column], dtype):
+                raise ValueError('Column ' + column + ' can not be widened to ' + dtype)
+            schema['widened'].setdefault(column, schema['columns'][column])
+            schema['columns'][column] = dtype
+        schema['version'] += 1
+        schema['history'].append({'version': schema['version'], 'added': add_columns,
+                                  'defaults': {column: defaults.get(column) for column in add_columns},
+                                  'dropped': drop_columns, 'widened': widen_columns,
+                                  'changed_at': datetime.datetime.now().strftime(PYTHON_TS_FORMAT)})
+        res = dict(current)
+        res['schema'] = schema
+        return res
+
+    return commit_manifest(path, update)['schema']
+
+
+def _register_schema_columns(path: str, dtypes: dict):
+    # Neue Datasets bekommen beim ersten Schreiben ein Schema, neue Spalten eines Writers werden ergänzt.
+    # Datasets mit Dateien, aber ohne Schema bleiben unverändert, bis evolve_schema aufgerufen wird.
+    manifest = read_manifest(path)
+    schema = None if manifest is None else manifest.get('schema')
+    if schema is None:
+        if manifest is not None and len(manifest['files']) > 0:
+            return
+
+        def update(current: dict) -> dict:
+            res = dict(current)
+            if res.get('schema') is None and len(res['files']) == 0:
+                res['schema'] = _create_schema(dtypes)
+            return res
+
+        commit_manifest(path, update)
+        return
+    new_columns = {column: _get_nullable_dtype(dtype) for column, dtype in dtypes.items()
+                   if column not in schema['columns'] and not _is_meta_column(column)}
+    if new_columns:
+        evolve_schema(path, add_columns=new_columns)
+
+
+#########################################################
+# get_record_hash_options
+# Input: path: Pfad des Datasets
+# Regeln, damit eine Schema Evolution nicht jeden Datensatz zum Update macht (Parameter für add_meta_columns):
+#   record_hash_defaults: über evolve_schema ergänzte Spalten (auch wenn sie später entfernt wurden) mit ihrem
+#                         Default. Eine solche Spalte wird nur gehasht, wenn ihr Wert vom Default abweicht.
+#                         Datensätze, die vor dem Ergänzen geschrieben wurden, behalten so ihren Hash
+#   record_hash_dtypes: verbreiterte Spalten mit ihrem ursprünglichen dtype. Werte, die in den ursprünglichen dtype
+#                       passen, werden in diesem gehasht (z.B. 5.0 wie 5)
+# Spalten in record_hash_exclude_columns werden nie gehasht, ihr Ergänzen oder Entfernen ändert keinen Hash.
+# Entfernt man eine Spalte, die schon beim ersten Schreiben im Dataset war, ändert sich der Hash der Datensätze
+# dagegen einmalig: ihre Werte fallen tatsächlich weg.
+# Output: Dictionary mit record_hash_defaults und record_hash_dtypes (leer, wenn das Dataset kein Schema führt)
+#########################################################
+def get_record_hash_options(path: str) -> dict:
+    schema = get_store_schema(path)
+    if schema is None:
+        return {'record_hash_defaults': {}, 'record_hash_dtypes': {}}
+    return {'record_hash_defaults': dict(schema['defaults']), 'record_hash_dtypes': dict(schema['widened'])}
+
+
+#########################################################
+# write_data_files
+# Input: df: Dataframe, das geschrieben werden soll. Muss die Hash-Spalten aus META_COLUMNS haben
+#        path: Pfad des Datasets
+#        partitioning: Dictionary aus create_partitioning. None schreibt eine Datei ohne Partitionierung
+#        write_file: optional Funktion (positions, file_path), die die Zeilen an den Positionen schreibt. Damit
+#                    bestimmt df nur Partitionen und Hash-Index (z.B. ArrowHelpers, das eine Arrow-Tabelle schreibt)
+#        dtypes: Dictionary {Spalte: dtype} der geschriebenen Spalten für das Schema. None nimmt die dtypes von df,
+#                mit write_file wird das Schema dann nicht angepasst
+# Schreibt df als neue Dateien (eine pro Partition) in das Dataset, ohne sie in das Manifest aufzunehmen.
+# Verzeichnisse: KEY_BUCKET=n/INSERT_DATE=yyyy-mm-dd/col=value/. Partitionsspalten aus partition_cols bleiben
+# in den Dateien erhalten, Bucket und Datum werden nur im Verzeichnisnamen und im Manifest geführt.
+# Output: Liste mit Manifest-Einträgen der neuen Dateien, Dataframe mit dem Hash-Index der neuen Zeilen
+#########################################################
+def write_data_files(df: pd.DataFrame, path: str, partitioning: dict = None, write_file=None, dtypes: dict = None):
+    if dtypes is None and write_file is None:
+        dtypes = df.dtypes.to_dict()
+    if dtypes is not None and len(df) > 0:
+        _register_schema_columns(path, dtypes)
+    with measure_stage(STAGE_WRITE, 'write_data_files', rows_in=len(df), path=path) as metrics:
+        entries, index_df = _write_data_files(df, path, partitioning, write_file)
+        metrics[METRIC_ROWS_OUT] = sum(entry['rows'] for entry in entries)
+        metrics[METRIC_BYTES_WRITTEN] = sum(os.path.getsize(os.path.join(path, entry['path'])) for entry in entries)
+    return entries, index_df
+
+
+def _write_data_files(df: pd.DataFrame, path: str, partitioning: dict, write_file):
+    if partitioning is None:
+        partitioning = create_partitioning()
+    if write_file is None:
+        def write_file(positions: np.ndarray, file_path: str):
+            df.iloc[positions].to_parquet(file_path, engine=PARQUET_ENGINE, index=False)
+    buckets = _get_buckets_from_high(get_hash_pair(df, COL_KEY_HASH)[0], partitioning)
+    keys = []
+    if partitioning['bucket_count']:
+        keys.append(pd.Series(buckets, index=df.index, name=PARTITION_BUCKET_COLUMN))
+    if partitioning['date_column']:
+        keys.append(pd.to_datetime(df[partitioning['date_column']]).dt.normalize().rename(PARTITION_DATE_COLUMN))
+    keys.extend(df[column] for column in partitioning['partition_cols'])
+    if len(keys) > 0:
+        groups = df.groupby(keys, sort=True, dropna=False).indices.items()
+    else:
+        groups = [((), np.arange(len(df)))]
+
+    entries = []
+    index_parts = []
+    file_name = _new_file_name('part') + '.parquet'
+    for values, positions in groups:
+        if len(positions) == 0:
+            continue
+        if not isinstance(values, tuple):
+            values = (values,)
+        group = df.iloc[positions]
+        partition = dict(zip([key.name for key in keys], values))
+        directory = '/'.join(column + '=' + _format_partition_value(column, value, partitioning)
+                             for column, value in partition.items())
+        relative_path = directory + '/' + file_name if directory else file_name
+        os.makedirs(os.path.dirname(os.path.join(path, relative_path)), exist_ok=True)
+        write_file(positions, os.path.join(path, relative_path))
+        entries.append({'path': relative_path, 'rows': len(group),
+                        'partition': {column: _format_partition_value(column, value, partitioning)
+                                      if column != PARTITION_BUCKET_COLUMN else int(value)
+                                      for column, value in partition.items()}})
+        index_parts.append(create_hash_index(group, relative_path, partitioning))
+    if len(index_parts) == 0:
+        return entries, create_hash_index(df.iloc[0:0], None, partitioning)
+    return entries, _concat_hash_index(index_parts)
+
+
+def _check_partitioning(manifest: dict, partitioning: dict):
+    if len(manifest['files']) > 0 and manifest['partitioning'] is not None and manifest['partitioning'] != partitioning:
+        raise ValueError('Partitioning ' + str(partitioning) + ' does not match the dataset partitioning '
+                         + str(manifest['partitioning']) + '. Use write_parquet_df to repartition the dataset')
+
+
+#########################################################
+# append_parquet_df
+# Input: df: Dataframe mit den neuen Datensätzen (z.B. das Delta eines Laufs)
+#        path: Pfad des Datasets
+#        partition_cols: Liste mit Spalten, nach denen partitioniert wird
+#        partitioning: Dictionary aus create_partitioning. Sind partition_cols und partitioning None, wird die
+#                      Partitionierung des Datasets übernommen
+# Hängt df als neue Dateien an das Dataset an. Bestehende Dateien werden nicht gelesen oder neu geschrieben,
+# die Schreibkosten hängen nur von der Größe von df ab. Der Hash-Index bekommt ein neues Segment für df,
+# Dateien und Segment werden über commit_manifest in einem Schritt sichtbar.
+# Output: Dictionary mit dem neuen Manifest
+#########################################################
+def append_parquet_df(df: pd.DataFrame, path: str, partition_cols: list = None, partitioning: dict = None) -> dict:
+    manifest = _get_or_create_manifest(path)
+    partitioning = _get_partitioning(manifest, partition_cols, partitioning)
+    _check_partitioning(manifest, partitioning)
+    if len(df) == 0:
+        return manifest
+    entries, index_df = write_data_files(df, path, partitioning)
+    segment = write_hash_index_segment(path, index_df, _new_file_name('index'))
+    return commit_appended_files(path, partitioning, entries, [segment])
+
+
+#########################################################
+# get_store_partitioning
+# Input: path: Pfad des Datasets
+#        partitioning: Dictionary aus create_partitioning. None übernimmt die Partitionierung des Datasets
+# Legt bei Bedarf das Manifest an und prüft, ob partitioning zum Dataset passt (sonst ValueError)
+# Output: Partitionierung, mit der neue Dateien geschrieben werden
+#########################################################
+def get_store_partitioning(path: str, partitioning: dict = None) -> dict:
+    manifest = _get_or_create_manifest(path)
+    partitioning = _get_partitioning(manifest, None, partitioning)
+    _check_partitioning(manifest, partitioning)
+    return partitioning
+
+
+#########################################################
+# commit_appended_files
+# Input: path: Pfad des Datasets
+#        partitioning: Partitionierung, mit der die Dateien geschrieben wurden
+#        entries: Manifest-Einträge der neuen Dateien (aus write_data_files)
+#        segments: Segmente des Hash-Index für die neuen Dateien (aus write_hash_index_segment)
+# Nimmt geschriebene Dateien und Index-Segmente über commit_manifest in einem Schritt in den Snapshot auf
+# Output: Dictionary mit dem neuen Manifest
+#########################################################
+def commit_appended_files(path: str, partitioning: dict, entries: list, segments: list) -> dict:
+    def update(current: dict) -> dict:
+        _check_partitioning(current, partitioning)
+        res = dict(current)
+        res['partitioning'] = partitioning
+        res['files'] = current['files'] + entries
+        res['index'] = current['index'] + segments
+        return res
+
+    return commit_manifest(path, update)
+
+
+#########################################################
+# write_parquet_df
+# Input: df: Dataframe, das geschrieben werden soll
+#        path: String mit Pfad, an den die Daten geschrieben werden sollen
+#        partition_cols: Liste mit Spalten, nach denen partitioniert wird
+#        partitioning: Dictionary aus create_partitioning. Hat Vorrang vor partition_cols
+# Ersetzt den Inhalt des Datasets durch df (auch mit neuer Partitionierung). Die neuen Dateien und der neue
+# Hash-Index werden über commit_manifest sichtbar, die alten Dateien werden als retired markiert und von
+# vacuum_store gelöscht.
+# Output: Dictionary mit dem neuen Manifest
+#########################################################
+def write_parquet_df(df: pd.DataFrame, path: str, partition_cols: list = None, partitioning: dict = None) -> dict:
+    manifest = _get_or_create_manifest(path)
+    partitioning = _get_partitioning(manifest, partition_cols, partitioning)
+    entries, index_df = write_data_files(df, path, partitioning)
+    segment = write_hash_index_segment(path, index_df, _new_file_name('index'))
+
+    def update(current: dict) -> dict:
+        res = dict(current)
+        res['partitioning'] = partitioning
+        res['files'] = entries
+        res['index'] = [segment]
+        res['retired'] = _retire(current, [entry['path'] for entry in current['files']] + current['index'])
+        return res
+
+    return commit_manifest(path, update)
+
+
+#########################################################
+# replace_store_files
+# Input: path: Pfad des Datasets
+#        remove_files: Liste mit Dateien des Snapshots, die ersetzt werden
+#        df: Dataframe mit den Datensätzen, die an Stelle von remove_files geschrieben werden
+#        partitioning: Dictionary aus create_partitioning. None übernimmt die Partitionierung des Datasets
+#        manifest_fields: optional Dictionary mit weiteren Einträgen, die im selben Commit ins Manifest geschrieben
+#                         werden (z.B. PENDING_HISTORY aus historize_to_store)
+# Ersetzt einzelne Dateien des Datasets (Copy-on-Write auf Dateiebene). Alle anderen Dateien bleiben unverändert.
+# Der Hash-Index bekommt ein neues Segment für df, Einträge der ersetzten Dateien werden beim Lesen gefiltert.
+# Ist df leer, werden remove_files nur entfernt.
+# Wurde eine der Dateien in der Zwischenzeit schon ersetzt, wird ein RuntimeError geworfen.
+# Output: Dictionary mit dem neuen Manifest
+#########################################################
+def replace_store_files(path: str, remove_files: list, df: pd.DataFrame, partitioning: dict = None,
+                        manifest_fields: dict = None) -> dict:
+    manifest = _get_or_create_manifest(path)
+    partitioning = _get_partitioning(manifest, None, partitioning)
+    _check_partitioning(manifest, partitioning)
+    if len(remove_files) == 0 and len(df) == 0 and not manifest_fields:
+        return manifest
+    entries, index_df = write_data_files(df, path, partitioning)
+    segments = [write_hash_index_segment(path, index_df, _new_file_name('index'))] if len(entries) > 0 else []
+    remove_files = set(remove_files)
+
+    def update(current: dict) -> dict:
+        if not remove_files.issubset(entry['path'] for entry in current['files']):
+            raise RuntimeError('Files of dataset ' + path + ' were replaced by another writer')
+        res = dict(current)
+        res['partitioning'] = partitioning
+        res['files'] = [entry for entry in current['files'] if entry['path'] not in remove_files] + entries
+        res['index'] = current['index'] + segments
+        res['retired'] = _retire(current, sorted(remove_files))
+        res.update(manifest_fields or {})
+        return res
+
+    return commit_manifest(path, update)
+
+
+#########################################################
+# compact_store
+# Input: path: Pfad des Datasets
+#        target_rows: Dateien mit weniger Zeilen gelten als klein und werden pro Partition zusammengefasst
+# Fasst kleine Dateien jeder Partition zu Dateien mit bis zu target_rows Zeilen zusammen. Der Hash-Index wird
+# dabei nur umgeschlüsselt (die Datei-Spalte ist kategorisch), die Daten werden nicht neu gehasht.
+# Während der Compaction angehängte Dateien bleiben erhalten. Die ersetzten Dateien werden als retired markiert.
+# Output: Dictionary mit dem neuen Manifest
+#########################################################
+def compact_store(path: str, target_rows: int = COMPACTION_TARGET_ROWS) -> dict:
+    manifest = _get_or_create_manifest(path)
+
+    partitions = {}
+    for entry in manifest['files']:
+        if entry.get('rows') is None or entry['rows'] < target_rows:
+            partitions.setdefault(os.path.dirname(entry['path']), []).append(entry)
+    partitioning = manifest['partitioning'] or create_partitioning()
+
+    file_mapping = {}
+    new_entries = []
+    for directory, entries in partitions.items():
+        batches = _get_compaction_batches(entries, target_rows)
+        for batch in batches:
+            df = read_store_files(path, [entry['path'] for entry in batch])
+            relative_path = (directory + '/' if directory else '') + _new_file_name('part') + '.parquet'
+            df.to_parquet(os.path.join(path, relative_path), engine=PARQUET_ENGINE, index=False)
+            new_entries.append({'path': relative_path, 'rows': len(df), 'partition': batch[0].get('partition', {})})
+            for entry in batch:
+                file_mapping[entry['path']] = relative_path
+    if len(file_mapping) == 0:
+        return manifest
+
+    index_df = read_hash_index(path, segments=manifest['index'])
+    files = index_df[INDEX_FILE].cat.categories
+    mapped_files = pd.Index([file_mapping.get(f, f) for f in files])
+    new_categories = mapped_files.unique()
+    codes = new_categories.get_indexer(mapped_files)[index_df[INDEX_FILE].cat.codes.to_numpy()]
+    index_df[INDEX_FILE] = pd.Categorical.from_codes(codes, categories=new_categories)
+    index_df[INDEX_BUCKET] = _get_buckets_from_high(index_df[INDEX_KEY_HASH_HIGH].to_numpy(), partitioning)
+    segment = write_hash_index_segment(path, index_df, _new_file_name('index'))
+
+    def update(current: dict) -> dict:
+        current_files = set(entry['path'] for entry in current['files'])
+        if not set(file_mapping).issubset(current_files) or not set(manifest['index']).issubset(current['index']):
+            raise RuntimeError('Dataset ' + path + ' was rewritten during compaction')
+        res = dict(current)
+        res['files'] = [entry for entry in current['files'] if entry['path'] not in file_mapping] + new_entries
+        res['index'] = [segment] + [s for s in current['index'] if s not in manifest['index']]
+        res['retired'] = _retire(current, list(file_mapping) + manifest['index'])
+        return res
+
+    return commit_manifest(path, update)
+
+
+def _get_compaction_batches(entries: list, target_rows: int) -> list:
+    res = []
+    batch = []
+    batch_rows = 0
+    for entry in entries:
+        rows = entry.get('rows') or 0
+        if len(batch) > 0 and batch_rows + rows > target_rows:
+            res.append(batch)
+            batch = []
+            batch_rows = 0
+        batch.append(entry)
+        batch_rows += rows
+    res.append(batch)
+    return [b for b in res if len(b) > 1]
+
+
+#########################################################
+# start_compaction
+# Input: path: Pfad des Datasets
+#        target_rows: siehe compact_store
+# Startet compact_store in einem Hintergrund-Thread. Appends können währenddessen weiterlaufen.
+# Output: concurrent.futures.Future mit dem Manifest nach der Compaction
+#########################################################
+def start_compaction(path: str, target_rows: int = COMPACTION_TARGET_ROWS):
+    return _COMPACTION_EXECUTOR.submit(compact_store, path, target_rows)
+
+
+#########################################################
+# vacuum_store
+# Input: path: Pfad des Datasets
+#        retention_seconds: Mindestalter in Sekunden, ab dem nicht mehr referenzierte Dateien gelöscht werden
+# Löscht Dateien, die durch write_parquet_df oder compact_store aus dem Snapshot entfernt wurden, und ihre
+# Segmente im Intervall-Index (siehe AsOfHelpers) und im Arrow-Snapshot (siehe SnapshotHelpers). Die Wartezeit
+# schützt Leser, die noch einen älteren Snapshot lesen.
+# Output: Liste mit den gelöschten Dateien
+#########################################################
+def vacuum_store(path: str, retention_seconds: int = 0) -> list:
+    removed = []
+    threshold = datetime.datetime.now() - datetime.timedelta(seconds=retention_seconds)
+
+    def update(current: dict) -> dict:
+        res = dict(current)
+        res['retired'] = []
+        for entry in current['retired']:
+            if datetime.datetime.strptime(entry['retired_at'], PYTHON_TS_FORMAT) <= threshold:
+                removed.append(entry['path'])
+            else:
+                res['retired'].append(entry)
+        return res
+
+    commit_manifest(path, update)
+    for file_name in removed:
+        for file_path in [os.path.join(path, file_name), os.path.join(path, INTERVAL_INDEX_DIR, file_name),
+                          os.path.join(path, SNAPSHOT_DIR, file_name + SNAPSHOT_SUFFIX)]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+    return removed
+
+
+#########################################################
+# create_hash_index
+# Input: df: Dataframe mit den Spalten META_COLUMNS[COL_KEY_HASH] und META_COLUMNS[COL_RECORD_HASH]
+#        file_name: Pfad der Datei (relativ zum Dataset), in der die Zeilen von df liegen. None bei leerem df
+#        partitioning: Dictionary aus create_partitioning für den Key-Bucket. None setzt den Bucket auf 0
+# Erzeugt die Index-Einträge für df: Key- und Record-Hash als je zwei uint64 Spalten (32 Byte pro Zeile),
+# den Key-Bucket und die Datei als kategorische Spalte
+# Output: Dataframe mit INDEX_COLUMNS
+#########################################################
+def create_hash_index(df: pd.DataFrame, file_name: str, partitioning: dict = None) -> pd.DataFrame:
+    key_high, key_low = get_hash_pair(df, COL_KEY_HASH)
+    record_high, record_low = get_hash_pair(df, COL_RECORD_HASH)
+    res = pd.DataFrame({
+        INDEX_KEY_HASH_HIGH: key_high,
+        INDEX_KEY_HASH_LOW: key_low,
+        INDEX_RECORD_HASH_HIGH: record_high,
+        INDEX_RECORD_HASH_LOW: record_low,
+        INDEX_BUCKET: _get_buckets_from_high(key_high, partitioning),
+    })
+    categories = [] if file_name is None else [file_name]
+    res[INDEX_FILE] = pd.Categorical.from_codes(np.zeros(len(res), dtype=np.int8), categories=categories)
+    return res
+
+
+#########################################################
+# build_hash_index
+# Input: path: Pfad des Datasets
+#        files: Liste mit Dateien, für die der Index aufgebaut wird. None nimmt die Dateien des aktuellen Snapshots
+# Baut den Hash-Index aus den Parquet-Dateien des Datasets auf. Pro Datei werden nur die beiden Hash-Spalten gelesen.
+# Output: Dataframe mit INDEX_COLUMNS
+#########################################################
+def build_hash_index(path: str, files: list = None) -> pd.DataFrame:
+    manifest = read_manifest(path)
+    partitioning = manifest['partitioning'] if manifest is not None else None
+    if files is None:
+        files = get_store_files(path)
+    parts = []
+    for file_name in files:
+        parquet_file = fastparquet.ParquetFile(os.path.join(path, file_name))
+        columns = [column for column in parquet_file.columns if column in HASH_COLUMN_NAMES]
+        df = parquet_file.to_pandas(columns=columns, index=False)
+        parts.append(create_hash_index(df, file_name, partitioning))
+    if len(parts) == 0:
+        return create_hash_index(pd.DataFrame({META_COLUMNS[COL_KEY_HASH]: [], META_COLUMNS[COL_RECORD_HASH]: []}), None)
+    return _concat_hash_index(parts)
+
+
+def _concat_hash_index(parts: list) -> pd.DataFrame:
+    files = pd.api.types.union_categoricals([part[INDEX_FILE] for part in parts])
+    res = pd.concat([part.drop(columns=INDEX_FILE) for part in parts], ignore_index=True)
+    res[INDEX_FILE] = files
+    return res
+
+
+#########################################################
+# write_hash_index_segment
+# Input: path: Pfad des Datasets
+#        index_df: Dataframe mit INDEX_COLUMNS
+#        segment_name: Name des Segments im Verzeichnis HASH_INDEX_DIR
+# Schreibt ein Segment des Hash-Index, sortiert nach Key-Bucket. Row Groups beginnen an Bucket-Grenzen und haben
+# mindestens INDEX_ROW_GROUP_MIN_ROWS Zeilen, damit read_hash_index über die Statistiken der Row Groups nur die
+# benötigten Buckets liest. Die Datei wird zuerst temporär geschrieben und dann umbenannt,
+# damit nie ein halb geschriebenes Segment gelesen wird
+# Output: Pfad des geschriebenen Segments relativ zu path
+#########################################################
+def write_hash_index_segment(path: str, index_df: pd.DataFrame, segment_name: str) -> str:
+    index_df = index_df.sort_values(INDEX_BUCKET, kind='stable', ignore_index=True)
+    buckets = index_df[INDEX_BUCKET].to_numpy()
+    row_group_offsets = [0]
+    for offset in np.flatnonzero(buckets[1:] != buckets[:-1]) + 1:
+        if offset - row_group_offsets[-1] >= INDEX_ROW_GROUP_MIN_ROWS:
+            row_group_offsets.append(int(offset))
+
+    index_path = os.path.join(path, HASH_INDEX_DIR)
+    os.makedirs(index_path, exist_ok=True)
+    tmp_path = os.path.join(index_path, '.' + segment_name + '.tmp')
+    index_df.to_parquet(tmp_path, engine=PARQUET_ENGINE, index=False, row_group_offsets=row_group_offsets)
+    os.replace(tmp_path, os.path.join(index_path, segment_name + '.parquet'))
+    return HASH_INDEX_DIR + '/' + segment_name + '.parquet'
+
+
+#########################################################
+# read_hash_index
+# Input: path: Pfad des Datasets
+#        columns: Liste mit Spalten aus INDEX_COLUMNS, die gelesen werden sollen. None liest alle
+#        segments: Liste mit Segmenten, die gelesen werden sollen. None nimmt die Segmente aus dem Manifest
+#                  bzw. bei Datasets ohne Manifest alle Segmente in HASH_INDEX_DIR
+#        buckets: Liste mit Key-Buckets, deren Einträge gelesen werden sollen. None liest alle
+# Liest die Segmente des Hash-Index. Die Daten des Datasets selbst werden nicht gelesen. Row Groups ohne
+# die gesuchten Buckets werden über ihre Statistiken übersprungen. Einträge von Dateien, die nicht mehr zum
+# Snapshot gehören (z.B. nach replace_store_files), werden herausgefiltert, die Segmente selbst werden erst
+# von compact_store oder rebuild_hash_index bereinigt.
+# Output: Dataframe mit INDEX_COLUMNS oder None, wenn kein Hash-Index vorhanden ist
+#########################################################
+def read_hash_index(path: str, columns: list = None, segments: list = None, buckets: list = None):
+    manifest = read_manifest(path)
+    if segments is None:
+        if manifest is not None:
+            segments = manifest['index']
+        elif os.path.isdir(os.path.join(path, HASH_INDEX_DIR)):
+            segments = sorted(HASH_INDEX_DIR + '/' + f for f in os.listdir(os.path.join(path, HASH_INDEX_DIR))
+                              if f.endswith('.parquet') and not f.startswith('.'))
+        else:
+            return None
+    if len(segments) == 0:
+        return None
+    live_files = None if manifest is None else pd.Index([entry['path'] for entry in manifest['files']])
+
+    read_columns = columns
+    if columns is not None:
+        read_columns = list(columns)
+        if buckets is not None and INDEX_BUCKET not in read_columns:
+            read_columns.append(INDEX_BUCKET)
+        if live_files is not None and INDEX_FILE not in read_columns:
+            read_columns.append(INDEX_FILE)
+    filters = None
+    if buckets is not None:
+        buckets = [int(b) for b in buckets]
+        filters = [(INDEX_BUCKET, 'in', buckets)]
+
+    parts = []
+    for segment in segments:
+        part = pd.read_parquet(os.path.join(path, segment), columns=read_columns, filters=filters, engine=PARQUET_ENGINE)
+        mask = np.ones(len(part), dtype=bool)
+        if buckets is not None:
+            mask &= part[INDEX_BUCKET].isin(buckets).to_numpy()
+        if live_files is not None:
+            live = part[INDEX_FILE].cat.categories.isin(live_files)
+            mask &= live[part[INDEX_FILE].cat.codes.to_numpy()]
+        if not mask.all():
+            part = part[mask]
+        if columns is not None:
+            part = part[columns]
+        parts.append(part)
+    if columns is not None and INDEX_FILE not in columns:
+        return pd.concat(parts, ignore_index=True)
+    return _concat_hash_index(parts)
+
+
+#########################################################
+# rebuild_hash_index
+# Input: path: Pfad des Datasets
+# Baut den Hash-Index komplett neu aus den Parquet-Dateien des aktuellen Snapshots auf und ersetzt alle
+# bestehenden Segmente durch ein neues Segment
+# Output: Dataframe mit dem neuen Hash-Index
+#########################################################
+def rebuild_hash_index(path: str) -> pd.DataFrame:
+    index_df = build_hash_index(path)
+    segment = write_hash_index_segment(path, index_df, _new_file_name('index'))
+
+    def update(current: dict) -> dict:
+        res = dict(current)
+        res['index'] = [segment]
+        res['retired'] = _retire(current, [s for s in current['index'] if s != segment])
+        return res
+
+    commit_manifest(path, update)
+    return index_df
+
+
+#########################################################
+# check_hash_index
+# Input: path: Pfad des Datasets
+# Prüft den Hash-Index gegen die Parquet-Dateien. Vergleicht pro Datei die Hash-Paare als Multimenge.
+# Output: Dictionary mit consistent (Boolean), index_rows, data_rows, missing_in_index (Zeilen der Daten,
+#         die im Index fehlen), missing_in_data (Index-Einträge ohne Zeile in den Daten) und files (betroffene Dateien)
+#########################################################
+def check_hash_index(path: str) -> dict:
+    files = get_store_files(path)
+    existing_files = [f for f in files if os.path.isfile(os.path.join(path, f))]
+    data_index = build_hash_index(path, existing_files)
+    stored_index = read_hash_index(path)
+    if stored_index is None:
+        stored_index = data_index.iloc[0:0]
+    compare_columns = INDEX_COLUMNS + ['OCCURRENCE']
+    data_index = data_index.astype({INDEX_FILE: str})
+    stored_index = stored_index.astype({INDEX_FILE: str})
+    data_index['OCCURRENCE'] = data_index.groupby(INDEX_COLUMNS).cumcount()
+    stored_index['OCCURRENCE'] = stored_index.groupby(INDEX_COLUMNS).cumcount()
+    merged = data_index[compare_columns].merge(stored_index[compare_columns], how='outer', on=compare_columns, indicator=True)
+    mismatches = merged[merged['_merge'] != 'both']
+    return {
+        'consistent': len(mismatches) == 0 and len(existing_files) == len(files),
+        'index_rows': len(stored_index),
+        'data_rows': len(data_index),
+        'missing_in_index': int((mismatches['_merge'] == 'left_only').sum()),
+        'missing_in_data': int((mismatches['_merge'] == 'right_only').sum()),
+        'files': sorted(set(mismatches[INDEX_FILE].unique().tolist()) | (set(files) - set(existing_files))),
+    }
+
+
+#########################################################
+# classify_delta_by_index
+# Input: path: Pfad des Datasets mit dem aktuellen Datenbestand
+#        new_df: Dataframe, das die neugeladenen Daten beinhaltet. Muss META_COLUMNS als Spalten haben
+# Klassifiziert new_df wie classify_hashes, liest aber vom aktuellen Datenbestand nur den Hash-Index und
+# bei nach Buckets partitionierten Datasets nur die Buckets, deren Key-Hashes in new_df vorkommen.
+# Liegt noch kein Datenbestand vor, sind alle Zeilen Inserts.
+# Output: int8 Array mit einem DELTA_* Wert pro Zeile von new_df
+#########################################################
+def classify_delta_by_index(path: str, new_df: pd.DataFrame) -> np.ndarray:
+    new_key = get_hash_pair(new_df, COL_KEY_HASH)
+    new_record = get_hash_pair(new_df, COL_RECORD_HASH)
+    buckets = None
+    manifest = read_manifest(path)
+    if manifest is not None and manifest['partitioning'] is not None and manifest['partitioning']['bucket_count']:
+        buckets = np.unique(_get_buckets_from_high(new_key[0], manifest['partitioning'])).tolist()
+    index_df = read_hash_index(path, columns=INDEX_COLUMNS[:4], buckets=buckets)
+    if index_df is None:
+        empty = np.empty(0, dtype=np.uint64)
+        current_key, current_record = (empty, empty), (empty, empty)
+    else:
+        current_key = (index_df[INDEX_KEY_HASH_HIGH].to_numpy(), index_df[INDEX_KEY_HASH_LOW].to_numpy())
+        current_record = (index_df[INDEX_RECORD_HASH_HIGH].to_numpy(), index_df[INDEX_RECORD_HASH_LOW].to_numpy())
+    return classify_hash_pairs(current_key, current_record, new_key, new_record)
+
+
+#########################################################
+# get_delta_by_index
+# Input: path: Pfad des Datasets mit dem aktuellen Datenbestand
+#        new_df: Dataframe, das die neugeladenen Daten beinhaltet. Muss META_COLUMNS als Spalten haben
+# Wie get_delta, vergleicht aber über classify_delta_by_index nur gegen den Hash-Index
+# Output: Dataframe das nur Inserts und Updates aus new_df beinhaltet
+#########################################################
+def get_delta_by_index(path: str, new_df: pd.DataFrame) -> pd.DataFrame:
+    with measure_stage(STAGE_DELTA, 'get_delta_by_index', rows_in=len(new_df), path=path) as metrics:
+        delta_class = classify_delta_by_index(path, new_df)
+        res = new_df[delta_class != DELTA_UNCHANGED]
+        metrics[METRIC_ROWS_OUT] = len(res)
+    return res
+
+
+#########################################################
+# append_delta_chunks
+# Input: chunks: Iterable mit Dataframes der Quelle ohne Metadatenspalten (z.B. pd.read_csv(..., chunksize=n))
+#        path: Pfad des Datasets mit dem aktuellen Datenbestand
+#        currents: Dictionary mit Zeitwerten aus create_currents, gilt für alle Chunks
+#        key_columns: Liste mit den Key-Spalten
+#        record_hash_exclude_columns: Liste mit Spalten, die nicht im Record gehasht werden sollen
+#        hash_mode: Hash-Verfahren (siehe compute_hashes)
+#        partitioning: Dictionary aus create_partitioning. None übernimmt die Partitionierung des Datasets
+#        compact: Boolean, ob die Metadatenspalten im kompakten Schema geschrieben werden (siehe add_meta_columns)
+# Streaming-Variante von add_meta_columns + get_delta_by_index + append_parquet_df. Jeder Chunk wird gehasht,
+# gegen den Hash-Index klassifiziert und sein Delta direkt als Dateien und Index-Segment geschrieben. Der
+# Speicherbedarf hängt damit von der Chunk-Größe ab und nicht von der Größe der Quelle.
+# Alle Chunks werden gegen den Stand vor dem Lauf klassifiziert und erst am Ende über ein commit_manifest
+# sichtbar, das Ergebnis entspricht daher einem Lauf mit der ganzen Quelle als ein Dataframe. Bei einem
+# Fehler werden die bereits geschriebenen Dateien wieder gelöscht.
+# Da Hashes über die String-Darstellung der Werte gebildet werden, müssen alle Chunks dieselben dtypes haben
+# (sonst ValueError, z.B. dtype an pd.read_csv übergeben). Die Regeln aus get_record_hash_options des Datasets
+# werden beim Hashen angewendet.
+# Output: Dictionary mit der Anzahl gelesener (rows) und geschriebener (delta_rows) Datensätze
+#########################################################
+def append_delta_chunks(chunks, path: str, currents: dict, key_columns: list, record_hash_exclude_columns: list = None,
+                        hash_mode: int = HASH_MODE_MD5, partitioning: dict = None, compact: bool = False) -> dict:
+    options = get_record_hash_options(path)
+    meta_chunks = (add_meta_columns(chunk, currents, key_columns, record_hash_exclude_columns, hash_mode, compact,
+                                    **options) for chunk in chunks)
+    with metrics_run(currents[CURRENT_RUN_ID]):
+        return append_meta_chunks(meta_chunks, path, partitioning)
+
+
+#########################################################
+# append_meta_chunks
+# Input: meta_chunks: Iterable mit Dataframes, die bereits META_COLUMNS als Spalten haben (aus add_meta_columns)
+#        path: Pfad des Datasets mit dem aktuellen Datenbestand
+#        partitioning: Dictionary aus create_partitioning. None übernimmt die Partitionierung des Datasets
+#        write_executor: optional Executor (z.B. ThreadPoolExecutor(1)), der die Deltas im Hintergrund schreibt.
+#                        Während ein Delta geschrieben wird, wird schon der nächste Chunk klassifiziert. Maximal
+#                        PENDING_WRITES Deltas warten auf das Schreiben, danach blockiert die Klassifikation
+#        diff_executor: optional Executor (z.B. ThreadPoolExecutor), der bei nach Buckets partitionierten Datasets
+#                       jeden Chunk pro Bucket parallel klassifiziert. Ein Bucket wird nur gegen die Hashes desselben
+#                       Buckets im Index verglichen
+# Klassifiziert und schreibt die Chunks wie append_delta_chunks, das Hashen ist aber schon passiert (z.B. parallel
+# in run_loads).
+# Output: Dictionary mit der Anzahl gelesener (rows) und geschriebener (delta_rows) Datensätze
+#########################################################
+def append_meta_chunks(meta_chunks, path: str, partitioning: dict = None, write_executor=None,
+                       diff_executor=None) -> dict:
+    partitioning = get_store_partitioning(path, partitioning)
+    index_df = read_hash_index(path, columns=INDEX_COLUMNS[:4])
+    if index_df is None:
+        empty = np.empty(0, dtype=np.uint64)
+        current_key, current_record = (empty, empty), (empty, empty)
+    else:
+        current_key = (index_df[INDEX_KEY_HASH_HIGH].to_numpy(), index_df[INDEX_KEY_HASH_LOW].to_numpy())
+        current_record = (index_df[INDEX_RECORD_HASH_HIGH].to_numpy(), index_df[INDEX_RECORD_HASH_LOW].to_numpy())
+        del index_df
+    current_buckets = None
+    if diff_executor is not None and partitioning is not None and partitioning['bucket_count']:
+        current_buckets = _split_hash_pairs_by_bucket(current_key, current_record, partitioning)
+        del current_key, current_record
+
+    entries = []
+    segments = []
+    writes = deque()
+    dtypes = None
+    res = {'rows': 0, 'delta_rows': 0}
+
+    def collect(written: tuple):
+        entries.extend(written[0])
+        segments.append(written[1])
+
+    try:
+        for chunk in meta_chunks:
+            if dtypes is None:
+                dtypes = chunk.dtypes
+            elif not chunk.dtypes.equals(dtypes):
+                raise ValueError('Chunk dtypes ' + str(dict(chunk.dtypes)) + ' do not match the first chunk '
+                                 + str(dict(dtypes)) + '. Pass fixed dtypes to the reader')
+            with measure_stage(STAGE_DELTA, 'append_meta_chunks', rows_in=len(chunk), path=path) as metrics:
+                if current_buckets is None:
+                    delta_class = classify_hash_pairs(current_key, current_record,
+                                                      get_hash_pair(chunk, COL_KEY_HASH),
+                                                      get_hash_pair(chunk, COL_RECORD_HASH))
+                else:
+                    delta_class = _classify_by_bucket(current_buckets, get_hash_pair(chunk, COL_KEY_HASH),
+                                                      get_hash_pair(chunk, COL_RECORD_HASH), partitioning,
+                                                      diff_executor)
+                delta_df = chunk[delta_class != DELTA_UNCHANGED]
+                metrics[METRIC_ROWS_OUT] = len(delta_df)
+            res['rows'] += len(chunk)
+            res['delta_rows'] += len(delta_df)
+            if len(delta_df) == 0:
+                continue
+            if write_executor is None:
+                collect(_write_delta_chunk(delta_df, path, partitioning))
+                continue
+            while len(writes) >= PENDING_WRITES:
+                collect(writes.popleft().result())
+            writes.append(write_executor.submit(contextvars.copy_context().run, _write_delta_chunk, delta_df, path,
+                                                partitioning))
+        while len(writes) > 0:
+            collect(writes.popleft().result())
+
+        if len(entries) > 0:
+            commit_appended_files(path, partitioning, entries, segments)
+    except BaseException:
+        # laufende Schreibvorgänge abwarten, damit auch ihre Dateien entfernt werden
+        for future in writes:
+            future.cancel()
+        for future in writes:
+            if not future.cancelled() and future.exception() is None:
+                collect(future.result())
+        for file_name in [entry['path'] for entry in entries] + segments:
+            if os.path.exists(os.path.join(path, file_name)):
+                os.remove(os.path.join(path, file_name))
+        raise
+    return res
+
+
+def _write_delta_chunk(delta_df: pd.DataFrame, path: str, partitioning: dict) -> tuple:
+    chunk_entries, chunk_index_df = write_data_files(delta_df, path, partitioning)
+    return chunk_entries, write_hash_index_segment(path, chunk_index_df, _new_file_name('index'))
+
+
+def _group_rows_by_bucket(high: np.ndarray, partitioning: dict) -> list:
+    buckets = _get_buckets_from_high(high, partitioning)
+    order = np.argsort(buckets, kind='stable')
+    values, starts = np.unique(buckets[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    return [(bucket, order[start:end]) for bucket, start, end in zip(values.tolist(), starts, ends)]
+
+
+def _split_hash_pairs_by_bucket(key: tuple, record: tuple, partitioning: dict) -> dict:
+    return {bucket: ((key[0][rows], key[1][rows]), (record[0][rows], record[1][rows]))
+            for bucket, rows in _group_rows_by_bucket(key[0], partitioning)}
+
+
+def _classify_by_bucket(current_buckets: dict, new_key: tuple, new_record: tuple, partitioning: dict,
+                        diff_executor) -> np.ndarray:
+    empty = np.empty(0, dtype=np.uint64)
+    futures = []
+    for bucket, rows in _group_rows_by_bucket(new_key[0], partitioning):
+        current_key, current_record = current_buckets.get(bucket, ((empty, empty), (empty, empty)))
+        futures.append((rows, diff_executor.submit(classify_hash_pairs, current_key, current_record,
+                                                   (new_key[0][rows], new_key[1][rows]),
+                                                   (new_record[0][rows], new_record[1][rows]))))
+    res = np.empty(len(new_key[0]), dtype=np.int8)
+    try:
+        for rows, future in futures:
+            res[rows] = future.result()
+    finally:
+        for _, future in futures:
+            future.cancel()
+    return res
+
+
+#########################################################
 # historize_dataset
-# Input: spark: SparkSession, um SQL-Engine zu nutzen
+# Input: new_df: Dataframe, das die neugeladenen Daten beinhaltet. Muss META_COLUMNS als Spalten haben
 #        current_df: Dataframe, das den aktuellen Datenbestand beinhaltet. Muss Hashes und COL_VALID_TO + COL_VALID_FROM als Spalten haben
-#        new_df: Dataframe, das die neugeladenen Daten beinhaltet. Muss META_COLUMNS als Spalten haben
+#                    None, wenn noch keine Daten vorliegen
 #        currents: Dictionary mit Zeitwerten. Muss je nach valid_from_mode die Werte CURRENT_RUN_TS, CURRENT_RUN_DAY und/oder CURRENT_RUN_ID beinhalten.
 #        valid_from_mode: Integer, der den valid_from_mode bestimmt (Welches valid_from Datum an neue Datensätze geschrieben wird). 
 #                         VALID_FROM_MODE_LOWER_BOUND, VALID_FROM_MODE_LOAD_DATE, VALID_FROM_MODE_CUSTOM
 #        valid_from_date: Datum, das bei VALID_FROM_MODE_CUSTOM als valid_from gesetzt werden soll
+#        full_load: Boolean, ob new_df ein Full Load ist. Dann werden aktive Keys, die in new_df fehlen, über
+#                   get_deleted_by_full_load als gelöscht abgeschlossen
 # Wrapperfunktion für merge_scd2. Für den Fall, dass noch keine aktuellen Daten vorliegen wird ein leeren Dataframe für die Historisierung
 # erzeugt, das die nötigen Spalten beinhaltet.
 # Output: Dataframe nach SCD Typ 2 historisiert
 #########################################################
-def historize_dataset(new_df: pd.DataFrame, current_df: pd.DataFrame ,currents: dict, valid_from_mode: int, valid_from_date: str = None) -> pd.DataFrame:
-  if current_df == None:
+def historize_dataset(new_df: pd.DataFrame, current_df: pd.DataFrame ,currents: dict, valid_from_mode: int, valid_from_date: str = None,
+                      full_load: bool = False) -> pd.DataFrame:
+  if current_df is None:
     current_df = create_empty_hist_dataframe(new_df)
-  res = merge_scd2(current_df, new_df, currents, valid_from_mode, valid_from_date)
-  return res'''
+  deleted_keys = get_deleted_by_full_load(current_df, new_df) if full_load else None
+  res = merge_scd2(current_df, new_df, currents, valid_from_mode, valid_from_date, deleted_keys)
+  return res
 
 
 #########################################################
@@ -309,8 +1661,264 @@ def historize_dataset(new_df: pd.DataFrame, current_df: pd.DataFrame ,currents:
 # Output: 2 Dataframes, je mit aktiven und abgeschlossenen Datensätzen
 #########################################################
 def split_merged_dataset(df: pd.DataFrame):
-  hist = df[df[META_COLUMNS[COL_VALID_TO]] > SCD2_UPPER_BOUND]
-  active = df[df[META_COLUMNS[COL_VALID_TO]] == SCD2_UPPER_BOUND]
-  hist.show()
-  active.show()
-  return hist, active
\ No newline at end of file
+  active_mask = df[META_COLUMNS[COL_VALID_TO]] == to_scd2_date(SCD2_UPPER_BOUND)
+  hist = df[~active_mask]
+  active = df[active_mask]
+  return hist, active
+
+
+#########################################################
+# get_active_path / get_history_path
+# Input: base_path: Pfad eines SCD2 Datasets, das aus aktiven und abgeschlossenen Datensätzen besteht
+# Ein SCD2 Dataset besteht aus zwei Datasets: ACTIVE_DATASET mit den offenen Versionen
+# (VALID_TO = SCD2_UPPER_BOUND) und HISTORY_DATASET mit den abgeschlossenen Versionen
+# Output: Pfad des jeweiligen Datasets
+#########################################################
+def get_active_path(base_path: str) -> str:
+    return os.path.join(base_path, ACTIVE_DATASET)
+
+
+def get_history_path(base_path: str) -> str:
+    return os.path.join(base_path, HISTORY_DATASET)
+
+
+#########################################################
+# historize_to_store
+# Input: new_df: Dataframe, das die neugeladenen Daten beinhaltet. Muss META_COLUMNS als Spalten haben
+#        base_path: Pfad des SCD2 Datasets (siehe get_active_path / get_history_path)
+#        currents: Dictionary mit Zeitwerten. Muss je nach valid_from_mode die Werte CURRENT_RUN_TS, CURRENT_RUN_DAY und/oder CURRENT_RUN_ID beinhalten.
+#        valid_from_mode: Integer, der den valid_from_mode bestimmt (siehe merge_scd2)
+#        valid_from_date: Datum, das bei VALID_FROM_MODE_CUSTOM als valid_from gesetzt werden soll
+#        partitioning: Dictionary aus create_partitioning für neue Datasets. None übernimmt die Partitionierung
+#                      der bestehenden Datasets
+#        full_load: Boolean, ob new_df ein Full Load ist. Aktive Keys, die in new_df fehlen, werden als gelöscht
+#                   abgeschlossen (Anti-Join über alle Buckets des Hash-Index)
+#        deleted_keys: Dataframe mit Key-Hashes, die zusätzlich als gelöscht abgeschlossen werden (z.B. aus
+#                      get_deletes_by_column bei Delta-Lieferungen)
+# Historisiert new_df nach SCD Typ 2 direkt in die aktiven und abgeschlossenen Datasets:
+#   1. Über den Hash-Index der aktiven Versionen (nur die Buckets aus new_df) werden unveränderte Datensätze
+#      aussortiert und die Dateien bestimmt, in denen geänderte Keys liegen
+#   2. Nur diese Dateien werden gelesen und mit merge_scd2_classes gemergt. Ob ein Key nur noch abgeschlossen
+#      existiert, entscheidet der Hash-Index der Historie
+#   3. Die abgeschlossenen Versionen werden als Dateien der Historie geschrieben, aber noch nicht committet.
+#      replace_store_files ersetzt die gelesenen aktiven Dateien, hängt neue Keys an und vermerkt die Dateien
+#      der Historie im selben Commit als PENDING_HISTORY im aktiven Manifest
+#   4. commit_pending_history übernimmt sie in das Manifest der Historie und entfernt den Vermerk
+# Der aktive Commit ist damit der einzige Commit, der zählt: bricht ein Lauf vorher ab, ist nichts sichtbar und
+# eine Wiederholung schreibt alles neu. Bricht er danach ab, holt der nächste historize_to_store (oder
+# commit_pending_history) den Commit der Historie genau einmal nach, eine Wiederholung des Laufs findet die neuen
+# Versionen schon aktiv und schreibt keine Historie doppelt. Bis dahin fehlen die abgeschlossenen Versionen beim
+# Lesen der Historie (read_scd2_dataset), der aktive Stand ist schon korrekt.
+# Gelöschte Keys werden als Tombstone abgeschlossen (VALID_TO und DELETED gesetzt) und in die Historie verschoben.
+# Neu geschrieben werden nur die aktiven Dateien, in denen gelöschte Keys liegen. Liegen in einer Datei nur
+# gelöschte Keys, wird sie ohne Ersatz entfernt.
+# Die Kosten hängen damit von new_df und den betroffenen Dateien ab, nicht von der Größe der Historie.
+# Output: Dictionary mit der Anzahl Datensätze pro Klasse (inserted, updated, unchanged, deleted)
+#########################################################
+def historize_to_store(new_df: pd.DataFrame, base_path: str, currents: dict, valid_from_mode: int,
+                       valid_from_date: str = None, partitioning: dict = None, full_load: bool = False,
+                       deleted_keys: pd.DataFrame = None) -> dict:
+    with metrics_run(currents[CURRENT_RUN_ID]):
+        return _historize_to_store(new_df, base_path, currents, valid_from_mode, valid_from_date, partitioning,
+                                   full_load, deleted_keys)
+
+
+def _historize_to_store(new_df: pd.DataFrame, base_path: str, currents: dict, valid_from_mode: int,
+                        valid_from_date: str, partitioning: dict, full_load: bool, deleted_keys: pd.DataFrame) -> dict:
+    active_path = get_active_path(base_path)
+    history_path = get_history_path(base_path)
+    commit_pending_history(base_path)
+    active_manifest = _get_or_create_manifest(active_path)
+    partitioning = _get_partitioning(active_manifest, None, partitioning)
+
+    new_key = get_hash_pair(new_df, COL_KEY_HASH)
+    new_record = get_hash_pair(new_df, COL_RECORD_HASH)
+    deleted_key = hash_to_uint64_pair([]) if deleted_keys is None else get_hash_pair(deleted_keys, COL_KEY_HASH)
+    buckets = None
+    if partitioning['bucket_count'] and not full_load:
+        buckets = np.unique(_get_buckets_from_high(np.concatenate([new_key[0], deleted_key[0]]), partitioning)).tolist()
+
+    index_df = read_hash_index(active_path, buckets=buckets)
+    if index_df is None:
+        index_df = create_hash_index(new_df.iloc[0:0], None)
+    index_key = (index_df[INDEX_KEY_HASH_HIGH].to_numpy(), index_df[INDEX_KEY_HASH_LOW].to_numpy())
+    index_record = (index_df[INDEX_RECORD_HASH_HIGH].to_numpy(), index_df[INDEX_RECORD_HASH_LOW].to_numpy())
+    delta_class = classify_hash_pairs(index_key, index_record, new_key, new_record)
+    changed = delta_class == DELTA_UPDATE
+    index_in_new = isin_hash_pairs(index_key[0], index_key[1], new_key[0], new_key[1])
+    if full_load:
+        index_deleted = ~index_in_new
+    else:
+        index_deleted = ~index_in_new & isin_hash_pairs(index_key[0], index_key[1], deleted_key[0], deleted_key[1])
+    index_pos = lookup_hash_pairs(new_key[0][changed], new_key[1][changed], index_key[0], index_key[1])
+    affected_files = sorted(set(index_df[INDEX_FILE].iloc[index_pos]) | set(index_df[INDEX_FILE][index_deleted]))
+    deleted_key_hashes = (index_key[0][index_deleted], index_key[1][index_deleted])
+
+    batch_df = new_df[delta_class != DELTA_UNCHANGED]
+    current_df = read_store_files(active_path, affected_files) if affected_files else create_empty_hist_dataframe(new_df)
+    history_index = read_hash_index(history_path, columns=[INDEX_KEY_HASH_HIGH, INDEX_KEY_HASH_LOW], buckets=buckets)
+    closed_key_hashes = None
+    if history_index is not None:
+        closed_key_hashes = (history_index[INDEX_KEY_HASH_HIGH].to_numpy(), history_index[INDEX_KEY_HASH_LOW].to_numpy())
+
+    with measure_stage(STAGE_MERGE, 'historize_to_store', rows_in=len(batch_df), current_rows=len(current_df)) as metrics:
+        current_only_df, new_only_df, unchanged_current_df, changed_current_df, changed_new_df = merge_scd2_classes(
+            current_df, batch_df, currents, valid_from_mode, valid_from_date, closed_key_hashes, deleted_key_hashes)
+        metrics[METRIC_ROWS_OUT] = (len(current_only_df) + len(new_only_df) + len(unchanged_current_df)
+                                    + len(changed_current_df) + len(changed_new_df))
+
+    pending = None
+    if len(changed_current_df) > 0:
+        history_partitioning = get_store_partitioning(history_path, partitioning)
+        entries, history_index_df = write_data_files(changed_current_df, history_path, history_partitioning)
+        pending = {'partitioning': history_partitioning, 'files': entries,
+                   'index': [write_hash_index_segment(history_path, history_index_df, _new_file_name('index'))]}
+    active_parts = [df for df in [current_only_df, unchanged_current_df, new_only_df, changed_new_df] if len(df) > 0]
+    active_df = pd.concat(active_parts, ignore_index=True) if len(active_parts) > 0 else current_df.iloc[0:0]
+    if len(affected_files) > 0 or len(active_df) > 0 or pending is not None:
+        replace_store_files(active_path, affected_files, active_df, partitioning,
+                            None if pending is None else {PENDING_HISTORY: pending})
+        commit_pending_history(base_path)
+
+    return {'inserted': len(new_only_df), 'updated': len(changed_new_df),
+            'unchanged': int((delta_class == DELTA_UNCHANGED).sum()), 'deleted': int(index_deleted.sum())}
+
+
+#########################################################
+# commit_pending_history
+# Input: base_path: Pfad des SCD2 Datasets
+# Übernimmt die im aktiven Manifest vermerkten Dateien der Historie (PENDING_HISTORY, siehe historize_to_store)
+# in das Manifest der Historie und entfernt danach den Vermerk. Dateien, die schon in der Historie stehen,
+# werden nicht nochmal angehängt, ein Abbruch zwischen den beiden Commits ist also unkritisch.
+# Output: Anzahl übernommener Dateien
+#########################################################
+def commit_pending_history(base_path: str) -> int:
+    active_path = get_active_path(base_path)
+    manifest = read_manifest(active_path)
+    if manifest is None or not manifest.get(PENDING_HISTORY):
+        return 0
+    pending = manifest[PENDING_HISTORY]
+    added = []
+
+    def update_history(current: dict) -> dict:
+        _check_partitioning(current, pending['partitioning'])
+        known = set(entry['path'] for entry in current['files'])
+        added.extend(entry for entry in pending['files'] if entry['path'] not in known)
+        res = dict(current)
+        res['partitioning'] = pending['partitioning']
+        res['files'] = current['files'] + added
+        res['index'] = current['index'] + [segment for segment in pending['index'] if segment not in current['index']]
+        return res
+
+    def update_active(current: dict) -> dict:
+        res = dict(current)
+        res.pop(PENDING_HISTORY, None)
+        return res
+
+    commit_manifest(get_history_path(base_path), update_history)
+    commit_manifest(active_path, update_active)
+    return len(added)
+
+
+#########################################################
+# merge_cdc_to_store
+# Input: new_df: Dataframe mit eingefügten und geänderten Datensätzen eines CDC-Batches. Muss META_COLUMNS als
+#                Spalten haben. Kommt ein Key mehrfach vor, gilt der letzte Datensatz
+#        path: Pfad des Datasets mit dem aktuellen Stand (ein Datensatz pro Key)
+#        currents: Dictionary aus create_currents für die Run-ID der Metriken
+#        deleted_keys: Dataframe mit Key-Hashes, die gelöscht werden (z.B. aus get_deletes_by_column). Steht ein
+#                      Key auch in new_df, gewinnt der Datensatz aus new_df
+#        partitioning: Dictionary aus create_partitioning für neue Datasets. None übernimmt die Partitionierung
+#                      des Datasets
+# Übernimmt einen CDC-Batch ohne Neuschreiben der ganzen Tabelle. Der Hash-Index ist der persistente Index
+# von Key auf Datei:
+#   1. Über den Hash-Index (nur die Buckets aus new_df und deleted_keys) werden unveränderte Datensätze
+#      aussortiert und die Dateien bestimmt, in denen geänderte oder gelöschte Keys liegen
+#   2. Nur diese Dateien werden gelesen, die betroffenen Keys entfernt und die neuen Versionen ergänzt.
+#      INSERT_TS und INSERT_RUN_ID bleiben bei Änderungen vom bestehenden Datensatz erhalten
+#   3. replace_store_files ersetzt die Dateien und hängt neue Keys in einem Commit an
+# Alle anderen Dateien bleiben unverändert, die Kosten hängen also von der Größe des Batches und der betroffenen
+# Dateien ab (mit Key-Buckets und compact_store wenige, kleine Dateien), nicht von der Größe der Tabelle.
+# Output: Dictionary mit der Anzahl Datensätze pro Klasse (inserted, updated, unchanged, deleted)
+#########################################################
+def merge_cdc_to_store(new_df: pd.DataFrame, path: str, currents: dict, deleted_keys: pd.DataFrame = None,
+                       partitioning: dict = None) -> dict:
+    with metrics_run(currents[CURRENT_RUN_ID]):
+        return _merge_cdc_to_store(new_df, path, deleted_keys, partitioning)
+
+
+def _merge_cdc_to_store(new_df: pd.DataFrame, path: str, deleted_keys: pd.DataFrame, partitioning: dict) -> dict:
+    manifest = _get_or_create_manifest(path)
+    partitioning = _get_partitioning(manifest, None, partitioning)
+
+    new_key = get_hash_pair(new_df, COL_KEY_HASH)
+    last = ~pd.DataFrame({'high': new_key[0], 'low': new_key[1]}).duplicated(keep='last').to_numpy()
+    if not last.all():
+        new_df = new_df[last]
+        new_key = (new_key[0][last], new_key[1][last])
+    new_record = get_hash_pair(new_df, COL_RECORD_HASH)
+    deleted_key = hash_to_uint64_pair([]) if deleted_keys is None else get_hash_pair(deleted_keys, COL_KEY_HASH)
+    buckets = None
+    if partitioning['bucket_count']:
+        buckets = np.unique(_get_buckets_from_high(np.concatenate([new_key[0], deleted_key[0]]), partitioning)).tolist()
+
+    index_df = read_hash_index(path, buckets=buckets)
+    if index_df is None:
+        index_df = create_hash_index(new_df.iloc[0:0], None)
+    # Hashtabellen nur über die Keys des Batches aufbauen, der Index wird einmal dagegen geprüft
+    index_key = (index_df[INDEX_KEY_HASH_HIGH].to_numpy(), index_df[INDEX_KEY_HASH_LOW].to_numpy())
+    in_new = isin_hash_pairs(index_key[0], index_key[1], new_key[0], new_key[1])
+    index_deleted = ~in_new & isin_hash_pairs(index_key[0], index_key[1], deleted_key[0], deleted_key[1])
+    index_df = index_df[in_new | index_deleted]
+    index_deleted = index_deleted[in_new | index_deleted]
+    index_key = (index_df[INDEX_KEY_HASH_HIGH].to_numpy(), index_df[INDEX_KEY_HASH_LOW].to_numpy())
+    index_record = (index_df[INDEX_RECORD_HASH_HIGH].to_numpy(), index_df[INDEX_RECORD_HASH_LOW].to_numpy())
+    delta_class = classify_hash_pairs(index_key, index_record, new_key, new_record)
+    changed = delta_class == DELTA_UPDATE
+    index_pos = lookup_hash_pairs(new_key[0][changed], new_key[1][changed], index_key[0], index_key[1])
+    affected_files = sorted(set(index_df[INDEX_FILE].iloc[index_pos]) | set(index_df[INDEX_FILE][index_deleted]))
+
+    batch_df = new_df[delta_class != DELTA_UNCHANGED]
+    current_df = read_store_files(path, affected_files) if affected_files else new_df.iloc[0:0]
+    with measure_stage(STAGE_MERGE, 'merge_cdc_to_store', rows_in=len(batch_df), current_rows=len(current_df)) as metrics:
+        current_key = get_hash_pair(current_df, COL_KEY_HASH)
+        batch_key = get_hash_pair(batch_df, COL_KEY_HASH)
+        remove_key = (np.concatenate([batch_key[0], index_key[0][index_deleted]]),
+                      np.concatenate([batch_key[1], index_key[1][index_deleted]]))
+        keep = ~isin_hash_pairs(current_key[0], current_key[1], remove_key[0], remove_key[1])
+
+        batch_df = batch_df.copy()
+        batch_pos = lookup_hash_pairs(current_key[0], current_key[1], batch_key[0], batch_key[1])
+        found = batch_pos >= 0
+        for column in [COL_INSERT_RUN_TS, COL_INSERT_RUN_ID]:
+            name = META_COLUMNS[column]
+            if found.any() and name in batch_df.columns and name in current_df.columns:
+                values = batch_df[name].to_numpy(copy=True)
+                values[batch_pos[found]] = current_df[name].to_numpy()[found]
+                batch_df[name] = values
+        res_df = pd.concat([current_df[keep], batch_df], ignore_index=True)
+        metrics[METRIC_ROWS_OUT] = len(res_df)
+
+    if len(affected_files) > 0 or len(batch_df) > 0:
+        replace_store_files(path, affected_files, res_df, partitioning)
+    return {'inserted': int((delta_class == DELTA_INSERT).sum()), 'updated': int(changed.sum()),
+            'unchanged': int((delta_class == DELTA_UNCHANGED).sum()), 'deleted': int(index_deleted.sum())}
+
+
+#########################################################
+# read_scd2_dataset
+# Input: base_path: Pfad des SCD2 Datasets (siehe get_active_path / get_history_path)
+#        active_only: Boolean, ob nur die aktiven Versionen gelesen werden sollen
+#        legacy: Boolean, ob Metadatenspalten im kompakten Schema in das bisherige Schema umgewandelt werden
+#        hash_mode: hash_mode der gespeicherten Hashes für legacy (siehe to_legacy_meta_columns)
+# Kompatibilitäts-Reader: liest abgeschlossene und aktive Versionen als eine Tabelle, wie sie merge_scd2 liefert
+# Output: Dataframe oder None, wenn keine Daten vorliegen
+#########################################################
+def read_scd2_dataset(base_path: str, active_only: bool = False, legacy: bool = False, hash_mode: int = HASH_MODE_MD5):
+    parts = [read_parquet_df(get_active_path(base_path), legacy=legacy, hash_mode=hash_mode)]
+    if not active_only:
+        parts.insert(0, read_parquet_df(get_history_path(base_path), legacy=legacy, hash_mode=hash_mode))
+    parts = [part for part in parts if part is not None and len(part) > 0]
+    if len(parts) == 0:
+        return None
+    return pd.concat(parts, ignore_index=True)
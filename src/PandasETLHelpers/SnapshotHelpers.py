@@ -0,0 +1,119 @@
+import os
+import uuid
+from src.PandasETLHelpers.ArrowHelpers import *
+from src.PandasETLHelpers.ArrowHelpers import _check_arrow, _to_pandas
+try:
+    import pyarrow.ipc as pa_ipc
+except ImportError:
+    pa_ipc = None
+
+
+SCHEMA_VERSION_KEY = b'schema_version'
+
+
+def _get_snapshot_segment(path: str, file_name: str) -> str:
+    return os.path.join(path, SNAPSHOT_DIR, file_name + SNAPSHOT_SUFFIX)
+
+
+def _get_schema_version(path: str) -> int:
+    return (get_store_schema(path) or {}).get('version', 0)
+
+
+def _is_segment_current(path: str, file_name: str, schema_version: int) -> bool:
+    segment = _get_snapshot_segment(path, file_name)
+    if not os.path.exists(segment):
+        return False
+    metadata = pa_ipc.open_file(pa.memory_map(segment)).schema.metadata or {}
+    return metadata.get(SCHEMA_VERSION_KEY) == str(schema_version).encode()
+
+
+#########################################################
+# build_snapshot_segment
+# Input: path: Pfad des Datasets
+#        file_name: Pfad der Datei relativ zu path
+# Liest die Datei wie read_parquet_df (inklusive Partitionswerten aus dem Pfad) und schreibt sie unkomprimiert im
+# Arrow IPC Format als Segment unter SNAPSHOT_DIR. Dateien werden im Dataset nie verändert, ein Segment bleibt
+# also gültig, bis vacuum_store die Datei löscht oder evolve_schema das Schema ändert. Die Version des Schemas wird
+# dafür in den Metadaten des Segments abgelegt.
+# Output: Anzahl geschriebener Bytes
+#########################################################
+def build_snapshot_segment(path: str, file_name: str) -> int:
+    _check_arrow()
+    table = pa.Table.from_pandas(read_store_files(path, [file_name]), preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           SCHEMA_VERSION_KEY: str(_get_schema_version(path)).encode()})
+    segment = _get_snapshot_segment(path, file_name)
+    os.makedirs(os.path.dirname(segment), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(segment), '.' + uuid.uuid4().hex + '.tmp')
+    try:
+        with pa_ipc.new_file(tmp_path, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, segment)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return os.path.getsize(segment)
+
+
+#########################################################
+# refresh_snapshot
+# Input: path: Pfad des Datasets
+# Legt für alle Dateien des aktuellen Snapshots (siehe get_store_files), die noch kein Segment mit der aktuellen
+# Schema-Version haben, eines über build_snapshot_segment an. Nach einem Append sind das nur die neu geschriebenen
+# Dateien, der Rest des Snapshots wird nicht angefasst. Nach evolve_schema werden alle Segmente neu aufgebaut, die
+# parquet Dateien selbst bleiben unverändert. Segmente ersetzter Dateien löscht vacuum_store.
+# Output: Liste mit den Dateien, deren Segment neu geschrieben wurde
+#########################################################
+def refresh_snapshot(path: str) -> list:
+    _check_arrow()
+    with measure_stage(STAGE_WRITE, 'refresh_snapshot', path=path) as metrics:
+        schema_version = _get_schema_version(path)
+        files = [file_name for file_name in get_store_files(path)
+                 if not _is_segment_current(path, file_name, schema_version)]
+        metrics[METRIC_BYTES_WRITTEN] = sum(build_snapshot_segment(path, file_name) for file_name in files)
+        metrics[METRIC_ROWS_OUT] = len(files)
+    return files
+
+
+#########################################################
+# read_snapshot_table
+# Input: path: Pfad des Datasets
+#        columns: Liste mit Spalten, die gelesen werden. None liest alle
+#        refresh: Boolean, ob fehlende Segmente vor dem Lesen über refresh_snapshot angelegt werden
+# Bildet den aktuellen Stand des Datasets aus den Segmenten unter SNAPSHOT_DIR. Die Segmente werden nur
+# memory-mapped, nicht dekodiert: die Arrow-Tabelle zeigt direkt auf die Seiten im Page Cache des
+# Betriebssystems, die sich alle Prozesse teilen, die denselben Snapshot lesen.
+# Output: Arrow-Tabelle mit denselben Zeilen in derselben Reihenfolge wie read_parquet_df oder None, wenn am Pfad
+#         keine Daten liegen
+#########################################################
+def read_snapshot_table(path: str, columns: list = None, refresh: bool = True):
+    _check_arrow()
+    if refresh:
+        refresh_snapshot(path)
+    files = select_store_files(path)
+    if files is None:
+        return None
+    with measure_stage(STAGE_READ, 'read_snapshot_table', path=path, files=len(files)) as metrics:
+        tables = [pa_ipc.open_file(pa.memory_map(_get_snapshot_segment(path, file_name))).read_all()
+                  for file_name in files]
+        res = pa.concat_tables(tables, promote_options='permissive') if len(tables) > 0 else pa.table({})
+        if columns is not None:
+            res = res.select(list(columns))
+        metrics[METRIC_ROWS_OUT] = res.num_rows
+    return res
+
+
+#########################################################
+# read_snapshot_df
+# Input: path, columns, refresh: siehe read_snapshot_table
+# Wie read_parquet_df(path, columns), liest aber den memory-mapped Snapshot. Nur die Umwandlung in pandas kostet
+# noch Zeit, das Dekodieren der parquet Dateien entfällt.
+# Output: Dataframe oder None
+#########################################################
+def read_snapshot_df(path: str, columns: list = None, refresh: bool = True):
+    table = read_snapshot_table(path, columns, refresh)
+    if table is None:
+        return None
+    if table.num_columns == 0:
+        return pd.DataFrame(columns=columns)
+    return _to_pandas(table)
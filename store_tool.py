@@ -0,0 +1,71 @@
+import argparse
+import json
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.BatchHelpers as bh
+
+
+def rebuild_index(args):
+    index_df = scd.rebuild_hash_index(args.path)
+    print('Rebuilt hash index of ' + args.path + ' with ' + str(len(index_df)) + ' rows')
+    return 0
+
+
+def check_index(args):
+    res = scd.check_hash_index(args.path)
+    print(json.dumps(res, indent=2))
+    return 0 if res['consistent'] else 1
+
+
+def compact(args):
+    manifest = scd.compact_store(args.path, args.target_rows)
+    print('Compacted ' + args.path + ' to ' + str(len(manifest['files'])) + ' files (manifest version ' + str(manifest['version']) + ')')
+    return 0
+
+
+def vacuum(args):
+    removed = scd.vacuum_store(args.path, args.retention_seconds)
+    print('Removed ' + str(len(removed)) + ' unreferenced files from ' + args.path)
+    return 0
+
+
+def run_batch(args):
+    report = bh.run_tables(bh.read_table_configs(args.config), args.max_workers, args.memory_limit,
+                           args.table_memory, report_path=args.report)
+    for res in report['tables']:
+        print(res['name'] + ': ' + res['status'] + ('' if res['error'] is None else ' (' + res['error'] + ')'))
+    print(json.dumps(report['summary'], indent=2))
+    return 0 if report['summary']['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintenance commands for parquet datasets written by the SCD helpers')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rebuild_parser = commands.add_parser('rebuild-index', help='rebuild the hash index from the parquet files')
+    rebuild_parser.add_argument('path')
+    rebuild_parser.set_defaults(func=rebuild_index)
+
+    check_parser = commands.add_parser('check-index', help='check the hash index against the parquet files')
+    check_parser.add_argument('path')
+    check_parser.set_defaults(func=check_index)
+
+    compact_parser = commands.add_parser('compact', help='merge small files of each partition')
+    compact_parser.add_argument('path')
+    compact_parser.add_argument('--target-rows', type=int, default=scd.COMPACTION_TARGET_ROWS)
+    compact_parser.set_defaults(func=compact)
+
+    vacuum_parser = commands.add_parser('vacuum', help='delete files that are no longer part of the snapshot')
+    vacuum_parser.add_argument('path')
+    vacuum_parser.add_argument('--retention-seconds', type=int, default=3600)
+    vacuum_parser.set_defaults(func=vacuum)
+
+    batch_parser = commands.add_parser('run-batch', help='historize all tables of a JSON/YAML configuration')
+    batch_parser.add_argument('config', help='configuration file or directory with one file per table')
+    batch_parser.add_argument('--max-workers', type=int, default=None)
+    batch_parser.add_argument('--memory-limit', type=int, default=None, help='bytes for the whole batch')
+    batch_parser.add_argument('--table-memory', type=int, default=None, help='bytes per table')
+    batch_parser.add_argument('--report', default=None, help='path of the JSON metrics report')
+    batch_parser.set_defaults(func=run_batch)
+
+    args = parser.parse_args()
+    raise SystemExit(args.func(args))
@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.ArrowHelpers as ah
+import src.PandasETLHelpers.PipelineHelpers as ph
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+SOURCES = ['data/grades_delta_old.csv', 'data/grades_delta_new.csv', 'data/grades_full_old.csv']
+
+
+@pytest.mark.parametrize('hash_mode', [mch.HASH_MODE_MD5, mch.HASH_MODE_FAST64, mch.HASH_MODE_FAST128])
+@pytest.mark.parametrize('compact', [False, True])
+def test_table_meta_columns_match_pandas(hash_mode, compact):
+    currents = mch.create_currents()
+    table = ah.add_meta_columns_table(ah.read_csv_table(SOURCES[0]), currents, KEY_COLUMNS, ['SSN'],
+                                      hash_mode, compact)
+    expected = mch.add_meta_columns(pd.read_csv(SOURCES[0]), currents, KEY_COLUMNS, ['SSN'], hash_mode, compact)
+    pd.testing.assert_frame_equal(ah.table_to_df(table), expected)
+
+
+def test_append_delta_table_matches_pandas_store(tmp_path):
+    # beide Backends schreiben abwechselnd in dasselbe Dataset, das Ergebnis entspricht dem reinen pandas-Lauf
+    partitioning = scd.create_partitioning(bucket_count=4, date_column='INSERT_TS')
+    for position, source in enumerate(SOURCES):
+        currents = mch.create_currents()
+        new = mch.add_meta_columns(pd.read_csv(source), currents, KEY_COLUMNS, hash_mode=mch.HASH_MODE_FAST128)
+        scd.append_parquet_df(scd.get_delta_by_index(str(tmp_path / 'pandas'), new), str(tmp_path / 'pandas'),
+                              partitioning=partitioning)
+        if position % 2 == 0:
+            table = ah.add_meta_columns_table(ah.read_csv_table(source), currents, KEY_COLUMNS,
+                                              hash_mode=mch.HASH_MODE_FAST128)
+            res = ah.append_delta_table(table, str(tmp_path / 'mixed'), partitioning)
+            assert res['rows'] == len(new)
+        else:
+            scd.append_parquet_df(scd.get_delta_by_index(str(tmp_path / 'mixed'), new), str(tmp_path / 'mixed'))
+    sort_columns = KEY_COLUMNS + ['INSERT_TS']
+    pd.testing.assert_frame_equal(scd.read_parquet_df(str(tmp_path / 'mixed')).sort_values(sort_columns, ignore_index=True),
+                                  scd.read_parquet_df(str(tmp_path / 'pandas')).sort_values(sort_columns, ignore_index=True))
+
+
+def test_arrow_backend_plans(tmp_path):
+    for source in SOURCES[:2]:
+        currents = mch.create_currents()
+        res = {}
+        for backend in [ph.BACKEND_PANDAS, ph.BACKEND_ARROW]:
+            plan = ph.plan_select(ph.plan_csv_source(ph.create_plan(), source), ['Lastname', 'Firstname', 'Grade'])
+            plan = ph.plan_store_sink(ph.plan_delta(ph.plan_meta_columns(plan, KEY_COLUMNS)), str(tmp_path / backend))
+            res[backend] = ph.run_plan(plan, currents, backend)
+        assert res[ph.BACKEND_ARROW] == res[ph.BACKEND_PANDAS]
+    pd.testing.assert_frame_equal(scd.read_parquet_df(str(tmp_path / ph.BACKEND_ARROW)),
+                                  scd.read_parquet_df(str(tmp_path / ph.BACKEND_PANDAS)))
+    assert [operator['operator'] for operator in ph.optimize_plan(plan, ph.BACKEND_ARROW)] == \
+        [ph.OP_READ_CSV_TABLE, ph.OP_ADD_META_COLUMNS_TABLE, ph.OP_APPEND_DELTA_TABLE]
+
+    currents = mch.create_currents()
+    plan = ph.plan_meta_columns(ph.plan_csv_source(ph.create_plan(), SOURCES[1]), KEY_COLUMNS)
+    pd.testing.assert_frame_equal(ph.run_plan(plan, currents, ph.BACKEND_ARROW), ph.run_plan(plan, currents))
+    with pytest.raises(ValueError):
+        ph.optimize_plan(plan, 'polars')
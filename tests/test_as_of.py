@@ -0,0 +1,85 @@
+import os
+
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.AsOfHelpers as aoh
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+RUNS = [('data/grades_full_old.csv', '2021-01-01 10:00:00'), ('data/grades_full_new.csv', '2021-02-01 10:00:00'),
+        ('data/grades_full_old.csv', '2021-03-01 10:00:00')]
+DAYS = ['2020-12-31', '2021-01-15', '2021-02-01', '2021-02-28', '2021-03-01', '2030-01-01']
+
+
+@pytest.fixture
+def store(tmp_path):
+    # drei Full Loads: Änderungen, neue Keys, Löschungen und eine Rückänderung auf den alten Stand
+    for csv_path, run_ts in RUNS:
+        currents = mch.create_currents(run_ts)
+        new = mch.add_meta_columns(pd.read_csv(csv_path), currents, KEY_COLUMNS)
+        scd.historize_to_store(new, str(tmp_path), currents, mch.VALID_FROM_MODE_LOAD_DATE,
+                               partitioning=scd.create_partitioning(bucket_count=4), full_load=True)
+    return str(tmp_path), scd.read_scd2_dataset(str(tmp_path))
+
+
+def valid_at(versions: pd.DataFrame, day: str) -> pd.DataFrame:
+    day = pd.Timestamp(day)
+    return versions[(versions['VALID_FROM'] <= day) & (versions['VALID_TO'] >= day)]
+
+
+def test_read_as_of_matches_full_scan(store):
+    base_path, versions = store
+    changed = versions.loc[versions['VALID_TO'] < pd.Timestamp(mch.SCD2_UPPER_BOUND), 'KEY_HASH']
+    for day in DAYS:
+        expected = valid_at(versions, day)
+        res = aoh.read_as_of(base_path, day)
+        assert sorted([] if res is None else res['RECORD_HASH']) == sorted(expected['RECORD_HASH'])
+        res = aoh.read_as_of(base_path, day, columns=['KEY_HASH', 'Grade'], key_hashes=changed)
+        assert sorted([] if res is None else res['KEY_HASH']) == sorted(expected.loc[expected['KEY_HASH'].isin(changed), 'KEY_HASH'])
+
+    history = aoh.read_key_history(base_path, versions['KEY_HASH'][versions['Lastname'] == 'Franklin'])
+    assert list(history['Grade']) == ['B-', 'B+', 'B-']
+    assert list(history['VALID_FROM']) == [pd.Timestamp('2021-01-01'), pd.Timestamp('2021-02-01'), pd.Timestamp('2021-03-01')]
+
+
+def test_interval_index_segments_follow_the_store_files(store):
+    base_path, versions = store
+    history_path = scd.get_history_path(base_path)
+    index_df = aoh.read_interval_index(history_path)
+    assert len(index_df) == len(scd.read_parquet_df(history_path))
+    assert set(index_df[scd.INDEX_FILE]) == set(scd.get_store_files(history_path))
+    assert len(aoh.read_interval_index(history_path, as_of='2021-02-15')) == \
+        len(valid_at(scd.read_parquet_df(history_path), '2021-02-15'))
+
+    active_path = scd.get_active_path(base_path)
+    aoh.read_interval_index(active_path)
+    files = scd.get_store_files(active_path)
+    assert all(os.path.exists(os.path.join(active_path, scd.INTERVAL_INDEX_DIR, file_name)) for file_name in files)
+    scd.write_parquet_df(scd.read_parquet_df(active_path), active_path)
+    assert set(scd.vacuum_store(active_path)) >= set(files)
+    assert not any(os.path.exists(os.path.join(active_path, scd.INTERVAL_INDEX_DIR, file_name)) for file_name in files)
+    assert len(aoh.read_interval_index(active_path)) == len(scd.read_parquet_df(active_path))
+
+
+def test_as_of_join_matches_point_lookups(store):
+    base_path, versions = store
+    keys = versions[KEY_COLUMNS].drop_duplicates()
+    fact_df = pd.concat([keys.assign(DAY=day, AMOUNT=position) for position, day in enumerate(DAYS)], ignore_index=True)
+    fact_df.loc[0, 'DAY'] = None
+    fact_df.index = fact_df.index + 100
+
+    res = aoh.as_of_join(fact_df, versions, 'DAY', KEY_COLUMNS, columns=['Grade', 'VALID_FROM'])
+    assert list(res.index) == list(fact_df.index)
+    expected = []
+    for _, row in fact_df.iterrows():
+        version = versions.iloc[0:0] if row['DAY'] is None else valid_at(
+            versions[(versions['Lastname'] == row['Lastname']) & (versions['Firstname'] == row['Firstname'])], row['DAY'])
+        assert len(version) <= 1
+        expected.append(version['Grade'].iloc[0] if len(version) > 0 else None)
+    assert [None if pd.isna(grade) else grade for grade in res['Grade']] == expected
+    assert res['Grade'].notna().sum() > 0 and res['Grade'].isna().sum() > 0
+
+    pd.testing.assert_frame_equal(aoh.as_of_join_store(fact_df, base_path, 'DAY', KEY_COLUMNS,
+                                                       columns=['Grade', 'VALID_FROM']), res)
@@ -0,0 +1,89 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.BatchHelpers as bh
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+VERSION_COLUMNS = KEY_COLUMNS + ['Grade', 'VALID_FROM', 'VALID_TO', 'DELETED']
+
+
+def versions(base_path: str) -> pd.DataFrame:
+    # DELETED ist der Zeitstempel des jeweiligen Laufs, verglichen wird nur, ob eine Version ein Tombstone ist
+    df = scd.read_scd2_dataset(base_path)[VERSION_COLUMNS]
+    df = df.assign(DELETED=df['DELETED'].notna()).astype(str)
+    return df.sort_values(VERSION_COLUMNS, ignore_index=True)
+
+
+def current(path: str) -> pd.DataFrame:
+    meta = [mch.META_COLUMNS[column] for column in [mch.COL_INSERT_RUN_TS, mch.COL_UPDATE_RUN_TS,
+                                                    mch.COL_INSERT_RUN_ID, mch.COL_UPDATE_RUN_ID]]
+    return scd.read_parquet_df(path).drop(columns=meta).sort_values(['RECORD_HASH'], ignore_index=True)
+
+
+def test_read_table_configs(tmp_path):
+    (tmp_path / 'a.json').write_text(json.dumps([
+        {'name': 'grades', 'source': 'data/grades_full_old.csv', 'target': 'x', 'key_columns': KEY_COLUMNS,
+         'load_type': 'full', 'valid_from_mode': 'load_date', 'hash_mode': 'fast64',
+         'partitioning': {'bucket_count': 4}}]))
+    (tmp_path / 'b.yaml').write_text('name: current\nsource: data/grades_delta_old.csv\ntarget: y\n'
+                                     'key_columns: [Lastname, Firstname]\nhistorization: current\n')
+    (tmp_path / 'notes.txt').write_text('ignored')
+    tables = bh.read_table_configs(str(tmp_path))
+    assert [table[bh.TABLE_NAME] for table in tables] == ['grades', 'current']
+    assert tables[0][bh.TABLE_VALID_FROM_MODE] == mch.VALID_FROM_MODE_LOAD_DATE
+    assert tables[0][bh.TABLE_HASH_MODE] == mch.HASH_MODE_FAST64
+    assert tables[0][bh.TABLE_PARTITIONING] == scd.create_partitioning(bucket_count=4)
+    assert tables[1][bh.TABLE_HISTORIZATION] == bh.HISTORIZATION_CURRENT
+
+    (tmp_path / 'c.json').write_text(json.dumps({'name': 'bad', 'source': 's', 'target': 't', 'keys': ['a']}))
+    with pytest.raises(ValueError):
+        bh.read_table_configs(str(tmp_path))
+    with pytest.raises(ValueError):
+        bh.create_table('bad', 's', 't', KEY_COLUMNS, load_type='incremental')
+
+
+def test_run_tables_matches_direct_runs(tmp_path):
+    # ein Chunk pro Lauf und Chunks mit wenigen Zeilen ergeben dieselbe Historie wie historize_to_store direkt
+    runs = ['data/grades_full_new.csv', 'data/grades_full_old.csv', 'data/grades_full_new.csv']
+    for source in runs:
+        currents = mch.create_currents()
+        scd.historize_to_store(mch.add_meta_columns(pd.read_csv(source), currents, KEY_COLUMNS),
+                               str(tmp_path / 'direct'), currents, mch.VALID_FROM_MODE_LOAD_DATE, full_load=True)
+        for table_memory in [None, 2000]:
+            tables = [bh.create_table('grades', source, str(tmp_path / str(table_memory)), KEY_COLUMNS,
+                                      load_type=bh.LOAD_TYPE_FULL, valid_from_mode='load_date'),
+                      bh.create_table('current', source, str(tmp_path / ('current' + str(table_memory))),
+                                      KEY_COLUMNS, historization=bh.HISTORIZATION_CURRENT)]
+            with ThreadPoolExecutor(2) as executor:
+                report = bh.run_tables(tables, table_memory=table_memory, executor=executor)
+            assert report['summary']['failed'] == 0
+            assert (report['tables'][0]['chunk_size'] < 16) == (table_memory is not None)
+    expected = versions(str(tmp_path / 'direct'))
+    assert expected['DELETED'].eq('True').sum() > 0
+    pd.testing.assert_frame_equal(versions(str(tmp_path / 'None')), expected)
+    pd.testing.assert_frame_equal(versions(str(tmp_path / '2000')), expected)
+    pd.testing.assert_frame_equal(current(str(tmp_path / 'current2000')), current(str(tmp_path / 'currentNone')))
+
+
+def test_run_tables_report(tmp_path):
+    tables = [bh.create_table('small', 'data/grades_delta_new.csv', str(tmp_path / 'small'), KEY_COLUMNS),
+              bh.create_table('missing', 'data/missing.csv', str(tmp_path / 'missing'), KEY_COLUMNS),
+              bh.create_table('big', 'data/grades_full_new.csv', str(tmp_path / 'big'), KEY_COLUMNS)]
+    report = bh.run_tables(tables, max_workers=2, report_path=str(tmp_path / 'report.json'))
+    # große Tabellen zuerst, ein Fehler bricht den Batch nicht ab
+    assert [res['name'] for res in report['tables']] == ['big', 'small', 'missing']
+    assert [res['status'] for res in report['tables']] == [bh.STATUS_OK, bh.STATUS_OK, bh.STATUS_ERROR]
+    assert report['tables'][2]['error'].startswith('FileNotFoundError')
+    assert report['summary']['failed'] == 1 and report['summary']['rows'] == 16 + 3
+    assert {'big', 'small'} <= {metrics['table'] for metrics in report['stages']}
+    assert all(metrics[mch.METRIC_RUN_ID] in [res['run_id'] for res in report['tables']] for metrics in report['stages'])
+    with open(tmp_path / 'report.json') as f:
+        assert json.load(f)['summary']['tables'] == 3
+
+    with pytest.raises(ValueError):
+        bh.run_tables(tables + tables[:1])
@@ -0,0 +1,25 @@
+import pandas as pd
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+from benchmarks.synthetic_data import create_runs
+from benchmarks.run_benchmarks import KEY_COLUMNS, run_benchmark
+
+
+def test_create_runs_rates():
+    old_df, new_df = create_runs(10000, change_rate=0.1, delete_rate=0.02, insert_rate=0.05, seed=1)
+    assert list(old_df.columns) == list(pd.read_csv('data/grades_full_old.csv').columns)
+    assert not old_df.duplicated(KEY_COLUMNS).any() and not new_df.duplicated(KEY_COLUMNS).any()
+
+    currents = mch.create_currents()
+    old_meta = mch.add_meta_columns(old_df, currents, KEY_COLUMNS)
+    new_meta = mch.add_meta_columns(new_df, currents, KEY_COLUMNS)
+    inserts, updates, _ = mch.classify_delta(old_meta, new_meta)
+    assert (len(inserts), len(updates)) == (500, 1000)
+    assert len(old_df) - len(new_df) + len(inserts) == 200
+
+
+def test_run_benchmark_reports_every_stage(tmp_path):
+    res = run_benchmark(2000, str(tmp_path), hash_mode=mch.HASH_MODE_FAST64, compact=True)
+    assert [stats['stage'] for stats in res] == ['add_meta_columns', 'store_write', 'delta', 'delta_by_index',
+                                                 'store_append', 'scd2_merge']
+    assert all(stats['seconds'] > 0 and stats['peak_rss_bytes'] > 0 for stats in res)
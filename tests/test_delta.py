@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+
+
+def meta_df(csv_path: str, hash_mode: int) -> pd.DataFrame:
+    currents = mch.create_currents('2021-01-01 10:00:00')
+    return mch.add_meta_columns(pd.read_csv(csv_path), currents, KEY_COLUMNS, hash_mode=hash_mode)
+
+
+@pytest.mark.parametrize('hash_mode', [mch.HASH_MODE_MD5, mch.HASH_MODE_FAST64, mch.HASH_MODE_FAST128])
+def test_classify_delta_matches_anti_join(hash_mode):
+    current = meta_df('data/grades_delta_old.csv', hash_mode)
+    new = meta_df('data/grades_delta_new.csv', hash_mode)
+    new = pd.concat([new, current.iloc[:2]], ignore_index=True)
+
+    inserts, updates, unchanged = mch.classify_delta(current[['KEY_HASH', 'RECORD_HASH']], new)
+
+    current_keys = set(current['KEY_HASH'])
+    current_pairs = set(zip(current['KEY_HASH'], current['RECORD_HASH']))
+    pairs = list(zip(new['KEY_HASH'], new['RECORD_HASH']))
+    assert inserts.index.tolist() == [i for i, (k, r) in enumerate(pairs) if k not in current_keys]
+    assert updates.index.tolist() == [i for i, (k, r) in enumerate(pairs) if k in current_keys and (k, r) not in current_pairs]
+    assert unchanged.index.tolist() == [i for i, p in enumerate(pairs) if p in current_pairs]
+    assert len(updates) == 1 and len(unchanged) == 2
+    assert mch.get_delta(current, new).index.tolist() == sorted(inserts.index.tolist() + updates.index.tolist())
+
+
+def test_isin_hash_pairs_handles_fingerprint_collisions():
+    high = np.array([1, 2, 3], dtype=np.uint64)
+    low = np.array([5, 6, 7], dtype=np.uint64)
+    values_high = high ^ mch._mix64(low) ^ mch._mix64(np.array([9, 9, 9], dtype=np.uint64))
+    values_high = np.concatenate([values_high, high[:1]])
+    values_low = np.array([9, 9, 9, 5], dtype=np.uint64)
+    assert mch.isin_hash_pairs(high, low, values_high, values_low).tolist() == [True, False, False]
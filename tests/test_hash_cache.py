@@ -0,0 +1,66 @@
+import os
+
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.HashCacheHelpers as hch
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+SOURCE = 'data/grades_delta_old.csv'
+
+
+@pytest.fixture
+def hash_calls(monkeypatch):
+    calls = []
+    compute_meta_hashes = hch.compute_meta_hashes
+
+    def counting(*args, **kwargs):
+        calls.append(args[2])
+        return compute_meta_hashes(*args, **kwargs)
+
+    monkeypatch.setattr(hch, 'compute_meta_hashes', counting)
+    return calls
+
+
+@pytest.mark.parametrize('hash_mode', [mch.HASH_MODE_MD5, mch.HASH_MODE_FAST64, mch.HASH_MODE_FAST128])
+@pytest.mark.parametrize('compact', [False, True])
+def test_cached_equals_uncached(tmp_path, hash_calls, hash_mode, compact):
+    currents = mch.create_currents()
+    expected = mch.add_meta_columns(pd.read_csv(SOURCE), currents, KEY_COLUMNS, hash_mode=hash_mode, compact=compact)
+    for _ in range(2):
+        res = hch.add_meta_columns_cached(SOURCE, str(tmp_path), currents, KEY_COLUMNS, hash_mode=hash_mode,
+                                          compact=compact)
+        pd.testing.assert_frame_equal(res, expected)
+    assert len(hash_calls) == 1
+
+
+def test_cache_invalidated_by_columns_and_content(tmp_path, hash_calls):
+    source = str(tmp_path / 'source.csv')
+    pd.read_csv(SOURCE).to_csv(source, index=False)
+    cache_path = str(tmp_path / 'cache')
+    currents = mch.create_currents()
+    hch.add_meta_columns_cached(source, cache_path, currents, KEY_COLUMNS)
+    hch.add_meta_columns_cached(source, cache_path, currents, KEY_COLUMNS, record_hash_exclude_columns=['Grade'])
+    hch.add_meta_columns_cached(source, cache_path, currents, ['Lastname'])
+    assert len(hash_calls) == 3
+
+    df = pd.read_csv(source)
+    df.loc[0, 'Grade'] = 'A+'
+    df.to_csv(source, index=False)
+    res = hch.add_meta_columns_cached(source, cache_path, currents, KEY_COLUMNS)
+    assert len(hash_calls) == 4
+    pd.testing.assert_frame_equal(res, mch.add_meta_columns(df, currents, KEY_COLUMNS))
+
+
+def test_evict_hash_cache_keeps_recently_used(tmp_path):
+    hashes = mch.compute_hashes(pd.read_csv(SOURCE), {'KEY_HASH': KEY_COLUMNS, 'RECORD_HASH': ['Grade']},
+                                as_pairs=True)
+    for position, cache_key in enumerate(['a', 'b', 'c']):
+        hch.write_hash_cache(str(tmp_path), cache_key, hashes)
+        os.utime(tmp_path / (cache_key + '.parquet'), ns=(position, position))
+    entry_size = os.path.getsize(tmp_path / 'a.parquet')
+
+    assert hch.read_hash_cache(str(tmp_path), 'a', len(hashes['KEY_HASH'][0])) is not None
+    assert hch.evict_hash_cache(str(tmp_path), 2 * entry_size) == 1
+    assert sorted(os.listdir(tmp_path)) == ['a.parquet', 'c.parquet']
@@ -0,0 +1,125 @@
+import glob
+from hashlib import md5
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+
+
+# Implementierung von add_hash_column vor der Umstellung auf compute_hashes.
+# Dient als Referenz für die Kompatibilität bereits gespeicherter Hashes.
+def legacy_add_hash_column(df: pd.DataFrame, columns: list, hash_column_name: str) -> pd.DataFrame:
+    res = df.copy()
+    res[hash_column_name] = res[columns[0]].astype(str)
+    for column in columns[1:]:
+        res[hash_column_name] = res[hash_column_name] + "#?" + res[column].astype(str)
+    res.loc[:, hash_column_name] = res.loc[:, hash_column_name].apply(lambda x: md5(x.encode("utf8")).hexdigest())
+    return res
+
+
+def legacy_add_meta_columns(df: pd.DataFrame, currents: dict, key_columns: list) -> pd.DataFrame:
+    res = legacy_add_hash_column(df, key_columns, mch.META_COLUMNS[mch.COL_KEY_HASH])
+    record_columns = [c for c in res.columns if c not in mch.META_COLUMNS.values()]
+    res = legacy_add_hash_column(res, record_columns, mch.META_COLUMNS[mch.COL_RECORD_HASH])
+    res[mch.META_COLUMNS[mch.COL_INSERT_RUN_TS]] = pd.to_datetime(currents[mch.CURRENT_RUN_TS])
+    res[mch.META_COLUMNS[mch.COL_UPDATE_RUN_TS]] = pd.to_datetime(currents[mch.CURRENT_RUN_TS])
+    res[mch.META_COLUMNS[mch.COL_INSERT_RUN_ID]] = currents[mch.CURRENT_RUN_ID]
+    res[mch.META_COLUMNS[mch.COL_UPDATE_RUN_ID]] = currents[mch.CURRENT_RUN_ID]
+    res[mch.META_COLUMNS[mch.COL_DELETED]] = pd.to_datetime('')
+    return res
+
+
+def mixed_df(rows: int = 1000) -> pd.DataFrame:
+    rng = np.random.default_rng(7)
+    return pd.DataFrame({
+        'Lastname': rng.choice(['Müller', 'O\'Brien', 'Żółw', 'a#?b', ''], rows),
+        'Firstname': rng.choice(['Jim', 'Ima', 'Benny'], rows),
+        'Count': rng.integers(-5, 5, rows),
+        'Score': rng.random(rows) * 100,
+        'Passed': rng.random(rows) > 0.5,
+    })
+
+
+@pytest.mark.parametrize('csv_path', sorted(glob.glob('data/*.csv')))
+@pytest.mark.parametrize('chunk_size', [1, 4, mch.HASH_CHUNK_SIZE])
+def test_md5_matches_legacy_on_data_files(csv_path, chunk_size):
+    df = pd.read_csv(csv_path)
+    for columns in (['Lastname', 'Firstname'], list(df.columns)):
+        expected = legacy_add_hash_column(df, columns, 'HASH')
+        actual = mch.add_hash_column(df, columns, 'HASH', chunk_size=chunk_size)
+        assert actual['HASH'].tolist() == expected['HASH'].tolist()
+
+
+@pytest.mark.parametrize('chunk_size', [3, 256, mch.HASH_CHUNK_SIZE])
+def test_md5_matches_legacy_on_mixed_dtypes(chunk_size):
+    df = mixed_df()
+    for columns in (['Lastname'], ['Lastname', 'Firstname'], list(df.columns)):
+        expected = legacy_add_hash_column(df, columns, 'HASH')
+        actual = mch.add_hash_column(df, columns, 'HASH', chunk_size=chunk_size)
+        assert actual['HASH'].tolist() == expected['HASH'].tolist()
+
+
+@pytest.mark.parametrize('hash_mode', [mch.HASH_MODE_MD5, mch.HASH_MODE_FAST128])
+def test_hash_to_uint64_pair_chunks(monkeypatch, hash_mode):
+    hashes = mch.compute_hashes(mixed_df(), {'HASH': ['Lastname', 'Firstname', 'Score']}, hash_mode)['HASH']
+    expected = mch.hash_to_uint64_pair(hashes)
+    # Blockgrenzen mitten in den Werten und ein unvollständiger letzter Block
+    monkeypatch.setattr(mch, 'HASH_PAIR_CHUNK_SIZE', 7)
+    for a, b in zip(mch.hash_to_uint64_pair(hashes), expected):
+        assert a.dtype == np.uint64 and (a == b).all()
+    assert mch.uint64_pair_to_hash(*expected, hash_mode).tolist() == list(hashes)
+
+
+def test_add_meta_columns_matches_legacy():
+    df = pd.read_csv('data/grades_delta_old.csv')
+    currents = mch.create_currents('2021-01-01 10:00:00')
+    expected = legacy_add_meta_columns(df, currents, ['Lastname', 'Firstname'])
+    actual = mch.add_meta_columns(df, currents, ['Lastname', 'Firstname'])
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    assert mch.META_COLUMNS[mch.COL_KEY_HASH] not in df.columns
+
+
+@pytest.mark.parametrize('hash_mode', [mch.HASH_MODE_FAST64, mch.HASH_MODE_FAST128])
+def test_fast_modes_are_chunk_invariant(hash_mode):
+    df = mixed_df()
+    full = mch.compute_hashes(df, {'HASH': list(df.columns)}, hash_mode)['HASH']
+    chunked = mch.compute_hashes(df, {'HASH': list(df.columns)}, hash_mode, chunk_size=7)['HASH']
+    assert list(full) == list(chunked)
+    if hash_mode == mch.HASH_MODE_FAST64:
+        assert full.dtype == np.uint64
+    else:
+        assert all(isinstance(h, bytes) and len(h) == 16 for h in full)
+
+
+def test_md5_hashes_missing_values_like_legacy_strings():
+    df = pd.DataFrame({'Name': pd.Series(['a', None], dtype=object), 'Score': [np.nan, 1.5]})
+    res = mch.add_hash_column(df, ['Name', 'Score'], 'HASH')
+    assert res['HASH'].tolist() == [md5('a#?nan'.encode('utf8')).hexdigest(),
+                                    md5('None#?1.5'.encode('utf8')).hexdigest()]
+
+
+@pytest.mark.parametrize('hash_mode', [mch.HASH_MODE_MD5, mch.HASH_MODE_FAST64, mch.HASH_MODE_FAST128])
+def test_compact_meta_columns_round_trip(hash_mode):
+    df = mixed_df()
+    currents = mch.create_currents()
+    legacy = mch.add_meta_columns(df, currents, ['Lastname', 'Firstname'], hash_mode=hash_mode)
+    compact = mch.add_meta_columns(df, currents, ['Lastname', 'Firstname'], hash_mode=hash_mode, compact=True)
+    assert 'KEY_HASH' not in compact.columns and compact['KEY_HASH_HIGH'].dtype == np.uint64
+    assert compact['INSERT_RUN_ID'].dtype == np.int64
+    assert compact.memory_usage(deep=True).sum() < legacy.memory_usage(deep=True).sum()
+    pd.testing.assert_frame_equal(mch.to_compact_meta_columns(legacy), compact)
+    # das kompakte Schema behält von der Run-ID nur den Zeitteil
+    run_id = currents[mch.CURRENT_RUN_ID].split(mch.RUN_ID_SEPARATOR)[0]
+    expected = legacy.assign(INSERT_RUN_ID=run_id, UPDATE_RUN_ID=run_id)
+    pd.testing.assert_frame_equal(mch.to_legacy_meta_columns(compact, hash_mode), expected, check_dtype=False)
+    for column in (mch.COL_KEY_HASH, mch.COL_RECORD_HASH):
+        for a, b in zip(mch.get_hash_pair(compact, column), mch.get_hash_pair(legacy, column)):
+            assert (a == b).all()
+
+
+def test_run_id_int_conversion_accepts_second_resolution_ids():
+    assert mch.run_id_to_str(mch.run_id_to_int('20210101100000')) == '20210101100000000000'
+    ids = pd.Series(['20210101100000123456', '20210101100000'])
+    assert mch.run_id_to_str(mch.run_id_to_int(ids)).tolist() == ['20210101100000123456', '20210101100000000000']
@@ -0,0 +1,106 @@
+import os
+
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+
+
+def meta_df(csv_path: str) -> pd.DataFrame:
+    return mch.add_meta_columns(pd.read_csv(csv_path), mch.create_currents('2021-01-01 10:00:00'), KEY_COLUMNS)
+
+
+def test_index_delta_matches_full_delta(tmp_path):
+    path = str(tmp_path / 'current.parquet')
+    current = meta_df('data/grades_delta_old.csv')
+    new = meta_df('data/grades_delta_new.csv')
+    scd.write_parquet_df(current, path, KEY_COLUMNS)
+
+    assert len(scd.read_hash_index(path)) == len(current)
+    assert scd.get_delta_by_index(path, new).index.tolist() == mch.get_delta(current, new).index.tolist()
+    assert scd.get_delta_by_index(str(tmp_path / 'missing'), new).index.tolist() == new.index.tolist()
+
+
+def test_check_hash_index_detects_stale_index(tmp_path):
+    path = str(tmp_path / 'current.parquet')
+    scd.write_parquet_df(meta_df('data/grades_delta_old.csv'), path, KEY_COLUMNS)
+    assert scd.check_hash_index(path)['consistent']
+
+    index_df = scd.read_hash_index(path)
+    segment = scd.read_manifest(path)['index'][0]
+    scd.write_hash_index_segment(path, index_df.iloc[1:], os.path.basename(segment)[:-len('.parquet')])
+    res = scd.check_hash_index(path)
+    assert not res['consistent']
+    assert res['missing_in_index'] == 1 and res['files'] == [index_df[scd.INDEX_FILE].iloc[0]]
+
+    scd.rebuild_hash_index(path)
+    assert scd.check_hash_index(path)['consistent']
+
+
+def test_append_and_compaction_keep_snapshot(tmp_path):
+    path = str(tmp_path / 'current.parquet')
+    first = meta_df('data/grades_delta_old.csv')
+    second = meta_df('data/grades_delta_new.csv')
+    scd.append_parquet_df(first, path)
+    scd.append_parquet_df(scd.get_delta_by_index(path, second), path)
+    before = scd.read_parquet_df(path)
+    assert len(before) == len(first) + 3
+    assert len(scd.read_manifest(path)['files']) == 2
+
+    manifest = scd.start_compaction(path).result()
+    assert len(manifest['files']) == 1
+    pd.testing.assert_frame_equal(scd.read_parquet_df(path), before)
+    assert scd.check_hash_index(path)['consistent']
+    assert len(scd.vacuum_store(path)) == 4
+    pd.testing.assert_frame_equal(scd.read_parquet_df(path), before)
+
+
+def test_bucket_partitioning_limits_reads_to_touched_buckets(tmp_path):
+    path = str(tmp_path / 'current.parquet')
+    partitioning = scd.create_partitioning(bucket_count=8, bucket_mode=scd.BUCKET_MODE_PREFIX,
+                                           date_column=mch.META_COLUMNS[mch.COL_INSERT_RUN_TS])
+    current = meta_df('data/grades_delta_old.csv')
+    new = meta_df('data/grades_delta_new.csv')
+    scd.append_parquet_df(current, path, partitioning=partitioning)
+
+    buckets = scd.get_key_buckets(new['KEY_HASH'], partitioning)
+    files = scd.get_store_files(path, buckets)
+    assert 0 < len(files) < len(scd.get_store_files(path))
+    assert all(f.startswith('KEY_BUCKET=') and '/INSERT_DATE=2021-01-01/' in f for f in files)
+    assert set(scd.read_hash_index(path, buckets=buckets)[scd.INDEX_BUCKET]) <= set(buckets)
+    assert scd.get_delta_by_index(path, new).index.tolist() == mch.get_delta(current, new).index.tolist()
+    assert sorted(scd.read_parquet_df(path).columns) == sorted(current.columns)
+
+    with pytest.raises(ValueError):
+        scd.append_parquet_df(new, path, partitioning=scd.create_partitioning(bucket_count=4))
+
+
+def test_append_delta_chunks_matches_single_batch(tmp_path):
+    partitioning = scd.create_partitioning(bucket_count=4)
+    batch_path = str(tmp_path / 'batch')
+    chunked_path = str(tmp_path / 'chunked')
+    for run, csv_path in enumerate(['data/grades_delta_old.csv', 'data/grades_delta_new.csv']):
+        currents = mch.create_currents('2021-0' + str(run + 1) + '-01 10:00:00')
+        new = mch.add_meta_columns(pd.read_csv(csv_path), currents, KEY_COLUMNS)
+        scd.append_parquet_df(scd.get_delta_by_index(batch_path, new), batch_path, partitioning=partitioning)
+        res = scd.append_delta_chunks(pd.read_csv(csv_path, chunksize=3), chunked_path, currents, KEY_COLUMNS,
+                                      partitioning=partitioning)
+        assert res['rows'] == len(new)
+
+    expected = scd.read_parquet_df(batch_path).sort_values(['RECORD_HASH', 'INSERT_TS'], ignore_index=True)
+    actual = scd.read_parquet_df(chunked_path).sort_values(['RECORD_HASH', 'INSERT_TS'], ignore_index=True)
+    pd.testing.assert_frame_equal(actual, expected)
+    assert scd.check_hash_index(chunked_path)['consistent']
+
+
+def test_append_delta_chunks_rejects_dtype_drift(tmp_path):
+    path = str(tmp_path / 'current.parquet')
+    chunks = [pd.DataFrame({'Lastname': ['A'], 'Firstname': ['B'], 'Test1': [1]}),
+              pd.DataFrame({'Lastname': ['C'], 'Firstname': ['D'], 'Test1': [None]})]
+    with pytest.raises(ValueError):
+        scd.append_delta_chunks(iter(chunks), path, mch.create_currents(), KEY_COLUMNS)
+    assert scd.read_parquet_df(path) is None or len(scd.read_parquet_df(path)) == 0
+    assert not any(name.endswith('.parquet') for _, _, names in os.walk(path) for name in names)
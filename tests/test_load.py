@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from itertools import count
+
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.LoadHelpers as lh
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+SOURCES = ['data/grades_delta_old.csv', 'data/grades_delta_new.csv', 'data/grades_full_old.csv']
+
+
+def test_create_currents_run_ids_are_unique():
+    run_ids = [mch.create_currents()[mch.CURRENT_RUN_ID] for _ in range(1000)]
+    assert len(set(run_ids)) == len(run_ids) and run_ids == sorted(run_ids)
+
+
+def test_create_currents_run_ids_are_unique_across_processes(monkeypatch):
+    # zwei Prozesse, die im selben Mikrosekundenschritt starten, bekommen verschiedene Run-IDs
+    now = mch._next_run_ts()
+    monkeypatch.setattr(mch, '_next_run_ts', lambda: now)
+    run_ids = [mch.create_currents()[mch.CURRENT_RUN_ID] for _ in range(2)]
+    assert run_ids[0] != run_ids[1]
+    assert mch.run_id_to_int(run_ids[0]) == mch.run_id_to_int(run_ids[1]) == mch.run_id_to_int(now.strftime(mch.RUN_ID_FORMAT))
+
+
+def sequential_result(path: str) -> pd.DataFrame:
+    for source in SOURCES:
+        new = mch.add_meta_columns(pd.read_csv(source), mch.create_currents(), KEY_COLUMNS)
+        scd.append_parquet_df(scd.get_delta_by_index(path, new), path)
+    return scd.read_parquet_df(path)
+
+
+def comparable(df: pd.DataFrame) -> pd.DataFrame:
+    meta = [mch.META_COLUMNS[column] for column in [mch.COL_INSERT_RUN_TS, mch.COL_UPDATE_RUN_TS,
+                                                    mch.COL_INSERT_RUN_ID, mch.COL_UPDATE_RUN_ID]]
+    return df.drop(columns=meta).sort_values(['RECORD_HASH'], ignore_index=True)
+
+
+def test_run_loads_matches_sequential_runs(tmp_path):
+    expected = comparable(sequential_result(str(tmp_path / 'sequential')))
+    loads = [lh.create_load(source, str(tmp_path / 'parallel')) for source in SOURCES]
+    res = lh.run_loads(loads, KEY_COLUMNS, max_workers=2)
+    pd.testing.assert_frame_equal(comparable(scd.read_parquet_df(str(tmp_path / 'parallel'))), expected)
+    assert [stats['source'] for stats in res] == SOURCES
+    assert len(set(stats['run_id'] for stats in res)) == len(SOURCES)
+
+    loads = [lh.create_load(source, str(tmp_path / 'chunked')) for source in SOURCES]
+    with ThreadPoolExecutor(2) as executor:
+        lh.run_loads(loads, KEY_COLUMNS, chunk_size=4, executor=executor)
+    pd.testing.assert_frame_equal(comparable(scd.read_parquet_df(str(tmp_path / 'chunked'))), expected)
+
+
+def test_run_loads_commits_targets_in_parallel(tmp_path, monkeypatch):
+    expected = comparable(sequential_result(str(tmp_path / 'sequential')))
+    barrier = threading.Barrier(2, timeout=5)
+    append_meta_chunks = lh.append_meta_chunks
+
+    def first_runs_together(meta_chunks, path, *args, **kwargs):
+        # die ersten Läufe beider Ziele müssen gleichzeitig laufen, sonst läuft die Barriere in einen Timeout
+        if scd.read_manifest(path) is None:
+            barrier.wait()
+        return append_meta_chunks(meta_chunks, path, *args, **kwargs)
+
+    monkeypatch.setattr(lh, 'append_meta_chunks', first_runs_together)
+    paths = [str(tmp_path / name) for name in ['first', 'second']]
+    loads = [lh.create_load(source, path) for source in SOURCES for path in paths]
+    with ThreadPoolExecutor(2) as executor:
+        res = lh.run_loads(loads, KEY_COLUMNS, chunk_size=4, executor=executor,
+                           partitioning=scd.create_partitioning(bucket_count=4))
+    assert [(stats['source'], stats['target']) for stats in res] == \
+           [(load[lh.LOAD_SOURCE], load[lh.LOAD_TARGET]) for load in loads]
+    for path in paths:
+        pd.testing.assert_frame_equal(comparable(scd.read_parquet_df(path)), expected)
+        scd.check_hash_index(path)
+
+
+def data_files(path: str) -> list:
+    return [name for _, _, names in os.walk(path) for name in names if name != scd.MANIFEST_FILE]
+
+
+def test_run_load_pipelined_matches_sequential_runs(tmp_path):
+    expected = comparable(sequential_result(str(tmp_path / 'sequential')))
+    path = str(tmp_path / 'pipelined')
+    with ThreadPoolExecutor(2) as executor:
+        res = [lh.run_load_pipelined(lh.create_load(source, path), KEY_COLUMNS, chunk_size=3, executor=executor,
+                                     partitioning=scd.create_partitioning(bucket_count=4)) for source in SOURCES]
+    pd.testing.assert_frame_equal(comparable(scd.read_parquet_df(path)), expected)
+    assert [stats['rows'] for stats in res] == [len(pd.read_csv(source)) for source in SOURCES]
+    assert sum(stats['delta_rows'] for stats in res) == len(expected)
+    scd.check_hash_index(path)
+
+
+@pytest.mark.parametrize('cancel', [False, True])
+def test_run_load_pipelined_stops_on_error(tmp_path, cancel):
+    # ein Fehler oder Abbruch mitten im Lesen: nichts wird committet, geschriebene Dateien werden entfernt
+    path = str(tmp_path)
+    cancel_event = threading.Event()
+
+    def grade(value: str) -> str:
+        if value == 'C+':
+            if not cancel:
+                raise ValueError('bad grade')
+            cancel_event.set()
+        return value
+
+    load = lh.create_load('data/grades_full_old.csv', path, {'converters': {'Grade': grade}})
+    with ThreadPoolExecutor(2) as executor, pytest.raises(CancelledError if cancel else ValueError):
+        lh.run_load_pipelined(load, KEY_COLUMNS, chunk_size=2, executor=executor, cancel_event=cancel_event)
+    assert len(scd.read_parquet_df(path)) == 0
+    assert data_files(path) == []
+    assert not any(thread.name == 'prefetch' for thread in threading.enumerate())
+
+
+def test_prefetch_backpressure():
+    produced = []
+
+    def items():
+        for i in count():
+            produced.append(i)
+            yield i
+
+    chunks = lh.prefetch(items(), max_pending=2)
+    assert next(chunks) == 0
+    time.sleep(0.3)
+    # ein Element beim Verbraucher, zwei in der Queue, eins wartet auf einen Platz
+    assert len(produced) <= 4
+    chunks.close()
+    assert not any(thread.name == 'prefetch' for thread in threading.enumerate())
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.PipelineHelpers as ph
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+SOURCES = ['data/grades_delta_old.csv', 'data/grades_delta_new.csv']
+
+
+def comparable(df: pd.DataFrame) -> pd.DataFrame:
+    meta = [mch.META_COLUMNS[column] for column in [mch.COL_INSERT_RUN_TS, mch.COL_UPDATE_RUN_TS,
+                                                    mch.COL_INSERT_RUN_ID, mch.COL_UPDATE_RUN_ID]]
+    return df.drop(columns=meta).sort_values(['RECORD_HASH'], ignore_index=True)
+
+
+def delta_plan(source: str, path: str, chunk_size: int = None) -> dict:
+    plan = ph.plan_csv_source(ph.create_plan(), source, chunk_size=chunk_size)
+    plan = ph.plan_select(plan, ['Lastname', 'Firstname', 'Final', 'Grade'])
+    plan = ph.plan_meta_columns(plan, KEY_COLUMNS, ['SSN'])
+    return ph.plan_store_sink(ph.plan_delta(plan), path)
+
+
+def test_fused_delta_plan_matches_eager_run(tmp_path):
+    for source in SOURCES:
+        new = mch.add_meta_columns(pd.read_csv(source, usecols=['Lastname', 'Firstname', 'Final', 'Grade']),
+                                   mch.create_currents(), KEY_COLUMNS)
+        scd.append_parquet_df(scd.get_delta_by_index(str(tmp_path / 'eager'), new), str(tmp_path / 'eager'))
+        res = ph.run_plan(delta_plan(source, str(tmp_path / 'lazy'), chunk_size=4))
+        assert res['rows'] == len(new)
+    pd.testing.assert_frame_equal(comparable(scd.read_parquet_df(str(tmp_path / 'lazy'))),
+                                  comparable(scd.read_parquet_df(str(tmp_path / 'eager'))))
+
+    plan = delta_plan(SOURCES[0], str(tmp_path / 'lazy'), chunk_size=4)
+    assert [operator['operator'] for operator in ph.optimize_plan(plan)] == [ph.OP_READ_CSV, ph.OP_APPEND_DELTA_CHUNKS]
+    assert 'usecols' in ph.explain_plan(plan).split('== Optimized plan ==')[1]
+
+
+def test_scd2_plan_matches_historize_to_store(tmp_path):
+    for source in ['data/grades_full_old.csv', 'data/grades_full_new.csv']:
+        currents = mch.create_currents()
+        new = mch.add_meta_columns(pd.read_csv(source), currents, KEY_COLUMNS)
+        expected = scd.historize_to_store(new, str(tmp_path / 'eager'), currents, mch.VALID_FROM_MODE_LOAD_DATE,
+                                          full_load=True)
+        plan = ph.plan_meta_columns(ph.plan_csv_source(ph.create_plan(), source), KEY_COLUMNS)
+        plan = ph.plan_store_sink(ph.plan_scd2(plan, mch.VALID_FROM_MODE_LOAD_DATE, full_load=True),
+                                  str(tmp_path / 'lazy'))
+        res = ph.run_plan(plan, currents)
+        assert res == dict(expected, run_id=currents[mch.CURRENT_RUN_ID])
+    pd.testing.assert_frame_equal(scd.read_scd2_dataset(str(tmp_path / 'lazy')).sort_values(['RECORD_HASH', 'VALID_FROM'], ignore_index=True),
+                                  scd.read_scd2_dataset(str(tmp_path / 'eager')).sort_values(['RECORD_HASH', 'VALID_FROM'], ignore_index=True))
+
+
+def test_invalid_plans():
+    source = ph.plan_df_source(ph.create_plan(), pd.read_csv(SOURCES[0]))
+    with pytest.raises(ValueError):
+        ph.plan_meta_columns(ph.plan_delta(ph.plan_meta_columns(source, KEY_COLUMNS)), KEY_COLUMNS)
+    with pytest.raises(ValueError):
+        ph.run_plan(ph.plan_scd2(ph.plan_meta_columns(source, KEY_COLUMNS), mch.VALID_FROM_MODE_LOAD_DATE))
+    with pytest.raises(ValueError):
+        ph.run_plan(ph.plan_meta_columns(ph.plan_select(source, ['Lastname', 'Grade']), KEY_COLUMNS))
+    res = ph.run_plan(ph.plan_meta_columns(ph.plan_select(source, ['Grade', 'Lastname', 'Firstname']), KEY_COLUMNS))
+    assert list(res.columns[:3]) == ['Lastname', 'Firstname', 'Grade']
@@ -0,0 +1,84 @@
+import os
+
+import fastparquet
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+FIRST_RUN = mch.create_currents('2021-01-01 10:00:00')
+SECOND_RUN = mch.create_currents('2021-02-01 10:00:00')
+
+
+def scd2_store(base_path: str):
+    partitioning = scd.create_partitioning(bucket_count=8)
+    for csv_path, currents in [('data/grades_delta_old.csv', FIRST_RUN), ('data/grades_delta_new.csv', SECOND_RUN)]:
+        new = mch.add_meta_columns(pd.read_csv(csv_path), currents, KEY_COLUMNS)
+        scd.historize_to_store(new, base_path, currents, mch.VALID_FROM_MODE_LOAD_DATE, partitioning=partitioning)
+    return scd.read_scd2_dataset(base_path)
+
+
+@pytest.fixture
+def opened_files(monkeypatch):
+    res = []
+    parquet_file = fastparquet.ParquetFile
+
+    def spy(path, *args, **kwargs):
+        name = getattr(path, 'name', path)
+        if scd.HASH_INDEX_DIR not in str(name):
+            res.append(name)
+        return parquet_file(path, *args, **kwargs)
+
+    monkeypatch.setattr(fastparquet, 'ParquetFile', spy)
+    return res
+
+
+def test_filters_and_columns_match_pandas(tmp_path):
+    everything = scd2_store(str(tmp_path))
+    history_path = scd.get_history_path(str(tmp_path))
+    scd.append_parquet_df(everything, str(tmp_path / 'all'), partitioning=scd.create_partitioning(bucket_count=8))
+    path = str(tmp_path / 'all')
+
+    active = scd.read_parquet_df(path, columns=['Lastname', 'VALID_TO'], filters=scd.filter_active())
+    assert list(active.columns) == ['Lastname', 'VALID_TO']
+    assert sorted(active['Lastname']) == sorted(everything.loc[everything['VALID_TO'] == pd.Timestamp('9999-12-31'), 'Lastname'])
+
+    runs = scd.read_parquet_df(path, filters=scd.filter_run_id_range(start=SECOND_RUN[mch.CURRENT_RUN_ID],
+                                                                      column=mch.COL_UPDATE_RUN_ID))
+    assert sorted(runs['Lastname']) == sorted(everything.loc[everything['UPDATE_RUN_ID'] == SECOND_RUN[mch.CURRENT_RUN_ID], 'Lastname'])
+
+    either = scd.read_parquet_df(path, filters=[[('Lastname', '==', 'Franklin')], [('Grade', 'in', ['A', 'A+'])]])
+    expected = everything[(everything['Lastname'] == 'Franklin') | everything['Grade'].isin(['A', 'A+'])]
+    assert sorted(either['RECORD_HASH']) == sorted(expected['RECORD_HASH'])
+    assert len(scd.read_parquet_df(history_path)) == 1
+
+
+def test_key_hashes_read_only_files_holding_the_keys(tmp_path, opened_files):
+    everything = scd2_store(str(tmp_path))
+    active_path = scd.get_active_path(str(tmp_path))
+    keys = everything.loc[everything['Lastname'].isin(['Franklin', 'Backus']), ['KEY_HASH']]
+
+    opened_files.clear()
+    res = scd.read_parquet_df(active_path, key_hashes=keys)
+    assert sorted(res['Lastname']) == ['Backus', 'Franklin']
+    assert len(opened_files) <= 2 < len(scd.get_store_files(active_path))
+
+    opened_files.clear()
+    bucket = int(scd.read_manifest(active_path)['files'][0]['partition']['KEY_BUCKET'])
+    res = scd.read_parquet_df(active_path, filters=[('KEY_BUCKET', '==', bucket)])
+    assert len(opened_files) == len(scd.get_store_files(active_path, [bucket]))
+    assert set(scd.get_key_buckets(res['KEY_HASH'], scd.read_manifest(active_path)['partitioning'])) == {bucket}
+
+
+def test_missing_dataset_is_none_but_corrupt_file_raises(tmp_path):
+    assert scd.read_parquet_df(str(tmp_path / 'missing')) is None
+    assert scd.read_parquet_df(str(tmp_path)) is None
+
+    scd2_store(str(tmp_path))
+    active_path = scd.get_active_path(str(tmp_path))
+    with open(os.path.join(active_path, scd.get_store_files(active_path)[0]), 'wb') as f:
+        f.write(b'not parquet')
+    with pytest.raises(Exception):
+        scd.read_parquet_df(active_path)
@@ -0,0 +1,72 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.LoadHelpers as lh
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+
+
+@pytest.fixture
+def metrics():
+    res = []
+    previous = mch.set_metrics_sink(res.append)
+    yield res
+    mch.set_metrics_sink(previous)
+
+
+def test_no_output_without_sink(tmp_path, capsys):
+    currents = mch.create_currents()
+    new = mch.add_meta_columns(pd.read_csv('data/grades_delta_old.csv'), currents, KEY_COLUMNS)
+    scd.historize_to_store(new, str(tmp_path), currents, mch.VALID_FROM_MODE_LOAD_DATE)
+    assert capsys.readouterr().out == ''
+
+
+def test_stages_are_attached_to_run_id(tmp_path, metrics):
+    loads = [lh.create_load(source, str(tmp_path / 'current'))
+             for source in ['data/grades_delta_old.csv', 'data/grades_delta_new.csv']]
+    res = lh.run_loads(loads, KEY_COLUMNS, max_workers=1)
+    currents = mch.create_currents()
+    new = mch.add_meta_columns(pd.read_csv('data/grades_full_new.csv'), currents, KEY_COLUMNS)
+    scd.historize_to_store(new, str(tmp_path / 'scd2'), currents, mch.VALID_FROM_MODE_LOAD_DATE)
+
+    # die Stufen aus den Prozessen von run_loads kommen nur bei fork an, die des aufrufenden Prozesses immer
+    stages = {(stats['run_id'], stats['stage']) for stats in metrics}
+    for stats in res:
+        assert {(stats['run_id'], mch.STAGE_DELTA), (stats['run_id'], mch.STAGE_WRITE)} <= stages
+    run_id = currents[mch.CURRENT_RUN_ID]
+    assert {(run_id, stage) for stage in [mch.STAGE_HASH, mch.STAGE_MERGE, mch.STAGE_WRITE]} <= stages
+
+    hash_stats = [stats for stats in metrics if stats['run_id'] == run_id and stats['stage'] == mch.STAGE_HASH][0]
+    assert hash_stats['rows_in'] == hash_stats['rows_out'] == len(new)
+    assert hash_stats['key_columns'] == KEY_COLUMNS
+    write_stats = [stats for stats in metrics if stats['stage'] == mch.STAGE_WRITE]
+    assert all(stats['bytes_written'] > 0 and stats['wall_seconds'] >= 0 and stats['cpu_seconds'] >= 0
+               and stats['rss_end_bytes'] > 0
+               and stats['rss_delta_bytes'] == stats['rss_end_bytes'] - stats['rss_start_bytes']
+               for stats in write_stats)
+
+
+def test_json_lines_sink():
+    stream = io.StringIO()
+    previous = mch.set_metrics_sink(mch.create_json_lines_sink(stream))
+    try:
+        with pytest.raises(ValueError):
+            with mch.metrics_run('1'), mch.measure_stage(mch.STAGE_READ, 'test', rows_in=3) as stats:
+                stats[mch.METRIC_ROWS_OUT] = 2
+                raise ValueError()
+    finally:
+        mch.set_metrics_sink(previous)
+    line = json.loads(stream.getvalue())
+    assert (line['run_id'], line['stage'], line['rows_in'], line['rows_out'], line['error']) == \
+        ('1', 'read', 3, 2, 'ValueError')
+
+
+def test_json_lines_sink_defaults_to_stderr(capsys):
+    mch.create_json_lines_sink()({'run_id': '1', 'stage': mch.STAGE_READ})
+    captured = capsys.readouterr()
+    assert captured.out == '' and json.loads(captured.err) == {'run_id': '1', 'stage': 'read'}
@@ -0,0 +1,224 @@
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.AsOfHelpers as aoh
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+FIRST_RUN = mch.create_currents('2021-01-01 10:00:00')
+SECOND_RUN = mch.create_currents('2021-02-01 10:00:00')
+
+
+def meta_df(csv_path: str, currents: dict) -> pd.DataFrame:
+    return mch.add_meta_columns(pd.read_csv(csv_path), currents, KEY_COLUMNS)
+
+
+def first_load() -> pd.DataFrame:
+    return scd.historize_dataset(meta_df('data/grades_delta_old.csv', FIRST_RUN), None, FIRST_RUN,
+                                 mch.VALID_FROM_MODE_LOWER_BOUND)
+
+
+def test_merge_scd2_classes():
+    current = first_load()
+    new = meta_df('data/grades_delta_new.csv', SECOND_RUN)
+    current_only, new_only, unchanged, changed_current, changed_new = scd.merge_scd2_classes(
+        current, new, SECOND_RUN, mch.VALID_FROM_MODE_LOAD_DATE)
+
+    assert len(current_only) == len(current) - 1 and len(unchanged) == 0
+    assert sorted(new_only['Lastname']) == ['George', 'Heffalump']
+    assert (new_only['VALID_FROM'] == pd.Timestamp('2021-02-01')).all()
+    assert changed_current['Lastname'].tolist() == ['Franklin']
+    assert changed_current['VALID_TO'].iloc[0] == pd.Timestamp('2021-01-31')
+    assert changed_current['UPDATE_RUN_ID'].iloc[0] == SECOND_RUN[mch.CURRENT_RUN_ID]
+    assert changed_new['Test1'].tolist() == [60.0]
+    assert changed_new['VALID_TO'].iloc[0] == pd.Timestamp(mch.SCD2_UPPER_BOUND)
+
+
+def test_merge_scd2_only_matches_active_versions():
+    merged = scd.merge_scd2(first_load(), meta_df('data/grades_delta_new.csv', SECOND_RUN), SECOND_RUN,
+                            mch.VALID_FROM_MODE_LOAD_DATE)
+    hist, active = scd.split_merged_dataset(merged)
+    assert hist['Lastname'].tolist() == ['Franklin']
+    assert active['KEY_HASH'].is_unique
+
+    third_run = mch.create_currents('2021-03-01 10:00:00')
+    rerun = meta_df('data/grades_delta_new.csv', third_run)
+    res = scd.merge_scd2(merged, rerun, third_run, mch.VALID_FROM_MODE_LOAD_DATE)
+    pd.testing.assert_frame_equal(res.sort_values('RECORD_HASH', ignore_index=True),
+                                  merged.sort_values('RECORD_HASH', ignore_index=True))
+
+
+def test_merge_scd2_reactivates_closed_keys():
+    current = first_load()
+    franklin = current['Lastname'] == 'Franklin'
+    current.loc[franklin, 'VALID_TO'] = pd.Timestamp('2021-01-15')
+    new = meta_df('data/grades_delta_old.csv', SECOND_RUN)
+    current_only, new_only, unchanged, changed_current, changed_new = scd.merge_scd2_classes(
+        current, new[new['Lastname'] == 'Franklin'], SECOND_RUN, mch.VALID_FROM_MODE_LOWER_BOUND)
+    assert len(new_only) == 0 and len(changed_current) == 0
+    assert changed_new['VALID_FROM'].tolist() == [pd.Timestamp('2021-02-01')]
+
+
+def test_merge_scd2_same_day_changes_leave_empty_intervals():
+    merged = scd.merge_scd2(first_load(), meta_df('data/grades_delta_new.csv', SECOND_RUN), SECOND_RUN,
+                            mch.VALID_FROM_MODE_LOAD_DATE)
+    # zweite Änderung von Franklin am selben Tag
+    same_day = mch.create_currents('2021-02-01 12:00:00')
+    new = pd.read_csv('data/grades_delta_new.csv')
+    new.loc[new['Lastname'] == 'Franklin', 'Test1'] = 70.0
+    merged = scd.merge_scd2(merged, mch.add_meta_columns(new, same_day, KEY_COLUMNS), same_day,
+                            mch.VALID_FROM_MODE_LOAD_DATE)
+    franklin = merged[merged['Lastname'] == 'Franklin'].sort_values(['VALID_FROM', 'VALID_TO'], ignore_index=True)
+    assert franklin['VALID_FROM'].tolist() == [pd.Timestamp(mch.SCD2_LOWER_BOUND), pd.Timestamp('2021-02-01'),
+                                               pd.Timestamp('2021-02-01')]
+    assert franklin['VALID_TO'].tolist() == [pd.Timestamp('2021-01-31'), pd.Timestamp('2021-01-31'),
+                                             pd.Timestamp(mch.SCD2_UPPER_BOUND)]
+
+    # die Version mit leerem Intervall gilt an keinem Tag, pro Tag gilt genau eine Version
+    for day, test1 in [('2021-01-31', franklin['Test1'].iloc[0]), ('2021-02-01', 70.0), ('2021-03-01', 70.0)]:
+        valid = franklin[scd._get_filter_mask(franklin, [scd.filter_as_of(day)])]
+        assert valid['Test1'].tolist() == [test1]
+    dates = pd.Series(pd.to_datetime(['2021-01-31', '2021-02-01']))
+    key = mch.get_hash_pair(franklin.iloc[[0, 0]], mch.COL_KEY_HASH)
+    positions = aoh.match_as_of(key, dates, mch.get_hash_pair(franklin, mch.COL_KEY_HASH), franklin['VALID_FROM'],
+                                franklin['VALID_TO'])
+    assert positions.tolist() == [0, 2]
+
+
+def test_merge_scd2_rejects_duplicate_keys():
+    new = meta_df('data/grades_delta_new.csv', SECOND_RUN)
+    with pytest.raises(ValueError):
+        scd.merge_scd2(first_load(), pd.concat([new, new]), SECOND_RUN, mch.VALID_FROM_MODE_LOAD_DATE)
+
+
+def test_historize_to_store_matches_merge_scd2(tmp_path):
+    partitioning = scd.create_partitioning(bucket_count=4)
+    third_run = mch.create_currents('2021-03-01 10:00:00')
+    runs = [('data/grades_delta_old.csv', FIRST_RUN), ('data/grades_delta_new.csv', SECOND_RUN),
+            ('data/grades_delta_new.csv', third_run)]
+    expected = None
+    for csv_path, currents in runs:
+        new = meta_df(csv_path, currents)
+        expected = scd.historize_dataset(new, expected, currents, mch.VALID_FROM_MODE_LOAD_DATE)
+        scd.historize_to_store(new, str(tmp_path), currents, mch.VALID_FROM_MODE_LOAD_DATE, partitioning=partitioning)
+
+    res = scd.read_scd2_dataset(str(tmp_path))
+    columns = list(expected.columns)
+    pd.testing.assert_frame_equal(res[columns].sort_values(['RECORD_HASH', 'VALID_FROM'], ignore_index=True),
+                                  expected.sort_values(['RECORD_HASH', 'VALID_FROM'], ignore_index=True),
+                                  check_dtype=False)
+    history = scd.read_parquet_df(scd.get_history_path(str(tmp_path)))
+    assert history['Lastname'].tolist() == ['Franklin']
+    assert scd.check_hash_index(scd.get_active_path(str(tmp_path)))['consistent']
+
+
+def test_full_load_deletes_are_tombstones(tmp_path):
+    old = meta_df('data/grades_delta_old.csv', FIRST_RUN)
+    new = meta_df('data/grades_delta_old.csv', SECOND_RUN)
+    new = new[new['Lastname'] != 'Alfalfa']
+    third_run = mch.create_currents('2021-03-01 10:00:00')
+    back = meta_df('data/grades_delta_old.csv', third_run)
+
+    merged = scd.historize_dataset(new, first_load(), SECOND_RUN, mch.VALID_FROM_MODE_LOAD_DATE, full_load=True)
+    hist, active = scd.split_merged_dataset(merged)
+    assert hist['Lastname'].tolist() == ['Alfalfa']
+    assert hist['DELETED'].iloc[0] == pd.Timestamp(SECOND_RUN[mch.CURRENT_RUN_TS])
+    assert hist['VALID_TO'].iloc[0] == pd.Timestamp('2021-01-31')
+    assert len(active) == len(old) - 1 and active['DELETED'].isna().all()
+
+    path = str(tmp_path)
+    partitioning = scd.create_partitioning(bucket_count=4)
+    scd.historize_to_store(old, path, FIRST_RUN, mch.VALID_FROM_MODE_LOWER_BOUND, partitioning=partitioning)
+    active_files = set(scd.get_store_files(scd.get_active_path(path)))
+    res = scd.historize_to_store(new, path, SECOND_RUN, mch.VALID_FROM_MODE_LOAD_DATE, full_load=True)
+    assert res['deleted'] == 1 and res['unchanged'] == len(new)
+    assert len(active_files - set(scd.get_store_files(scd.get_active_path(path)))) == 1
+    stored = scd.read_scd2_dataset(path)
+    pd.testing.assert_frame_equal(stored[merged.columns].sort_values('KEY_HASH', ignore_index=True),
+                                  merged.sort_values('KEY_HASH', ignore_index=True), check_dtype=False)
+
+    res = scd.historize_to_store(back, path, third_run, mch.VALID_FROM_MODE_LOAD_DATE, full_load=True)
+    assert res['updated'] == 1 and res['deleted'] == 0
+    active = scd.read_scd2_dataset(path, active_only=True)
+    assert active.loc[active['Lastname'] == 'Alfalfa', 'VALID_FROM'].tolist() == [pd.Timestamp('2021-03-01')]
+
+
+def test_full_load_deletes_last_key_of_file(tmp_path):
+    # A und B liegen in eigenen aktiven Dateien, der Full Load enthält nur B unverändert
+    path = str(tmp_path)
+    old = meta_df('data/grades_delta_old.csv', FIRST_RUN)
+    for row in [0, 1]:
+        scd.historize_to_store(old.iloc[[row]], path, FIRST_RUN, mch.VALID_FROM_MODE_LOWER_BOUND)
+    assert len(scd.get_store_files(scd.get_active_path(path))) == 2
+    new = meta_df('data/grades_delta_old.csv', SECOND_RUN).iloc[[1]]
+    res = scd.historize_to_store(new, path, SECOND_RUN, mch.VALID_FROM_MODE_LOAD_DATE, full_load=True)
+    assert res['deleted'] == 1 and res['unchanged'] == 1
+    active = scd.read_scd2_dataset(path, active_only=True)
+    assert active['Lastname'].tolist() == [old['Lastname'].iloc[1]]
+    assert len(scd.get_store_files(scd.get_active_path(path))) == 1
+    history = scd.read_parquet_df(scd.get_history_path(path))
+    assert history['Lastname'].tolist() == [old['Lastname'].iloc[0]] and history['DELETED'].notna().all()
+
+
+def test_historize_to_store_recovers_pending_history(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    scd.historize_to_store(meta_df('data/grades_delta_old.csv', FIRST_RUN), path, FIRST_RUN,
+                           mch.VALID_FROM_MODE_LOWER_BOUND)
+    new = meta_df('data/grades_delta_new.csv', SECOND_RUN)
+    # Abbruch nach dem aktiven Commit: die Historie ist nur im aktiven Manifest vermerkt
+    with monkeypatch.context() as patch:
+        patch.setattr(scd, 'commit_pending_history', lambda base_path: 0)
+        scd.historize_to_store(new, path, SECOND_RUN, mch.VALID_FROM_MODE_LOAD_DATE)
+    assert scd.read_manifest(scd.get_active_path(path))[scd.PENDING_HISTORY]
+    assert len(scd.get_store_files(scd.get_history_path(path))) == 0
+
+    # die Wiederholung holt den Commit der Historie nach und schreibt sie nicht doppelt
+    res = scd.historize_to_store(new, path, SECOND_RUN, mch.VALID_FROM_MODE_LOAD_DATE)
+    assert res['updated'] == 0 and res['unchanged'] == len(new)
+    assert scd.read_parquet_df(scd.get_history_path(path))['Lastname'].tolist() == ['Franklin']
+    assert scd.PENDING_HISTORY not in scd.read_manifest(scd.get_active_path(path))
+    assert scd.commit_pending_history(path) == 0
+
+
+def test_historize_to_store_with_compact_schema(tmp_path):
+    expected = None
+    for csv_path, currents in [('data/grades_delta_old.csv', FIRST_RUN), ('data/grades_delta_new.csv', SECOND_RUN)]:
+        new = mch.add_meta_columns(pd.read_csv(csv_path), currents, KEY_COLUMNS, compact=True)
+        expected = scd.historize_dataset(meta_df(csv_path, currents), expected, currents, mch.VALID_FROM_MODE_LOAD_DATE)
+        scd.historize_to_store(new, str(tmp_path), currents, mch.VALID_FROM_MODE_LOAD_DATE)
+
+    compact = scd.read_scd2_dataset(str(tmp_path))
+    assert compact['UPDATE_RUN_ID'].dtype == 'int64' and 'RECORD_HASH_LOW' in compact.columns
+    res = scd.read_scd2_dataset(str(tmp_path), legacy=True)
+    pd.testing.assert_frame_equal(res[expected.columns].sort_values(['RECORD_HASH', 'VALID_FROM'], ignore_index=True),
+                                  expected.sort_values(['RECORD_HASH', 'VALID_FROM'], ignore_index=True),
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_merge_cdc_to_store_rewrites_only_affected_files(tmp_path, compact):
+    path = str(tmp_path)
+    current = mch.add_meta_columns(pd.read_csv('data/grades_full_old.csv'), FIRST_RUN, KEY_COLUMNS, compact=compact)
+    scd.merge_cdc_to_store(current, path, FIRST_RUN, partitioning=scd.create_partitioning(bucket_count=4))
+    files = set(scd.get_store_files(path))
+
+    # CDC-Batch: Inserts, ein Update, ein Delete und derselbe Key zweimal (der letzte Datensatz gilt)
+    changes = pd.read_csv('data/grades_full_new.csv')
+    changes = pd.concat([changes.iloc[[2]].assign(Grade='X'), changes], ignore_index=True)
+    new = mch.add_meta_columns(changes, SECOND_RUN, KEY_COLUMNS, compact=compact)
+    deleted = new.iloc[[1]]
+    res = scd.merge_cdc_to_store(new.drop(index=1), path, SECOND_RUN, deleted)
+    assert res == {'inserted': 2, 'updated': 1, 'unchanged': 12, 'deleted': 1}
+
+    expected = pd.concat([pd.read_csv('data/grades_full_old.csv'), changes.drop(index=[0, 1])])
+    expected = expected.drop_duplicates(KEY_COLUMNS, keep='last')
+    expected = expected[~expected['SSN'].eq(changes.loc[1, 'SSN'])]
+    stored = scd.read_parquet_df(path)
+    columns = list(expected.columns)
+    pd.testing.assert_frame_equal(stored[columns].astype(str).sort_values(KEY_COLUMNS, ignore_index=True),
+                                  expected.astype(str).sort_values(KEY_COLUMNS, ignore_index=True))
+    updated = stored[stored[mch.META_COLUMNS[mch.COL_UPDATE_RUN_TS]] == pd.Timestamp(SECOND_RUN[mch.CURRENT_RUN_TS])]
+    assert (updated[mch.META_COLUMNS[mch.COL_INSERT_RUN_TS]] == pd.Timestamp(FIRST_RUN[mch.CURRENT_RUN_TS])).sum() == 1
+    assert 0 < len(files & set(scd.get_store_files(path))) < len(files)
+    assert scd.check_hash_index(path)['consistent']
@@ -0,0 +1,128 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.HashCacheHelpers as hch
+import src.PandasETLHelpers.LoadHelpers as lh
+import src.PandasETLHelpers.PipelineHelpers as ph
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+
+
+def source(csv_path: str = 'data/grades_delta_old.csv') -> pd.DataFrame:
+    return pd.read_csv(csv_path, dtype={'Final': 'int64'})
+
+
+def delta(path: str, df: pd.DataFrame, hash_mode: int, compact: bool) -> pd.DataFrame:
+    new = mch.add_meta_columns(df, mch.create_currents(), KEY_COLUMNS, hash_mode=hash_mode, compact=compact,
+                               **scd.get_record_hash_options(path))
+    return scd.get_delta_by_index(path, new)
+
+
+def file_state(path: str) -> dict:
+    return {file_name: os.path.getmtime(os.path.join(path, file_name)) for file_name in scd.get_store_files(path)}
+
+
+@pytest.mark.parametrize('hash_mode,compact', [(mch.HASH_MODE_MD5, False), (mch.HASH_MODE_FAST64, True)])
+def test_evolve_schema_without_rewrite(tmp_path, hash_mode, compact):
+    path = str(tmp_path)
+    scd.append_parquet_df(delta(path, source(), hash_mode, compact), path,
+                          partitioning=scd.create_partitioning(bucket_count=4))
+    assert scd.get_store_schema(path)['columns']['Final'] == 'int64'
+    files = file_state(path)
+
+    schema = scd.evolve_schema(path, add_columns={'Class': 'str'}, defaults={'Class': 'A'},
+                               widen_columns={'Final': 'float64'})
+    assert schema['version'] == 2 and schema['widened'] == {'Final': 'int64'}
+    # nur das Manifest ändert sich, die Dateien bleiben unverändert
+    assert file_state(path) == files
+    df = scd.read_parquet_df(path)
+    assert df['Final'].dtype == 'float64'
+    assert df['Class'].eq('A').all() and str(df['Class'].dtype) == 'str'
+    assert len(scd.read_parquet_df(path, filters=[('Class', '==', 'A')])) == len(df)
+    assert len(scd.read_parquet_df(path, filters=[('Class', '==', 'B')])) == 0
+
+    # neue Läufe mit Default in der neuen Spalte und verbreitertem Typ sind keine Updates
+    new = source().assign(Class='A', Final=lambda x: x['Final'].astype('float64'))
+    assert len(delta(path, new, hash_mode, compact)) == 0
+    assert len(delta(path, scd.prepare_schema(source(), schema), hash_mode, compact)) == 0
+    assert list(scd.prepare_schema(source(), schema, {'Class': 'C'}, remove_columns=True)['Class'].unique()) == ['C']
+    new.loc[0, 'Class'] = 'B'
+    new.loc[1, 'Final'] = new.loc[1, 'Final'] + 0.5
+    changed = delta(path, new, hash_mode, compact)
+    assert sorted(changed['Lastname']) == sorted(new.loc[[0, 1], 'Lastname'])
+    scd.append_parquet_df(changed, path)
+    assert scd.read_parquet_df(path, filters=[('Class', '==', 'B')])['Lastname'].tolist() == [new.loc[0, 'Lastname']]
+    assert file_state(path).items() >= files.items()
+
+    # entfernte Spalten werden nicht mehr gelesen, ergänzte Spalten mit Default ändern auch dann keinen Hash
+    files = file_state(path)
+    schema = scd.evolve_schema(path, drop_columns=['SSN', 'Class'])
+    assert file_state(path) == files and schema['dropped'] == {'SSN': None, 'Class': 'A'}
+    assert not {'SSN', 'Class'} & set(scd.read_parquet_df(path).columns)
+    assert len(delta(path, source().drop(columns=['SSN']), hash_mode, compact)) == len(source())
+    assert len(delta(path, source().iloc[2:].assign(Class='A'), hash_mode, compact)) == 0
+
+    # zusätzliche Spalten eines Writers werden mit Default None ergänzt
+    extra = source('data/grades_delta_new.csv').assign(Room=1)
+    scd.append_parquet_df(delta(path, extra, hash_mode, compact), path)
+    assert scd.get_store_schema(path)['columns']['Room'] == 'Int64'
+    room = scd.read_parquet_df(path)['Room']
+    assert str(room.dtype) == 'Int64' and room.isna().sum() == len(room) - len(extra)
+
+
+def test_evolve_schema_errors(tmp_path):
+    path = str(tmp_path)
+    with pytest.raises(ValueError):
+        scd.evolve_schema(path, add_columns={'Room': 'int64'})
+    with pytest.raises(ValueError):
+        scd.evolve_schema(path, drop_columns=[mch.META_COLUMNS[mch.COL_RECORD_HASH]])
+    new = mch.add_meta_columns(source(), mch.create_currents(), KEY_COLUMNS)
+    scd.append_parquet_df(new, path)
+    for kwargs in [{'add_columns': {'Grade': 'str'}}, {'drop_columns': ['Room']},
+                   {'widen_columns': {'Test1': 'int64'}}]:
+        with pytest.raises(ValueError):
+            scd.evolve_schema(path, **kwargs)
+    assert scd.get_store_schema(path)['version'] == 1
+
+
+def evolve_scd2(base_path: str):
+    for path in [scd.get_active_path(base_path), scd.get_history_path(base_path)]:
+        scd.evolve_schema(path, add_columns={'Class': 'str'}, defaults={'Class': 'A'})
+
+
+def test_evolve_schema_no_updates_in_load_paths(tmp_path):
+    # jeder Weg, der Metadatenspalten anlegt, übernimmt die Regeln aus dem Schema des Ziels
+    old = 'data/grades_delta_old.csv'
+    new = str(tmp_path / 'new.csv')
+    pd.read_csv(old).assign(Class='A').to_csv(new, index=False)
+    cache_path = str(tmp_path / 'cache')
+    for name, options in [('loads', {}), ('chunked', {'chunk_size': 4}), ('cached', {'hash_cache_path': cache_path})]:
+        path = str(tmp_path / name)
+        with ThreadPoolExecutor(2) as executor:
+            lh.run_loads([lh.create_load(old, path)], KEY_COLUMNS, executor=executor, **options)
+            scd.evolve_schema(path, add_columns={'Class': 'str'}, defaults={'Class': 'A'})
+            res = lh.run_loads([lh.create_load(new, path)], KEY_COLUMNS, executor=executor, **options)
+        assert res[0]['delta_rows'] == 0, name
+
+    base_path = str(tmp_path / 'scd2')
+    currents = mch.create_currents()
+    scd.historize_to_store(hch.add_meta_columns_cached(old, cache_path, currents, KEY_COLUMNS), base_path, currents,
+                           mch.VALID_FROM_MODE_LOAD_DATE)
+    evolve_scd2(base_path)
+    currents = mch.create_currents()
+    new_df = hch.add_meta_columns_cached(new, cache_path, currents, KEY_COLUMNS,
+                                         **scd.get_record_hash_options(scd.get_active_path(base_path)))
+    res = scd.historize_to_store(new_df, base_path, currents, mch.VALID_FROM_MODE_LOAD_DATE)
+    assert res['updated'] == 0 and res['unchanged'] == len(new_df)
+
+    plan = ph.plan_scd2(ph.plan_meta_columns(ph.plan_csv_source(ph.create_plan(), new), KEY_COLUMNS),
+                        mch.VALID_FROM_MODE_LOAD_DATE)
+    plan = ph.plan_store_sink(plan, base_path)
+    for backend in [ph.BACKEND_PANDAS] + ([ph.BACKEND_ARROW] if ph.pa is not None else []):
+        res = ph.run_plan(plan, backend=backend)
+        assert res['updated'] == 0 and res['unchanged'] == len(new_df), backend
@@ -0,0 +1,63 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import src.PandasETLHelpers.MetaColumnHelpers as mch
+import src.PandasETLHelpers.SCDHelpers as scd
+import src.PandasETLHelpers.LoadHelpers as lh
+import src.PandasETLHelpers.SnapshotHelpers as sh
+
+KEY_COLUMNS = ['Lastname', 'Firstname']
+SOURCES = ['data/grades_delta_old.csv', 'data/grades_delta_new.csv', 'data/grades_full_old.csv']
+
+
+def segment_exists(path: str, file_name: str) -> bool:
+    return os.path.exists(os.path.join(path, scd.SNAPSHOT_DIR, file_name + scd.SNAPSHOT_SUFFIX))
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_snapshot_follows_appends(tmp_path, compact):
+    path = str(tmp_path)
+    assert sh.read_snapshot_df(path) is None
+    partitioning = scd.create_partitioning(bucket_count=4, date_column='INSERT_TS')
+    for source in SOURCES:
+        before = set(scd.get_store_files(path)) if os.path.exists(path) else set()
+        new = mch.add_meta_columns(pd.read_csv(source), mch.create_currents(), KEY_COLUMNS, compact=compact)
+        scd.append_parquet_df(scd.get_delta_by_index(path, new), path, partitioning=partitioning)
+        # nur die Dateien des Appends bekommen ein neues Segment
+        assert set(sh.refresh_snapshot(path)) == set(scd.get_store_files(path)) - before
+        pd.testing.assert_frame_equal(sh.read_snapshot_df(path, refresh=False), scd.read_parquet_df(path))
+    pd.testing.assert_frame_equal(sh.read_snapshot_df(path, columns=['Grade', 'Lastname']),
+                                  scd.read_parquet_df(path, columns=['Grade', 'Lastname']))
+
+    files = scd.get_store_files(path)
+    scd.write_parquet_df(scd.read_parquet_df(path), path)
+    assert set(scd.vacuum_store(path)) >= set(files)
+    assert not any(segment_exists(path, file_name) for file_name in files)
+    pd.testing.assert_frame_equal(sh.read_snapshot_df(path), scd.read_parquet_df(path))
+
+
+def test_run_loads_refreshes_snapshot(tmp_path):
+    path = str(tmp_path / 'current')
+    loads = [lh.create_load(source, path) for source in SOURCES]
+    with ThreadPoolExecutor(2) as executor:
+        lh.run_loads(loads, KEY_COLUMNS, executor=executor, snapshot=True)
+    assert all(segment_exists(path, file_name) for file_name in scd.get_store_files(path))
+    assert sh.read_snapshot_table(path, refresh=False).num_rows == len(scd.read_parquet_df(path))
+
+
+def test_snapshot_follows_schema(tmp_path):
+    path = str(tmp_path)
+    new = mch.add_meta_columns(pd.read_csv(SOURCES[0]), mch.create_currents(), KEY_COLUMNS)
+    scd.append_parquet_df(new, path, partitioning=scd.create_partitioning(bucket_count=4))
+    assert set(sh.refresh_snapshot(path)) == set(scd.get_store_files(path))
+    assert sh.refresh_snapshot(path) == []
+    # eine neue Schema-Version baut alle Segmente neu auf, die parquet Dateien bleiben
+    scd.evolve_schema(path, add_columns={'Class': 'str'}, defaults={'Class': 'A'}, drop_columns=['SSN'])
+    assert set(sh.refresh_snapshot(path)) == set(scd.get_store_files(path))
+    pd.testing.assert_frame_equal(sh.read_snapshot_df(path), scd.read_parquet_df(path))
+    assert 'SSN' not in sh.read_snapshot_table(path).column_names